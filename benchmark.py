@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" benchmark.py times thermal performance curve fitting on synthetic curves with known parameters.
+
+For each model, fitting mode and scale it reports fits per second, function evaluations per fit, the restart that found the best fit, peak memory and how well the true parameters were recovered. Curves are generated from a fixed seed and every row records the commit and library versions, so results files from different commits can be compared with --compare.
+
+Example :
+    $ python benchmark.py --curves 100 1000 --modes serial workers -w 4 -o Results/benchmark.csv
+    $ python benchmark.py --curves 100 1000 --modes serial workers -w 4 -o Results/benchmark_new.csv --compare Results/benchmark.csv
+    $ python benchmark.py --imports
+"""
+
+import os
+import sys
+import time
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+import scipy
+import lmfit
+from tpcfit import *
+from pipeline import vals
+
+# Columns identifying a benchmark case (rows with the same values are compared)
+case_cols = ["model_name", "mode", "n_curves", "n_points", "noise", "iter", "workers", "seed"]
+
+# Metrics compared by --compare
+compare_cols = ["fits_per_sec", "nfev_per_fit", "restarts_needed", "peak_rss_mb", "median_error"]
+
+# Import-time budgets in seconds (best of several fresh interpreters). Fitting itself imports lmfit, which takes about a second.
+import_budgets = {"import tpcfit": 0.05,
+                  "from tpcfit import fit_tpc": 0.3,
+                  "from tpcfit import curve_seed, parse_shard": 0.1,
+                  "from tpcfit.service import FitClient": 0.3,
+                  "import pipeline": 1.0}
+
+def bench_arrays(curve_id, temps, traits, model_name=None, iter=5, seed=0):
+    """ Fit one synthetic curve with a known model
+
+    Parameters
+    ----------
+    curve_id: str
+        originalid of the curve
+    temps: numpy array
+        Temperature values in Kelvin
+    traits: numpy array
+        Trait values
+    model_name: str
+        Model to fit
+    iter: int
+        Number of random restarts
+    seed: int
+        Base random seed
+
+    Returns
+    -------
+    result: dict
+        Total function evaluations, restarts run, restart that found the best fit, parameter estimates and the peak memory of the process
+    """
+    np.random.seed(curve_seed(curve_id, seed))
+    best_mod = resample_model(model_name, vals=vals, temps=temps, traits=traits, iter=iter)
+    result = {"originalid": curve_id, "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    if best_mod is None:
+        return result
+    result["nfev"] = best_mod.nfev_total
+    result["restart"] = best_mod.restart
+    result.update(best_mod.final_estimates)
+    return result
+
+def bench_curve(curve_id, dataset, **kwargs):
+    """ bench_arrays for a curve given as a DataFrame """
+    return bench_arrays(curve_id, dataset["interactor1K"].values, dataset["standardisedtraitvalue"].values, **kwargs)
+
+class PeakMemory(object):
+    """ Sample the resident memory of this process in a background thread and keep the peak """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+
+    def _rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (IOError, ValueError):
+            # Not linux: the lifetime peak is the best we can do
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+def run_case(model_name, mode, n_curves, n_points=10, noise=0.1, iter=5, workers=1, seed=0):
+    """ Generate synthetic curves, fit them and summarise speed and accuracy
+
+    Parameters
+    ----------
+    model_name: str
+        Model used to generate and fit the curves
+    mode: str
+        "serial", "workers" (CurveScheduler) or "shared" (CurveScheduler with shared memory)
+    n_curves: int
+        Number of curves
+    n_points: int
+        Points per curve
+    noise: float
+        Standard deviation of the noise on the log trait values
+    iter: int
+        Number of random restarts
+    workers: int
+        Number of worker processes (ignored in serial mode)
+    seed: int
+        Random seed for the curves and the starting parameters
+
+    Returns
+    -------
+    summary: dict
+        Case settings and metrics
+    """
+    with PeakMemory() as memory:
+        data, truth = synthetic_curves(n_curves, model_name, n_points=n_points, noise=noise, seed=seed)
+        datasets = synthetic_datasets(data)
+
+        start = time.perf_counter()
+        if mode == "serial":
+            workers = 1
+            results = [bench_curve(curve_id, dataset, model_name=model_name, iter=iter, seed=seed) for curve_id, dataset in datasets.items()]
+        elif mode in ("workers", "shared"):
+            scheduler = CurveScheduler(bench_arrays if mode == "shared" else bench_curve, workers=workers, iter=iter, shared=mode == "shared", model_name=model_name, seed=seed)
+            results = scheduler.run(datasets)
+        else:
+            raise ValueError("Unknown mode '{}'".format(mode))
+        wall = time.perf_counter() - start
+
+    results = pd.DataFrame(results).set_index("originalid")
+    fitted = results["nfev"].notna() if "nfev" in results.columns else pd.Series(False, index=results.index)
+    errors = recovery_error(results.loc[fitted], truth)
+
+    summary = {"model_name": model_name, "mode": mode, "n_curves": n_curves, "n_points": n_points, "noise": noise,
+               "iter": iter, "workers": workers, "seed": seed,
+               "wall": wall,
+               "fits_per_sec": fitted.sum() / wall,
+               "failed": 1 - fitted.mean(),
+               "nfev_per_fit": (results.loc[fitted, "nfev"] / iter).mean() if fitted.any() else np.nan,
+               "restarts_needed": results.loc[fitted, "restart"].mean() if fitted.any() else np.nan,
+               "peak_rss_mb": memory.peak / 2 ** 20,
+               "worker_rss_mb": results["maxrss_kb"].max() / 1024 if mode != "serial" else np.nan,
+               "median_error": np.nanmedian(errors[[col for col in errors.columns if col not in ("Th", "Tl")]].to_numpy())}
+    for col in errors.columns:
+        summary["err_" + col] = errors[col].median()
+    return summary
+
+def import_times(budgets=import_budgets, repeat=5, scale=1.0):
+    """ Time import statements in fresh interpreters and check them against a budget
+
+    Parameters
+    ----------
+    budgets: dict
+        Import statement -> budget in seconds
+    repeat: int
+        Number of fresh interpreters per statement (the fastest is kept)
+    scale: float
+        Multiply every budget by this (e.g. for slower machines)
+
+    Returns
+    -------
+    times: pandas DataFrame
+        Seconds, budget and whether it was met for each statement
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([here, os.environ.get("PYTHONPATH", "")]))
+    rows = []
+    for statement, budget in budgets.items():
+        code = "import time; t = time.perf_counter(); exec({!r}); print(time.perf_counter() - t)".format(statement)
+        times = [float(subprocess.run([sys.executable, "-W", "ignore", "-c", code], capture_output=True, text=True, check=True, cwd=here, env=env).stdout)
+                 for _ in range(repeat)]
+        rows.append({"statement": statement, "seconds": min(times), "budget": budget * scale, "ok": min(times) <= budget * scale})
+    return pd.DataFrame(rows)
+
+def environment():
+    """ Commit and library versions recorded with every result """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "scipy": scipy.__version__, "lmfit": lmfit.__version__, "cpus": os.cpu_count()}
+
+def compare(results, baseline):
+    """ Compare results with a baseline from another commit
+
+    Parameters
+    ----------
+    results: pandas DataFrame
+        Benchmark results
+    baseline: pandas DataFrame
+        Earlier benchmark results
+
+    Returns
+    -------
+    comparison: pandas DataFrame
+        Ratio (new / baseline) of each metric for every case in both
+    """
+    merged = results.merge(baseline, on=case_cols, suffixes=("", "_base"))
+    comparison = merged[case_cols].copy()
+    for col in compare_cols:
+        comparison[col] = merged[col] / merged[col + "_base"]
+    comparison["commits"] = merged["commit_base"].astype(str) + ".." + merged["commit"].astype(str)
+    return comparison
+
+def main():
+    """ Entry point of main script"""
+    # Check import times instead of fitting
+    if args.imports:
+        times = import_times(scale=args.budget_scale)
+        print(times.to_string(index=False))
+        if args.output is not None:
+            times.assign(**environment()).to_csv(args.output, index=False)
+        sys.exit(0 if times["ok"].all() else 1)
+
+    env = environment()
+    rows = []
+    for n_curves in args.curves:
+        for model_name in args.models:
+            for mode in args.modes:
+                summary = run_case(model_name, mode, n_curves, n_points=args.points, noise=args.noise, iter=args.iter, workers=args.workers, seed=args.seed)
+                summary.update(env)
+                rows.append(summary)
+                print("{model_name:>16} {mode:>7} {n_curves:>7} curves: {fits_per_sec:8.1f} fits/s, {nfev_per_fit:7.1f} nfev/fit, "
+                      "best at restart {restarts_needed:.2f}, {peak_rss_mb:.0f} MB, median error {median_error:.3f}".format(**summary))
+                sys.stdout.flush()
+
+    results = pd.DataFrame(rows)
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
+
+    if args.compare is not None:
+        comparison = compare(results, pd.read_csv(args.compare, dtype={"commit": str}))
+        with pd.option_context("display.width", 200, "display.max_columns", 20):
+            print(comparison)
+
+if __name__ == "__main__":
+    # Assign a description to help doc
+    parser = argparse.ArgumentParser(description="Benchmark curve fitting on synthetic curves with known parameters")
+
+    parser.add_argument("--curves",
+                        type=int,
+                        nargs="+",
+                        help="Number of curves (several values run several scales)",
+                        required=False,
+                        default=[100])
+    parser.add_argument("--models",
+                        type=str,
+                        nargs="+",
+                        help="Models to generate and fit",
+                        required=False,
+                        default=list(synthetic_models))
+    parser.add_argument("--modes",
+                        type=str,
+                        nargs="+",
+                        choices=["serial", "workers", "shared"],
+                        help="Fitting modes",
+                        required=False,
+                        default=["serial"])
+    parser.add_argument("--points",
+                        type=int,
+                        help="Points per curve",
+                        required=False,
+                        default=10)
+    parser.add_argument("--noise",
+                        type=float,
+                        help="Standard deviation of the noise on the log trait values",
+                        required=False,
+                        default=0.1)
+    parser.add_argument("--iter",
+                        type=int,
+                        help="Number of random restarts per curve",
+                        required=False,
+                        default=5)
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        help="Number of worker processes in workers and shared modes",
+                        required=False,
+                        default=os.cpu_count())
+    parser.add_argument("--seed",
+                        type=int,
+                        help="Random seed",
+                        required=False,
+                        default=0)
+    parser.add_argument("--imports",
+                        action="store_true",
+                        help="Check import times against their budgets instead of fitting (exits with 1 if any is over)")
+    parser.add_argument("--budget-scale",
+                        type=float,
+                        help="Multiply the import-time budgets by this (e.g. on slower machines)",
+                        required=False,
+                        default=1.0)
+    parser.add_argument("-o", "--output",
+                        type=str,
+                        help="Path of the results csv",
+                        required=False,
+                        default=None)
+    parser.add_argument("--compare",
+                        type=str,
+                        help="Results csv of an earlier run to compare with",
+                        required=False,
+                        default=None)
+
+    args = parser.parse_args()
+    main()
@@ -4,12 +4,19 @@
 import numpy as np
 import pandas as pd
 import sys
+from tpcfit.streaming import complete_curves
 
 """
 Example :
     $ python Data_clean.py file2clean.csv
 """
 
+# Seconds in a day, for converting s^-1 trait values to d^-1
+SECONDS_PER_DAY = 60 * 60 * 24
+
+# Number of rows cleaned at a time
+CHUNKSIZE = 500000
+
 def celcius2kelvin(data, temps_col, is_celcius):
     """Replaces temperature units in celcius to Kelvin
 
@@ -30,7 +37,7 @@ def celcius2kelvin(data, temps_col, is_celcius):
 
     return data
 
-def convert_traits(data, traits_col, temp_conversion):
+def convert_traits(data, traits_col, temp_conversion=SECONDS_PER_DAY):
     """Converts s^-1 trait values to d^-1
     Parameters
     ----------
@@ -46,29 +53,135 @@ def convert_traits(data, traits_col, temp_conversion):
 
     return data
 
-def rm_negative_vals(data):
+def shift_positive(values, codes):
+    """Shifts each curve so its minimum value is just above zero (if it isn't already)
+
+    Parameters
+    ----------
+    values : numpy array of temperature or trait values
+    codes: numpy array of integer curve codes (from pd.factorize)
+
+    Returns
+    -------
+    values : new array with 0 or negative values shifted per curve
+    """
+    # Per-curve minimum broadcast back to every row
+    mins = pd.Series(values).groupby(codes, sort=False).transform("min").to_numpy()
+    return values - np.where(mins <= 0, mins - 10E-10, 0)
+
+def count_unique_temps(temps, codes):
+    """Counts the number of unique temperatures in each curve
+
+    Parameters
+    ----------
+    temps : numpy array of temperature values
+    codes: numpy array of integer curve codes (from pd.factorize)
+
+    Returns
+    -------
+    unique_temps : array with the count for each row's curve (NaN temperatures aren't counted)
+    """
+    pairs = pd.DataFrame({"codes": codes, "temps": temps})
+    # A missing temperature isn't a temperature (as in nunique)
+    pairs = pairs.loc[pairs["temps"].notna()].drop_duplicates()
+    counts = np.bincount(pairs["codes"].to_numpy(), minlength=codes.max() + 1 if len(codes) else 0)
+    return counts[codes]
+
+def rm_negative_vals(data, id_col=None):
     """Removes 0 or negative values
 
     Parameters
     ----------
     data : dataframe to be cleaned
+    id_col: column of curve ids. If given, each curve is shifted separately,
+        otherwise the whole column is shifted.
 
     Returns
     -------
-    data : new dataframe with converted units in Kelvin
+    data : new dataframe without 0 or negative temperature or trait values
     """
-    min_temp_val  = data['temps'].min()
-    min_trait_val  = data['traits'].min()
+    if id_col is None:
+        codes = np.zeros(len(data), dtype=np.intp)
+    else:
+        codes = pd.factorize(data[id_col])[0]
 
     # Get rid of 0s for temps and traits columns
-    if min_trait_val <= 0:
-        data['traits'] -= min_trait_val - 10E-10
+    data['traits'] = shift_positive(data['traits'].to_numpy(dtype=np.float64), codes)
+    data['temps'] = shift_positive(data['temps'].to_numpy(dtype=np.float64), codes)
+
+    return data
 
-    if min_temp_val <= 0:
-        data['temps'] -= min_temp_val - 10E-10
+def unique_temps(data, id_col):
+    """Gets the number of unique temperatures for each curve
+
+    Parameters
+    ----------
+    data : dataframe to be cleaned
+    id_col: column of curve ids
+
+    Returns
+    -------
+    data : new dataframe with unique_temps column
+    """
+    data['unique_temps'] = count_unique_temps(data['temps'].to_numpy(), pd.factorize(data[id_col])[0])
 
     return data
 
+def clean_data(data, id_col, temps_col, traits_col, is_celcius=True, temp_conversion=SECONDS_PER_DAY):
+    """Runs every cleaning step on a dataframe in one vectorized pass
+
+    Converts temperatures to Kelvin, traits from s^-1 to d^-1, shifts 0 or
+    negative values per curve and counts unique temperatures per curve.
+    Rows without a curve id are dropped.
+
+    Parameters
+    ----------
+    data : dataframe to be cleaned
+    id_col: column of curve ids
+    temps_col: column of temperature values
+    traits_col: column of trait values
+    is_celcius: boolean
+    temp_conversion: 60 * 60 * 24
+
+    Returns
+    -------
+    data : new dataframe with "temps", "traits" and "unique_temps" columns
+    """
+    data = data.loc[data[id_col].notna()]
+
+    # Integer code for each curve, shared by all grouped operations
+    codes = pd.factorize(data[id_col])[0]
+
+    temps = data[temps_col].to_numpy(dtype=np.float64)
+    if is_celcius:
+        temps = temps + 273.15
+    traits = data[traits_col].to_numpy(dtype=np.float64) * temp_conversion
+
+    temps = shift_positive(temps, codes)
+    traits = shift_positive(traits, codes)
+
+    return data.assign(temps=temps, traits=traits, unique_temps=count_unique_temps(temps, codes))
+
+def clean_chunks(chunks, id_col, **kwargs):
+    """Cleans a stream of dataframe chunks (e.g. from pd.read_csv(chunksize=...))
+
+    Chunks are regrouped by tpcfit.streaming.complete_curves, so per-curve
+    steps see whole curves. Each curve's rows must be contiguous in the input,
+    otherwise a tpcfit.streaming.StreamingException (a ValueError) is raised.
+
+    Parameters
+    ----------
+    chunks : iterable of dataframes
+    id_col: column of curve ids
+    kwargs: passed to clean_data
+
+    Yields
+    ------
+    data : cleaned dataframe chunks
+    """
+    for chunk in complete_curves(chunks, id_col):
+        yield clean_data(chunk, id_col, **kwargs)
+
 def main():
 
     # Check whether an input file has been provided
@@ -80,30 +193,23 @@ def main():
         print("Using input data")
 
     # Assign relevant columns
-    trait_name_col = 'StandardisedTraitName'
-    temps_col = 'ConTemp' # i.e.x values
-    traits_col = 'StandardisedTraitValue' # i.e. y values
+    id_col = 'originalid'
+    temps_col = 'interactor1temp' # i.e.x values
+    traits_col = 'standardisedtraitvalue' # i.e. y values
 
     # Is the temperature in kelvin or celcius?
     is_celcius = True
 
-    # Read in data
-    data = pd.read_csv(file, low_memory=False)
-
-    # Convert temperature in celcius to kelvin
-    data = celcius2kelvin(data, temps_col, is_celcius)
-    print("Converting temperatures...")
-
-    # Convert traits in s^-1 to d^-1
-    data = convert_traits(data, traits_col, temp_conversion)
-    print("Converting traits...")
+    # Read in data in chunks
+    chunks = pd.read_csv(file, low_memory=False, chunksize=CHUNKSIZE)
 
-    # Remove any negative values
-    data = rm_negative_vals(data)
-    print("Removing negative values...")
+    # Convert temperatures and traits, remove negative values and count unique temperatures
+    print("Cleaning data...")
+    cleaned = clean_chunks(chunks, id_col, temps_col=temps_col, traits_col=traits_col, is_celcius=is_celcius)
 
     # Export clean data to results folder
-    data.to_csv("Results/CleanData.csv", index = False)
+    for i, chunk in enumerate(cleaned):
+        chunk.to_csv("Results/CleanData.csv", index = False, mode = "w" if i == 0 else "a", header = i == 0)
     print("Done!")
 
 if __name__ == "__main__":
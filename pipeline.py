@@ -1,14 +1,449 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import argparse
+import csv
+import sys
+import time
+import functools
 import numpy as np
 import pandas as pd
-from scipy.stats import truncnorm
-from lmfit import Minimizer, minimize, Parameters, report_fit
-from tpcfit import *
-import matplotlib.pyplot as plt
+from tpcfit import (ResultsStore, fit_tpc, refit_tpc, get_datasets, CurveScheduler, StreamingPipeline, complete_curves, ProgressReporter,
+                    curve_seed, parse_shard, select_shard, write_manifest, merge_shards, metrics_table, hot_curves, TemplateLibrary,
+                    load_templates, template_params, group_cols, group_curves, WarmStarts, model_funcs, registered_models,
+                    plot_formats, plot_fits, fit_batched)
+from data_wrang import clean_data
 np.seterr(divide='ignore', invalid='ignore')
 
+# Create dictionary of starting parameters
+vals = {"B0": [0.05, 1.2], "E": [0.05, 0.85],
+        "Eh": [0.5, 1.2],"El": [0.05, 0.7],
+        "Th": [273.15, 330], "Tl": [273.15, 330]}
+
+# Fit columns written after the curve metadata (followed by the parameter estimates)
+result_cols = ("screen", "model_name", "fit_time", "aic", "timed_out", "nfev", "nfev_total", "n_points")
+
+def result_columns(input_cols):
+    """ Columns of the results csv when they can't be taken from the fits (streamed or empty results)
+
+    Parameters
+    ----------
+    input_cols: list
+        Columns of the input data
+
+    Returns
+    -------
+    columns: list
+        Curve metadata, fit columns and the estimates of every Schoolfield model (or of the declared --model)
+    """
+    metadata_cols = ["originalid"] + [col for col in ResultsStore.text_cols if col in input_cols and col != "originalid"]
+    param_cols = list(registered_models[args.model].param_names) if args.model in registered_models else list(vals)
+    return metadata_cols + list(result_cols) + param_cols + (["refit"] if args.refit else [])
+
+def curve_metadata(curve_id, dataset):
+    """ Collect the descriptive columns of a single curve
+
+    Parameters
+    ----------
+    curve_id: str
+        originalid of the curve
+    dataset: pandas DataFrame
+        Rows of a single curve (as returned by get_datasets)
+
+    Returns
+    -------
+    metadata: dict
+        originalid, trait name, kingdom etc.
+    """
+    metadata = {col: dataset[col].iloc[0] for col in ResultsStore.text_cols if col in dataset.columns}
+    metadata["originalid"] = curve_id
+    return metadata
+
+# Results stores opened by previous_fit in this process: path -> ResultsStore
+_stores = {}
+
+def previous_fit(db, curve_id):
+    """ Latest stored fit of a curve
+
+    Parameters
+    ----------
+    db: str
+        Path of a SQLite results store (opened once per process)
+    curve_id: str
+        originalid of the curve
+
+    Returns
+    -------
+    previous: dict
+        Latest row of the curve with a model and AIC, or None if it has never been fitted
+    """
+    if db not in _stores:
+        _stores[db] = ResultsStore(db)
+    store = _stores[db]
+    if "aic" not in store.columns:
+        return None
+    rows = store.query(originalid=str(curve_id), order_by="rowid")
+    rows = rows.loc[rows["model_name"].notna() & rows["aic"].notna()]
+    if len(rows) == 0:
+        return None
+    return rows.iloc[-1].to_dict()
+
+def stored_fit(previous):
+    """ Reuse a stored fit as the result of a curve that has no new points
+
+    Parameters
+    ----------
+    previous: dict
+        Row returned by previous_fit
+
+    Returns
+    -------
+    result: dict
+        Fit columns and estimates of the stored row, with refit set to "unchanged". Raises ValueError if its model no longer exists.
+    """
+    params = model_funcs(previous["model_name"])[1]()
+    result = {col: previous.get(col) for col in list(result_cols) + list(params.keys())}
+    result = {col: None if pd.isna(value) else value for col, value in result.items()}
+    # SQLite keeps the flag as text and the counts as REAL
+    result["timed_out"] = str(result["timed_out"]) in ("1", "True")
+    for col in ("nfev", "nfev_total", "n_points"):
+        if result[col] is not None:
+            result[col] = int(result[col])
+    result["refit"] = "unchanged"
+    return result
+
+def fit_arrays(curve_id, temps, traits, unique_temps=None, iter=5, timeout=None, curve_timeout=None, seed=0, metrics=False, templates=None, n_templates=3, warm_starts=None, refit=None, model_name=None):
+    """ Screen and fit a single thermal performance curve
+
+    Parameters
+    ----------
+    curve_id: str
+        originalid of the curve
+    temps: numpy array
+        Temperature values in Kelvin
+    traits: numpy array
+        Trait values
+    unique_temps: int, optional
+        Number of unique temperatures (counted if not given)
+    iter: int
+        Number of random restarts
+    timeout: float
+        Wall-clock budget in seconds for each fit
+    curve_timeout: float
+        Wall-clock budget in seconds for all restarts of the curve
+    seed: int
+        Base random seed. Each curve's starting parameters are drawn from a seed derived from its originalid, so results don't depend on shard, worker or order.
+    metrics: bool
+        Return the fit record of every restart under the "metrics" key
+    templates: str, optional
+        Path of a template library (see tpcfit.templates) to start from the fits of the most similar curves. The curve's arrays are returned under the "template" key if it fitted, to be added to the library.
+    n_templates: int
+        Number of restarts started from template fits, each one that converges replacing one of the iter random restarts
+    warm_starts: WarmStarts, optional
+        Estimates of the previous fit in the curve's group to start from (see tpcfit.grouping)
+    refit: str, optional
+        Path of a results store. Curves fitted before are refitted from their latest stored fit (see refit_tpc), or keep it if they have no new points.
+    model_name: str, optional
+        Model to fit to every curve, e.g. one declared in tpcfit.registry (default: chosen per curve by screening)
+
+    Returns
+    -------
+    result: dict
+        Model name, screening reason code, AIC and parameter estimates
+    """
+    records = [] if metrics else None
+    library = load_templates(templates) if templates is not None else None
+    result = {"originalid": curve_id}
+    previous = previous_fit(refit, curve_id) if refit is not None else None
+    if previous is not None:
+        try:
+            if pd.notna(previous.get("n_points")) and len(temps) == previous["n_points"]:
+                # No new points since the stored fit, so reuse it
+                result.update(stored_fit(previous))
+            else:
+                result.update(refit_tpc(temps, traits, vals, previous, iter=iter, timeout=timeout, curve_timeout=curve_timeout, seed=curve_seed(curve_id, seed), metrics=records, curve_id=curve_id))
+        except ValueError:
+            # Unusable stored fit, e.g. of a model that no longer exists
+            previous = None
+    if previous is None:
+        result.update(fit_tpc(temps, traits, vals, model_name=model_name, unique_temps=unique_temps, iter=iter, timeout=timeout, curve_timeout=curve_timeout, seed=curve_seed(curve_id, seed), metrics=records, curve_id=curve_id, templates=library, n_templates=n_templates, warm_starts=warm_starts))
+    if metrics:
+        result["metrics"] = records
+    if templates is not None and result.get("aic") is not None and not result.get("timed_out"):
+        result["template"] = (temps, traits)
+
+    return result
+
+def fit_curve(curve_id, dataset, iter=5, timeout=None, curve_timeout=None, seed=0, metrics=False, templates=None, n_templates=3, warm_starts=None, refit=None, model_name=None):
+    """ Fit a single thermal performance curve
+
+    Parameters
+    ----------
+    curve_id: str
+        originalid of the curve
+    dataset: pandas DataFrame
+        Rows of a single curve (as returned by get_datasets)
+    iter: int
+        Number of random restarts
+    timeout: float
+        Wall-clock budget in seconds for each fit
+    curve_timeout: float
+        Wall-clock budget in seconds for all restarts of the curve
+    seed: int
+        Base random seed
+    metrics: bool
+        Return the fit record of every restart under the "metrics" key
+    templates: str, optional
+        Path of a template library to start from
+    n_templates: int
+        Number of restarts started from template fits, each one that converges replacing one of the iter random restarts
+    warm_starts: WarmStarts, optional
+        Estimates of the previous fit in the curve's group to start from
+    refit: str, optional
+        Path of a results store to refit curves from their latest stored fit
+    model_name: str, optional
+        Model to fit (default: chosen by screening)
+
+    Returns
+    -------
+    result: dict
+        Curve metadata, model name, screening reason code, AIC and parameter estimates
+    """
+
+    # Get temperature and trait values
+    temps, traits = np.array(dataset["interactor1K"]), np.array(dataset["standardisedtraitvalue"])
+    unique_temps = dataset["unique_temps"].iloc[0] if "unique_temps" in dataset.columns else None
+
+    result = curve_metadata(curve_id, dataset)
+    result.update(fit_arrays(curve_id, temps, traits, unique_temps, iter=iter, timeout=timeout, curve_timeout=curve_timeout, seed=seed, metrics=metrics, templates=templates, n_templates=n_templates, warm_starts=warm_starts, refit=refit, model_name=model_name))
+
+    return result
+
+def fit_group(group_id, group, **kwargs):
+    """ Fit the curves of a group of related curves in order, each starting from the group's previous fit
+
+    Parameters
+    ----------
+    group_id: str
+        Key of the group (see tpcfit.grouping)
+    group: pandas DataFrame
+        Rows of the group's curves, one curve after another in fitting order
+    kwargs: keyword arguments
+        Passed to fit_curve
+
+    Returns
+    -------
+    results: list of dicts
+        fit_curve result of every curve
+    """
+    warm_starts = WarmStarts()
+    return [fit_curve(curve_id, dataset, warm_starts=warm_starts, **kwargs) for curve_id, dataset in group.groupby("originalid", sort=False)]
+
+def clean_input(data):
+    """ Convert temperatures to Kelvin and traits to d^-1 with data_wrang, and use them for fitting
+
+    Parameters
+    ----------
+    data: pandas DataFrame
+        Raw rows of whole curves
+
+    Returns
+    -------
+    data: pandas DataFrame
+        Cleaned rows, with interactor1K and standardisedtraitvalue replaced by the cleaned values
+    """
+    data = clean_data(data, "originalid", temps_col="interactor1temp", traits_col="standardisedtraitvalue")
+    return data.assign(interactor1K=data["temps"], standardisedtraitvalue=data["traits"])
+
+def stream_curves(chunks, ids=None, shard=None, clean=False):
+    """ Clean stage of the streaming pipeline: split input chunks into curves
+
+    Parameters
+    ----------
+    chunks: iterable of pandas DataFrames
+        Input chunks (each curve's rows must be contiguous)
+    ids: list, optional
+        Only keep these originalids
+    shard: tuple, optional
+        (shard, n_shards) to keep
+    clean: bool
+        Clean the data with data_wrang first
+
+    Yields
+    ------
+    curve_id: str
+        originalid of the curve
+    dataset: pandas DataFrame
+        Rows of the curve (as returned by get_datasets)
+    """
+    for data in complete_curves(chunks):
+        if ids is not None:
+            data = data.loc[data["originalid"].isin(ids)]
+        if shard is not None:
+            data = select_shard(data, *shard)
+        if len(data) == 0:
+            continue
+        if clean:
+            data = clean_input(data)
+        yield from get_datasets(data).items()
+
+class ResultsWriter(object):
+    """ Write stage of the streaming pipeline: append results to a csv (and optionally a results store) as they arrive """
+
+    def __init__(self, output, columns, db=None, batch_size=1000, metrics=None):
+        """
+        Parameters
+        ----------
+        output: str
+            Path of the results csv
+        columns: list
+            Columns of the results csv
+        db: str, optional
+            Path of a SQLite results store to append fits to
+        batch_size: int
+            Number of results inserted into the store at a time
+        metrics: str, optional
+            Path of a csv for the fit records of every restart (see tpcfit.instrumentation)
+        """
+        self.output = output
+        self.columns = columns
+        self.db = db
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.ids = []
+        self.records = []
+        self.templates = []
+        self._file = None
+        self._store = None
+        self._pending = []
+
+    def _open(self):
+        self._file = open(self.output, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, self.columns, restval="", lineterminator="\n")
+        self._writer.writeheader()
+        if self.db is not None:
+            self._store = ResultsStore(self.db)
+
+    def __call__(self, result):
+        # Opened on first use, so the file and database connection belong to the writer thread
+        if self._file is None:
+            self._open()
+        self.records.extend(result.pop("metrics", None) or [])
+        if "template" in result:
+            self.templates.append((result, result.pop("template")))
+        self._writer.writerow({k: "" if v is None else v for k, v in result.items()})
+        self.ids.append(result["originalid"])
+        if self._store is not None:
+            self._pending.append(result)
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._store.insert(pd.DataFrame(self._pending))
+            self._pending = []
+
+    def close(self):
+        """ Flush and close the csv and results store, and write the metrics table """
+        # A header-only csv when there were no curves (e.g. an empty shard)
+        if self._file is None:
+            self._open()
+        if self.metrics is not None:
+            metrics_table(self.records).to_csv(self.metrics, index=False)
+        if self._store is not None:
+            self._flush()
+            self._store.close()
+        if self._file is not None:
+            self._file.close()
+
+def run_streaming(progress, shard=None):
+    """ Fit every curve with reading, cleaning, fitting and writing running concurrently
+
+    Parameters
+    ----------
+    progress: ProgressReporter
+        Started progress reporter (the number of curves isn't known in advance, so there is no ETA)
+    shard: tuple, optional
+        (shard, n_shards) to fit
+
+    Returns
+    -------
+    writer: ResultsWriter
+        The write stage (with the ids of every fitted curve)
+    """
+    # Fixed csv columns, since results are written before every curve has been seen
+    header = pd.read_csv(args.input, nrows=0).columns
+    writer = ResultsWriter(args.output, result_columns(header), db=args.db, metrics=args.metrics)
+
+    streaming = StreamingPipeline(read=functools.partial(pd.read_csv, args.input, chunksize=args.chunksize),
+                                  clean=functools.partial(stream_curves, ids=args.ids, shard=shard, clean=args.clean),
+                                  fit_func=progress.wrap(functools.partial(fit_curve, **fit_kwargs())),
+                                  write=writer, workers=args.workers, queue_size=args.queue_size)
+    n_results = streaming.run()
+    for line in streaming.summary():
+        print(line)
+    print("{} fits written to {}".format(n_results, args.output))
+    if args.metrics is not None:
+        print(hot_curves(metrics_table(writer.records)))
+    update_templates(writer.templates)
+    return writer
+
+def run_grouped(datasets, progress):
+    """ Fit curves group by group, each curve starting from the previous fit of its group
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    progress: ProgressReporter
+        Started progress reporter (counting groups)
+
+    Returns
+    -------
+    results: list of dicts
+        fit_curve result of every curve, in the order of datasets
+    """
+    groups = group_curves(datasets, by=args.group_by)
+    group_data = {key: pd.concat([datasets[curve_id] for curve_id in ids]) for key, ids in groups.items()}
+    if args.workers > 1:
+        # Groups are scheduled as a whole, largest first
+        scheduler = CurveScheduler(progress.wrap(fit_group), workers=args.workers, **fit_kwargs())
+        fits = scheduler.run(group_data)
+        print(scheduler.utilization)
+    else:
+        fit = progress.wrap(fit_group)
+        fits = [fit(key, data, **fit_kwargs()) for key, data in group_data.items()]
+    results = {result["originalid"]: result for group_results in fits for result in group_results}
+    warm = sum(bool(result.get("warm_start")) for result in results.values())
+    print("{} curves in {} groups, {} fitted from their group's previous fit".format(len(results), len(groups), warm))
+    return [results[curve_id] for curve_id in datasets]
+
+def update_templates(fits):
+    """ Add this run's fits to the --templates library (unless --freeze-templates is given)
+
+    Parameters
+    ----------
+    fits: list of tuples
+        (result, (temps, traits)) of every curve that fitted
+    """
+    if args.templates is None or args.freeze_templates:
+        return
+    library = TemplateLibrary.load(args.templates)
+    # Templates are kept for the screened (Schoolfield) models only
+    added = sum(library.add(result["originalid"], result["model_name"], temps, traits, result) for result, (temps, traits) in fits if result["model_name"] in template_params)
+    library.save(args.templates)
+    print("{} fits added to {} ({} curves)".format(added, args.templates, len(library)))
+
+def fit_kwargs():
+    """ Keyword arguments of fit_curve and fit_arrays from the command line options """
+    return {"iter": args.iter, "timeout": args.timeout, "curve_timeout": args.curve_timeout, "seed": args.seed,
+            "metrics": args.metrics is not None, "templates": args.templates, "n_templates": args.neighbours,
+            "refit": args.db if args.refit else None, "model_name": args.model}
+
+def progress_reporter(total=None):
+    """ Progress reporter for the command line options (silent unless --progress or --events is given) """
+    return ProgressReporter(total=total, events=args.events, interval=args.progress if args.progress is not None else 10.0,
+                            stream=sys.stderr if args.progress is not None else None)
+
 def main():
     """ Entry point of main script"""
     # Boltzmann constant
@@ -18,41 +453,126 @@ def main():
     global Tref
     Tref = 273.15
 
-    # Read data
-    data = pd.read_csv(args.input)
-
-    eg = ["MTD4538"]
+    # Merge shard results instead of fitting
+    if args.merge is not None:
+        n_curves = merge_shards(args.merge, args.output)
+        print("{} curves from {} shards merged into {}".format(n_curves, len(args.merge), args.output))
+        return
 
-    data = data.loc[data["originalid"].isin(eg)]
+    if args.refit and args.db is None:
+        raise ValueError("--refit needs the results store of the previous fits (--db)")
+    if args.model is not None:
+        # Raises ValueError for unknown models
+        model_funcs(args.model)
 
-    # Create dictionary of starting parameters
-    vals = {"B0": [0.05, 1.2], "E": [0.05, 0.85],
-            "Eh": [0.5, 1.2],"El": [0.05, 0.7],
-            "Th": [273.15, 330], "Tl": [273.15, 330]}
+    # Overlap reading, cleaning, fitting and writing
+    if args.stream:
+        if args.shared or args.memmap is not None:
+            raise ValueError("--stream can't be combined with --shared or --memmap")
+        if args.grouped:
+            raise ValueError("--stream can't be combined with --grouped")
+        if args.plots is not None:
+            raise ValueError("--stream can't be combined with --plots (curves aren't kept after fitting)")
+        shard = parse_shard(args.shard) if args.shard is not None else None
+        with progress_reporter() as progress:
+            writer = run_streaming(progress, shard)
+        if shard is not None:
+            write_manifest(args.output, shard[0], shard[1], writer.ids)
+        return
 
+    # Read data
+    data = pd.read_csv(args.input)
+    if args.clean:
+        data = clean_input(data)
 
-    # Get temperature and trait values
-    temps, traits = np.array(data["interactor1K"]), np.array(data["standardisedtraitvalue"])
+    if args.ids is not None:
+        data = data.loc[data["originalid"].isin(args.ids)]
 
-    #initialise parameter object
-    params = ssf_init()
+    # Only fit this shard's curves
+    if args.shard is not None:
+        shard, n_shards = parse_shard(args.shard)
+        data = select_shard(data, shard, n_shards)
 
-    # Get randomly sampled params
-    new_params = StartParams(params, vals)
+    # Create dictionary of TPCs
+    datasets = get_datasets(data)
 
-    # Fit model
-    model = SharpeSchoolfieldFull(temps=temps, traits=traits, fit_pars=new_params)
+    # Fit model to every curve
+    if args.batched:
+        unsupported = {"--grouped": args.grouped, "--shared": args.shared, "--memmap": args.memmap is not None, "--refit": args.refit,
+                       "--templates": args.templates is not None, "--timeout": args.timeout is not None,
+                       "--curve-timeout": args.curve_timeout is not None, "--metrics": args.metrics is not None,
+                       "--progress": args.progress is not None, "--events": args.events is not None}
+        unsupported = [option for option, used in unsupported.items() if used]
+        if unsupported:
+            raise ValueError("--batched can't be combined with {}".format(", ".join(unsupported)))
+        # Curves are fitted in lockstep batches, so there is no per-curve progress to report
+        progress = None
+        # Raises BatchedException for models other than the Schoolfield models
+        fits = fit_batched(datasets, vals, model_name=args.model, iter=args.iter, seed=args.seed)
+        results = []
+        for curve_id, fit in zip(datasets.keys(), fits):
+            result = curve_metadata(curve_id, datasets[curve_id])
+            result.update(fit)
+            results.append(result)
+    elif args.grouped:
+        if args.shared or args.memmap is not None:
+            raise ValueError("--grouped can't be combined with --shared or --memmap")
+        progress = progress_reporter(len(group_curves(datasets, by=args.group_by))).start()
+        results = run_grouped(datasets, progress)
+    elif args.workers > 1:
+        progress = progress_reporter(len(datasets)).start()
+        # Use fit times from previous runs to schedule the most expensive curves first
+        history = None
+        if args.db is not None:
+            with ResultsStore(args.db) as store:
+                if "fit_time" in store.columns:
+                    # Stores written before nfev_total was recorded only have fit times
+                    history = store.query(columns=[col for col in ("originalid", "fit_time", "nfev_total") if col in store.columns], originalid=list(datasets.keys()))
+        if args.shared or args.memmap is not None:
+            # Workers read curves from one shared block; metadata is added back here
+            scheduler = CurveScheduler(progress.wrap(fit_arrays), workers=args.workers, history=history, shared=True, shared_path=args.memmap, **fit_kwargs())
+            fits = scheduler.run(datasets)
+            results = []
+            for curve_id, fit in zip(datasets.keys(), fits):
+                result = curve_metadata(curve_id, datasets[curve_id])
+                result.update(fit)
+                results.append(result)
+        else:
+            scheduler = CurveScheduler(progress.wrap(fit_curve), workers=args.workers, history=history, **fit_kwargs())
+            results = scheduler.run(datasets)
+        print(scheduler.utilization)
+    else:
+        progress = progress_reporter(len(datasets)).start()
+        fit = progress.wrap(fit_curve)
+        results = [fit(curve_id, dataset, **fit_kwargs()) for curve_id, dataset in datasets.items()]
+    if progress is not None:
+        progress.stop()
 
-    # Resample model
-    best_mod = resample_ssf(vals=vals, params=params, temps=temps, traits=traits, iter = 5)
+    # Add the fits to the template library
+    update_templates([(result, result.pop("template")) for result in results if "template" in result])
 
-    # Collect estimates
-    parameter_estimates = dict(best_mod.final_estimates)
-    print(type(parameter_estimates))
+    # Save the fit record of every restart, and show the slowest curves
+    if args.metrics is not None:
+        metrics = metrics_table([record for result in results for record in result.pop("metrics")])
+        metrics.to_csv(args.metrics, index=False)
+        print(hot_curves(metrics))
 
-    # Save results
-    results = pd.DataFrame([parameter_estimates])
+    # Save results (a shard without curves still gets a header, so it can be merged)
+    results = pd.DataFrame(results) if results else pd.DataFrame(columns=result_columns(data.columns))
     results.to_csv(args.output, encoding='utf-8', index=False)
+    if args.shard is not None:
+        write_manifest(args.output, shard, n_shards, datasets.keys())
+
+    # Write results to the indexed results store
+    if args.db is not None:
+        with ResultsStore(args.db) as store:
+            store.insert(results)
+        print("{} fits written to {}".format(len(results), args.db))
+
+    # Plot every fitted curve for visual checks
+    if args.plots is not None:
+        paths = plot_fits(datasets, results, args.plots, format=args.plot_format, workers=args.workers)
+        print("{} plot files written to {}".format(len(paths), args.plots))
 
 if __name__ == "__main__":
     # Assign a description to help doc
@@ -71,6 +591,155 @@ if __name__ == "__main__":
                         help="Output path for folder or single csv",
                         required=False,
                         default="data/fitted_models.csv")
+    # Results database
+    parser.add_argument("--db",
+                        type=str,
+                        help="Optional path to a SQLite results store to append fits to",
+                        required=False,
+                        default=None)
+    # Curves to fit
+    parser.add_argument("--ids",
+                        type=str,
+                        nargs="+",
+                        help="Only fit these originalids (default: all curves)",
+                        required=False,
+                        default=None)
+    # Number of restarts
+    parser.add_argument("--iter",
+                        type=int,
+                        help="Number of random restarts per curve",
+                        required=False,
+                        default=5)
+
+    # Number of worker processes
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        help="Number of worker processes (curves are scheduled longest first)",
+                        required=False,
+                        default=1)
+    # Shared memory mode
+    parser.add_argument("--shared",
+                        action="store_true",
+                        help="Send workers offsets into one shared memory block of curve data instead of DataFrames")
+    parser.add_argument("--memmap",
+                        type=str,
+                        help="Like --shared, but back the block with a memory-mapped file at this path (removed when the fits are done)",
+                        required=False,
+                        default=None)
+    # Sharding
+    parser.add_argument("--shard",
+                        type=str,
+                        help="Only fit shard i of N (given as i/N), assigned by a stable hash of originalid",
+                        required=False,
+                        default=None)
+    parser.add_argument("--merge",
+                        type=str,
+                        nargs="+",
+                        help="Merge these shard results csvs into --output instead of fitting",
+                        required=False,
+                        default=None)
+    parser.add_argument("--seed",
+                        type=int,
+                        help="Base random seed (each curve's seed is derived from it and its originalid)",
+                        required=False,
+                        default=0)
+    # Progress
+    parser.add_argument("--progress",
+                        type=float,
+                        nargs="?",
+                        const=10.0,
+                        help="Print progress, throughput, ETA and the slowest in-flight curves to stderr every N seconds (default 10)",
+                        required=False,
+                        default=None)
+    parser.add_argument("--events",
+                        type=str,
+                        help="Optional path of a JSON-lines file of progress events (appended to)",
+                        required=False,
+                        default=None)
+    # Instrumentation
+    parser.add_argument("--metrics",
+                        type=str,
+                        help="Optional path to a csv of per-fit metrics (nfev, timings, outcome and parameters of every restart)",
+                        required=False,
+                        default=None)
+    # Streaming
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help="Read, clean, fit and write concurrently (input must be sorted by originalid)")
+    parser.add_argument("--chunksize",
+                        type=int,
+                        help="Rows read at a time in --stream mode",
+                        required=False,
+                        default=100000)
+    parser.add_argument("--queue-size",
+                        type=int,
+                        help="Capacity of the queues between stages in --stream mode",
+                        required=False,
+                        default=8)
+    parser.add_argument("--clean",
+                        action="store_true",
+                        help="Convert temperatures to Kelvin and traits to d^-1 (as data_wrang.py) before fitting")
+    # Incremental refits
+    parser.add_argument("--refit",
+                        action="store_true",
+                        help="Refit curves already in --db from their latest stored fit, only running random restarts if the new points show a regime change. Curves without new points keep their stored fit (refit column 'unchanged')")
+    # Grouped fitting
+    parser.add_argument("--grouped",
+                        action="store_true",
+                        help="Fit related curves one after another, each starting from the previous fit of its group and falling back to random restarts if that fails (--progress counts groups)")
+    parser.add_argument("--group-by",
+                        type=str,
+                        nargs="+",
+                        help="Columns defining a group of related curves in --grouped mode",
+                        required=False,
+                        default=list(group_cols))
+    # Batched fitting
+    parser.add_argument("--batched",
+                        action="store_true",
+                        help="Fit the restarts of all curves together with a vectorised Levenberg-Marquardt solver (Schoolfield models only, no time budgets)")
+    # Template starts
+    parser.add_argument("--templates",
+                        type=str,
+                        help="Optional path of a template library (.npz): start each curve from the fits of the most similar curves in it, then add this run's fits to it",
+                        required=False,
+                        default=None)
+    parser.add_argument("--neighbours",
+                        type=int,
+                        help="Number of restarts started from the nearest --templates fits. They run first, and each one that converges replaces one of the --iter random restarts, so random restarts are only run for the template starts that fail",
+                        required=False,
+                        default=3)
+    parser.add_argument("--freeze-templates",
+                        action="store_true",
+                        help="Don't add this run's fits to the --templates library (e.g. for shards run at the same time)")
+    # Model
+    parser.add_argument("--model",
+                        type=str,
+                        help="Fit this model to every curve instead of choosing a Schoolfield model by screening: a Schoolfield model or one declared in tpcfit.registry ({})".format(", ".join(registered_models)),
+                        required=False,
+                        default=None)
+    # Plots
+    parser.add_argument("--plots",
+                        type=str,
+                        help="Optional directory to plot the points and fitted curve of every fitted curve in (rendered over -w worker processes)",
+                        required=False,
+                        default=None)
+    parser.add_argument("--plot-format",
+                        type=str,
+                        choices=plot_formats,
+                        help="One PNG per curve, or multi-page PDF sheets of 16 curves per page",
+                        required=False,
+                        default="png")
+    # Time budgets
+    parser.add_argument("--timeout",
+                        type=float,
+                        help="Wall-clock budget in seconds for each fit",
+                        required=False,
+                        default=None)
+    parser.add_argument("--curve-timeout",
+                        type=float,
+                        help="Wall-clock budget in seconds for all restarts of a curve",
+                        required=False,
+                        default=None)
 
     args = parser.parse_args()
     main()
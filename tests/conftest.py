@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+""" Make the repository root (pipeline.py and the tpcfit package) importable from the tests, and hold what several test modules share """
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from tpcfit.models import SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow
+
+# Model class and residual method of each Schoolfield model
+models = {"sharpeschoolfull": (SharpeSchoolfieldFull, "ssf_fcn2min"),
+          "sharpeschoolhigh": (SharpeSchoolfieldHigh, "ssh_fcn2min"),
+          "sharpeschoollow": (SharpeSchoolfieldLow, "ssl_fcn2min")}
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+""" The batched Levenberg-Marquardt solver finds the same fits as lmfit on synthetic curves """
+
+import numpy as np
+import pytest
+from pipeline import vals
+from tpcfit import model_funcs
+from tpcfit.batched import BatchedSchoolfield, batched_lm, best_model, random_starts
+from tpcfit.general_funcs import start_params
+from tpcfit.synthetic import schoolfield_log, synthetic_curves, synthetic_models
+
+def curve_arrays(data):
+    return [(curve["interactor1K"].to_numpy(), curve["standardisedtraitvalue"].to_numpy()) for curve_id, curve in data.groupby("originalid", sort=False)]
+
+def lmfit_fits(model_name, temps, traits, starts):
+    """ lmfit models fitted from each start, as resample_class fits them """
+    init = model_funcs(model_name)[1]
+    models = [synthetic_models[model_name](temps, traits, start_params(init(), start)) for start in starts]
+    return [model for model in models if getattr(model, "AIC", None) is not None]
+
+@pytest.mark.parametrize("model_name", ["sharpeschoolhigh", "sharpeschoollow"])
+def test_best_fit_matches_lmfit(model_name):
+    data, truth = synthetic_curves(12, model_name, n_points=12, seed=7)
+    curves = curve_arrays(data)
+    param_names = synthetic_models[model_name].param_names
+    rng = np.random.default_rng(1)
+    starts = [random_starts(param_names, vals, 5, rng) for curve in curves]
+    models = BatchedSchoolfield(model_name).fit(curves, starts)
+    for (temps, traits), curve_starts, curve_models in zip(curves, starts, models):
+        batched = best_model(curve_models)
+        lmfit = min(lmfit_fits(model_name, temps, traits, curve_starts), key=lambda model: model.AIC)
+        assert batched.AIC == pytest.approx(lmfit.AIC, abs=1e-4)
+        for name in param_names:
+            assert batched.final_estimates[name] == pytest.approx(lmfit.final_estimates[name], rel=1e-3)
+        np.testing.assert_allclose(batched.fits, np.exp(schoolfield_log(model_name, temps, lmfit.final_estimates)), rtol=1e-4)
+
+def test_full_model_fits_as_well_as_lmfit():
+    # The full model has local optima (e.g. a deactivation term pushed outside the data), which the two solvers don't always
+    # reach from the same starts, so compare the best of 5 restarts over all curves rather than curve by curve
+    model_name = "sharpeschoolfull"
+    data, truth = synthetic_curves(12, model_name, n_points=12, seed=7)
+    curves = curve_arrays(data)
+    rng = np.random.default_rng(1)
+    starts = [random_starts(synthetic_models[model_name].param_names, vals, 5, rng) for curve in curves]
+    models = BatchedSchoolfield(model_name).fit(curves, starts)
+    differences = []
+    for (temps, traits), curve_starts, curve_models in zip(curves, starts, models):
+        batched = best_model(curve_models)
+        lmfit = min(lmfit_fits(model_name, temps, traits, curve_starts), key=lambda model: model.AIC)
+        rss = np.sum((schoolfield_log(model_name, temps, batched.final_estimates) - np.log(traits)) ** 2)
+        assert rss == pytest.approx(batched.fit_result.chisqr)
+        assert batched.final_estimates["E"] < batched.final_estimates["Eh"]
+        assert batched.final_estimates["Th"] >= batched.final_estimates["Tl"] + 1
+        differences.append(batched.AIC - lmfit.AIC)
+    differences = np.array(differences)
+    assert abs(np.median(differences)) < 1e-2
+    assert np.mean(differences < 0.1) >= 0.75
+
+def test_batched_lm_respects_bounds():
+    # Straight lines y = a + b x, the second with its least-squares slope outside the bounds
+    x = np.linspace(0, 1, 8)
+    y = np.array([1 + 2 * x, 1 - 3 * x])
+
+    def evaluate(problems, theta):
+        residuals = theta[:, 0, None] + theta[:, 1, None] * x - y[problems]
+        jac = np.stack([np.ones_like(residuals), np.broadcast_to(x, residuals.shape)], axis=2)
+        return residuals, jac
+
+    theta, rss, nfev, converged = batched_lm(evaluate, np.zeros((2, 2)), np.broadcast_to(np.arange(2), (2, 2)),
+                                             np.array([-10.0, -1.0]), np.array([10.0, 10.0]), np.array([False, False]))
+    assert converged.all()
+    np.testing.assert_allclose(theta[0], [1, 2], atol=1e-8)
+    assert rss[0] == pytest.approx(0, abs=1e-14)
+    # Slope held at its bound, intercept refitted for it
+    np.testing.assert_allclose(theta[1], [1 - 2 * x.mean(), -1], atol=1e-8)
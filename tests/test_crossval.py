@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+""" Cross-validated residuals match cold refits of the training points, and the hat matrix approximates leave-one-out """
+
+import numpy as np
+import pandas as pd
+import pytest
+from pipeline import vals
+from tpcfit.batched import fit_batched
+from tpcfit.crossval import CrossValidation, cross_validate, cv_best_models
+from tpcfit.general_funcs import resample_model
+from tpcfit.synthetic import schoolfield_log, synthetic_curves
+
+model_name = "sharpeschoolhigh"
+
+def curves(n_curves, n_points, noise=0.05):
+    data, truth = synthetic_curves(n_curves, model_name, n_points=n_points, noise=noise, seed=2)
+    datasets = {curve_id: curve for curve_id, curve in data.groupby("originalid")}
+    fits = pd.DataFrame(fit_batched(datasets, vals, model_name=model_name, iter=5, seed=0)).set_index("originalid")
+    return datasets, fits
+
+@pytest.mark.parametrize("folds", [None, 4])
+def test_held_out_residuals_match_cold_refits(folds):
+    datasets, fits = curves(3, 10)
+    cv = CrossValidation(model_name, folds=folds).fit(datasets, fits)
+    assert cv.method == ("loo" if folds is None else "kfold")
+    assert (cv.errors["n_failed"] == 0).all()
+    for curve_id, points in cv.points.groupby("originalid"):
+        temps = datasets[curve_id]["interactor1K"].to_numpy()
+        traits = datasets[curve_id]["standardisedtraitvalue"].to_numpy()
+        for fold in np.unique(points["fold"]):
+            test = points["fold"].to_numpy() == fold
+            # Fitted from random restarts, without the full-data optimum cross-validation starts from
+            np.random.seed(0)
+            cold = resample_model(model_name, vals=vals, temps=temps[~test], traits=traits[~test], iter=10)
+            expected = schoolfield_log(model_name, temps[test], cold.final_estimates) - np.log(traits[test])
+            np.testing.assert_allclose(points["cv_residual"].to_numpy()[test], expected, atol=1e-4)
+
+def test_approx_close_to_exact_loo():
+    # Dense, low-noise curves are close enough to linear around their optimum for the hat matrix to hold
+    datasets, fits = curves(4, 16)
+    exact = CrossValidation(model_name).fit(datasets, fits).errors
+    approx = CrossValidation(model_name, approx=True).fit(datasets, fits).errors
+    assert (approx["method"] == "approx_loo").all()
+    np.testing.assert_allclose(approx["rmse"], exact["rmse"])
+    np.testing.assert_allclose(approx["cv_rmse"], exact["cv_rmse"], rtol=0.02)
+
+def test_cross_validate_fits_missing_models():
+    datasets, fits = curves(2, 10)
+    errors, points = cross_validate(datasets, vals=vals, models=(model_name, "sharpeschoollow"), folds=3)
+    assert sorted(errors["model_name"].unique()) == sorted((model_name, "sharpeschoollow"))
+    assert errors["aic"].notna().all() and (errors["cv_rmse"] >= 0).all()
+    assert len(points) == 2 * sum(len(dataset) for dataset in datasets.values())
+
+def test_cv_best_models():
+    errors = pd.DataFrame({"originalid": ["a", "a", "a", "b", "b"],
+                           "model_name": ["full", "high", "low", "full", "high"],
+                           "cv_rmse": [0.3, 0.1, np.nan, 0.2, 0.5],
+                           "aic": [-12.0, -10.0, -20.0, np.nan, -5.0]})
+    best = cv_best_models(errors)
+    assert best.columns.tolist() == ["originalid", "cv_model", "cv_rmse", "aic_model"]
+    assert best["cv_model"].tolist() == ["high", "full"]
+    assert best["cv_rmse"].tolist() == [0.1, 0.2]
+    # The lowest AIC counts even where the model couldn't be cross-validated
+    assert best["aic_model"].tolist() == ["low", "high"]
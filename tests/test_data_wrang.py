@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+""" Data cleaning converts units, shifts each curve positive and counts its unique temperatures, in one frame or in chunks """
+
+import numpy as np
+import pandas as pd
+import pytest
+from data_wrang import SECONDS_PER_DAY, clean_chunks, clean_data, count_unique_temps
+
+raw = pd.DataFrame({"originalid": ["a", "a", "a", "a", "b", "b", "b", None, "c", "c"],
+                    "interactor1temp": [10.0, 20.0, 20.0, np.nan, -5.0, 5.0, 15.0, 25.0, -273.15, 0.0],
+                    "standardisedtraitvalue": [1e-5, 2e-5, 3e-5, 4e-5, -1e-5, 0.0, 2e-5, 1e-5, 1e-5, 2e-5]})
+
+columns = {"temps_col": "interactor1temp", "traits_col": "standardisedtraitvalue"}
+
+def test_count_unique_temps_ignores_missing():
+    temps = np.array([283.15, 293.15, 293.15, np.nan, np.nan, 278.15])
+    codes = np.array([0, 0, 0, 0, 1, 1])
+    np.testing.assert_array_equal(count_unique_temps(temps, codes), [2, 2, 2, 2, 1, 1])
+    # As pandas counts them
+    np.testing.assert_array_equal(count_unique_temps(temps, codes), pd.Series(temps).groupby(codes).transform("nunique"))
+
+def test_clean_data():
+    clean = clean_data(raw, "originalid", **columns)
+    # Rows without a curve id are dropped
+    assert clean["originalid"].tolist() == ["a"] * 4 + ["b"] * 3 + ["c"] * 2
+    np.testing.assert_allclose(clean["temps"].iloc[:3], [283.15, 293.15, 293.15])
+    assert np.isnan(clean["temps"].iloc[3])
+    np.testing.assert_allclose(clean["traits"].iloc[:4], raw["standardisedtraitvalue"].iloc[:4] * SECONDS_PER_DAY)
+    # Curve b has traits at or below zero, so only its traits are shifted just above zero
+    b = clean.loc[clean["originalid"] == "b"]
+    np.testing.assert_allclose(b["traits"], (raw["standardisedtraitvalue"].iloc[4:7] + 1e-5) * SECONDS_PER_DAY + 10E-10)
+    np.testing.assert_allclose(b["temps"], [268.15, 278.15, 288.15])
+    # Curve c is at absolute zero, so its temperatures are shifted
+    c = clean.loc[clean["originalid"] == "c"]
+    assert c["temps"].min() > 0 and c["temps"].min() < 1e-8
+    assert clean["unique_temps"].tolist() == [2] * 4 + [3] * 3 + [2] * 2
+    # The original columns are kept
+    assert clean["interactor1temp"].iloc[0] == 10.0
+
+def test_clean_chunks_matches_clean_data():
+    data = raw.loc[raw["originalid"].notna()].reset_index(drop=True)
+    expected = clean_data(data, "originalid", **columns).reset_index(drop=True)
+    for chunksize in (1, 2, 3, 5, 20):
+        chunks = (data.iloc[i:i + chunksize] for i in range(0, len(data), chunksize))
+        cleaned = pd.concat(clean_chunks(chunks, "originalid", **columns), ignore_index=True)
+        pd.testing.assert_frame_equal(cleaned, expected)
+
+def test_clean_chunks_needs_contiguous_curves():
+    data = raw.loc[raw["originalid"].notna()].iloc[[0, 4, 1, 5]]
+    with pytest.raises(ValueError, match="not contiguous"):
+        list(clean_chunks((data.iloc[i:i + 1] for i in range(len(data))), "originalid", **columns))
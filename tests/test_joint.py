@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+""" Joint fits recover a shared activation energy, with a Jacobian sparsity pattern matching the residuals """
+
+import numpy as np
+import pytest
+from tpcfit.joint import JointFit, fit_joint_groups
+from tpcfit.synthetic import schoolfield_log, synthetic_curves
+
+model_name = "sharpeschoolhigh"
+
+def shared_e_curves(n_curves, E=0.6, noise=0.05, seed=1):
+    """ Synthetic curves that all have the same activation energy """
+    data, truth = synthetic_curves(n_curves, model_name, n_points=12, noise=noise, seed=seed)
+    truth["E"] = E
+    params = {name: truth[name].reindex(data["originalid"]).to_numpy() for name in truth.columns}
+    rng = np.random.default_rng(seed + 100)
+    data["standardisedtraitvalue"] = np.exp(schoolfield_log(model_name, data["interactor1K"].to_numpy(), params) + rng.normal(scale=noise, size=len(data)))
+    return {curve_id: curve for curve_id, curve in data.groupby("originalid")}, truth
+
+@pytest.mark.parametrize("shared, hierarchical, name", [(("E",), None, "E"), ((), {"E": 0.1}, "E_mean")])
+def test_recovers_shared_energy(shared, hierarchical, name):
+    datasets, truth = shared_e_curves(10)
+    joint = JointFit(model_name, shared=shared, hierarchical=hierarchical).fit(datasets, starts=truth.assign(E=0.4))
+    assert joint.success
+    estimate, stderr = joint.group.loc[name, "estimate"], joint.group.loc[name, "stderr"]
+    assert np.isfinite(stderr) and 0 < stderr < 0.05
+    assert abs(estimate - 0.6) < 3 * stderr
+    # Curves pulled towards the group mean stay close to it
+    assert np.all(np.abs(joint.estimates["E"] - estimate) < 0.05)
+
+@pytest.mark.parametrize("shared, hierarchical", [(("E",), None), (("E",), {"Eh": 1.0}), ((), {"E": 0.1, "Th": 5.0})])
+def test_sparsity_matches_residuals(shared, hierarchical):
+    datasets, truth = shared_e_curves(4)
+    joint = JointFit(model_name, shared=shared, hierarchical=hierarchical).fit(datasets, starts=truth)
+    sparsity = joint.sparsity()
+    n_points, n_curves = len(joint.temps), len(joint.ids)
+    n_hier = len(joint.hierarchical)
+    assert sparsity.shape == (len(joint._residuals(joint.result.x)), joint.n_params)
+    assert sparsity.shape == (n_points + n_hier * n_curves, len(shared) + n_hier + n_curves * len(joint.local))
+    # Every point on the shared parameters and its curve's block, every prior row on a mean and one curve's value
+    assert sparsity.nnz == n_points * (len(shared) + len(joint.local)) + 2 * n_hier * n_curves
+    # The Jacobian least_squares estimated has no entries outside the pattern
+    jac = joint.result.jac.toarray()
+    assert np.all(jac[sparsity.toarray() == 0] == 0)
+
+def test_groups_without_enough_points_are_skipped():
+    datasets, truth = shared_e_curves(6)
+    for i, curve_id in enumerate(datasets):
+        group = "rich" if i < 4 else "sparse"
+        dataset = datasets[curve_id] if group == "rich" else datasets[curve_id].iloc[:3]
+        datasets[curve_id] = dataset.assign(interactor1=group, standardisedtraitname="growth")
+    estimates, groups = fit_joint_groups(datasets, starts=truth)
+    assert groups.index.tolist() == ["rich|growth"]
+    assert groups.loc["rich|growth", "curves"] == 4
+    assert sorted(estimates.index) == sorted(list(datasets)[:4])
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+""" Plotted curves are the curves the models were fitted with, including the Th >= Tl + 1 projection of the full model """
+
+import numpy as np
+import pytest
+from tpcfit import model_funcs
+from conftest import models
+from tpcfit.plotting import model_curve
+from tpcfit.synthetic import synthetic_curves
+
+def trial_params(rng, names):
+    # Th and Tl overlap, so about half of the full model's draws have Th below Tl + 1
+    values = {"B0": rng.uniform(0.1, 2), "E": rng.uniform(0.05, 1.0), "Eh": rng.uniform(1.5, 4), "El": rng.uniform(0.05, 3),
+              "Th": rng.uniform(280, 320), "Tl": rng.uniform(275, 315)}
+    return {name: values[name] for name in names}
+
+@pytest.mark.parametrize("model_name", sorted(models))
+def test_plotted_curve_is_the_fitted_model(model_name):
+    model_class, fcn2min = models[model_name]
+    data, truth = synthetic_curves(1, model_name, n_points=12, seed=5)
+    temps, traits = data["interactor1K"].to_numpy(), data["standardisedtraitvalue"].to_numpy()
+    params = model_funcs(model_name)[1]()
+    for name, value in truth.iloc[0].items():
+        params[name].set(value=value)
+    model = model_class(temps, traits, params)
+    rng = np.random.default_rng(1)
+    for _ in range(100):
+        values = trial_params(rng, model_class.param_names)
+        for name, value in values.items():
+            params[name].value = value
+        residuals = getattr(model, fcn2min)(params, temps, traits)
+        np.testing.assert_allclose(model_curve(model_name, temps, values), np.exp(residuals + np.log(traits)), rtol=1e-10)
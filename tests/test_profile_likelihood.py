@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+""" Profile refits stay in the region the lmfit models fit: E below Eh and Th at least 1 K above Tl """
+
+import numpy as np
+from tpcfit.profile_likelihood import ProfileLikelihood
+from tpcfit.synthetic import synthetic_curves
+
+def test_profiles_stay_feasible():
+    data, truth = synthetic_curves(4, "sharpeschoolfull", n_points=14, seed=3)
+    datasets = {curve_id: curve for curve_id, curve in data.groupby("originalid")}
+    estimates = truth.copy()
+    # An estimate with Th below Tl + 1, as ssf fits can report
+    estimates.iloc[0, estimates.columns.get_loc("Th")] = estimates["Tl"].iloc[0] - 3
+    profile = ProfileLikelihood("sharpeschoolfull", ("E", "Th", "Tl")).fit(datasets, estimates)
+
+    assert np.all(profile.theta[:, profile.param_names.index("Th")] >= profile.theta[:, profile.param_names.index("Tl")] + 1)
+    profiles = profile.profiles[np.isfinite(profile.profiles["rss"])]
+    assert len(profiles)
+    assert np.all(profiles["E"] < profiles["Eh"])
+    free = profiles[profiles["param"] != "Th"]
+    assert np.all(free["Th"] >= free["Tl"] + 1)
+    # The profiled parameter is reported at its grid value
+    for name in ("E", "Th", "Tl"):
+        rows = profile.profiles[profile.profiles["param"] == name]
+        np.testing.assert_array_equal(rows[name], rows["value"])
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+""" --refit keeps the stored fit of curves without new points and refits the rest from their latest fit """
+
+import numpy as np
+import pipeline
+from tpcfit import ResultsStore
+from tpcfit.synthetic import synthetic_curves
+
+def stored_row(curve_id, aic, n_points, **estimates):
+    row = {"originalid": curve_id, "model_name": "sharpeschoolhigh", "screen": "ok", "fit_time": 0.1, "aic": aic,
+           "timed_out": "0", "nfev": 100.0, "n_points": float(n_points), "B0": 1.0, "E": 0.6, "Eh": 3.0, "Th": 305.0}
+    row.update(estimates)
+    return row
+
+def test_previous_fit_is_the_latest_insert(tmp_path):
+    db = str(tmp_path / "fits.db")
+    with ResultsStore(db) as store:
+        store.insert([stored_row("A", -3.0, 10), stored_row("B", -1.0, 10), stored_row("A", -5.0, 12), stored_row("A", np.nan, 13)])
+    previous = pipeline.previous_fit(db, "A")
+    # Rows without an AIC are skipped
+    assert previous["aic"] == -5.0 and previous["n_points"] == 12
+
+def test_refit_skips_curves_without_new_points(tmp_path):
+    data, truth = synthetic_curves(1, "sharpeschoolhigh", n_points=10, seed=2)
+    temps, traits = data["interactor1K"].values, data["standardisedtraitvalue"].values
+    curve_id = data["originalid"].iloc[0]
+    fit = pipeline.fit_arrays(curve_id, temps, traits, iter=2)
+    db = str(tmp_path / "fits.db")
+    with ResultsStore(db) as store:
+        store.insert([dict(fit, timed_out=str(int(fit["timed_out"])))])
+
+    unchanged = pipeline.fit_arrays(curve_id, temps, traits, iter=2, refit=db, metrics=True)
+    assert unchanged["refit"] == "unchanged"
+    assert unchanged["metrics"] == []
+    for col in fit:
+        if col != "originalid":
+            assert unchanged[col] == fit[col], col
+
+    # A new point is refitted, starting from the stored fit
+    more_temps, more_traits = np.append(temps, temps[-1] + 1), np.append(traits, traits[-1])
+    refitted = pipeline.fit_arrays(curve_id, more_temps, more_traits, iter=2, refit=db, metrics=True)
+    assert refitted["refit"] != "unchanged" and refitted["n_points"] == len(temps) + 1
+    start = refitted["metrics"][0]["start"]
+    assert start == {name: fit[name] for name in start}
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+""" Generated registry kernels give the log of the declared expression and its derivatives (checked against finite differences) """
+
+import numpy as np
+import pytest
+from tpcfit.registry import compile_kernels, registered_models, _eps
+
+k = 8.617 * 10 ** (-5)
+Tref = 283.15
+
+# Declared models, plus expressions exercising the log of a sum, a quotient and a power with a fitted exponent
+expressions = {name: (model.expression, model.param_names, model.start) for name, model in registered_models.items()}
+expressions["schoolfield_high"] = ("B0 * exp(-E / k * (1 / T - 1 / Tref)) / (1 + exp(Eh / k * (1 / Th - 1 / T)))", ("B0", "E", "Eh", "Th"),
+                                   {"B0": [0.05, 1.2], "E": [0.05, 0.85], "Eh": [1.5, 4.0], "Th": [295.0, 320.0]})
+expressions["power_law"] = ("a * (T / Tref) ** b + log(T / 200)", ("a", "b"), {"a": [0.5, 2.0], "b": [-3.0, 3.0]})
+
+def direct(expression, T, params):
+    """ The expression evaluated as written, with numpy, and where none of its pos() arguments is clipped """
+    unclipped = np.ones(T.shape, dtype=bool)
+
+    def pos(x):
+        unclipped[...] &= x > _eps
+        return np.maximum(x, _eps)
+
+    namespace = dict(params, T=T, k=k, Tref=Tref, exp=np.exp, log=np.log, sqrt=np.sqrt, pos=pos)
+    return eval(expression, {"__builtins__": {}}, namespace), unclipped
+
+def draws(start, n, seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        yield {name: rng.uniform(*start[name]) for name in start}
+
+@pytest.mark.parametrize("name", sorted(expressions))
+def test_model_kernel_is_log_of_expression(name):
+    expression, param_names, start = expressions[name]
+    kernels = compile_kernels(expression, param_names)
+    T = np.linspace(278.15, 318.15, 17)
+    for params in draws(start, 50, seed=1):
+        values, inside = direct(expression, T, params)
+        log_values, = kernels.model(T, k, Tref, *[params[p] for p in param_names])
+        log_values = np.broadcast_to(log_values, T.shape)
+        np.testing.assert_allclose(log_values[inside], np.log(values[inside]), rtol=1e-10, atol=1e-10)
+
+@pytest.mark.parametrize("name", sorted(expressions))
+def test_jacobian_kernel_matches_finite_differences(name):
+    expression, param_names, start = expressions[name]
+    kernels = compile_kernels(expression, param_names)
+    T = np.linspace(278.15, 318.15, 17)
+    for params in draws(start, 50, seed=2):
+        values = [params[p] for p in param_names]
+        log_values, *derivatives = kernels.jacobian(T, k, Tref, *values)
+        np.testing.assert_allclose(np.broadcast_to(log_values, T.shape), np.broadcast_to(kernels.model(T, k, Tref, *values)[0], T.shape))
+        for i, param in enumerate(param_names):
+            h = 1e-6 * max(abs(values[i]), 1e-3)
+            up, down = list(values), list(values)
+            up[i] += h
+            down[i] -= h
+            numeric = (kernels.model(T, k, Tref, *up)[0] - kernels.model(T, k, Tref, *down)[0]) / (2 * h)
+            analytic = np.broadcast_to(derivatives[i], T.shape)
+            # Central differences straddling a pos() clip see a kink, so only compare where both sides agree on the slope
+            smooth = np.abs(numeric - (kernels.model(T, k, Tref, *up)[0] - np.broadcast_to(log_values, T.shape)) / h) < 1e-3 * (1 + np.abs(numeric))
+            np.testing.assert_allclose(analytic[smooth], np.broadcast_to(numeric, T.shape)[smooth], rtol=1e-5, atol=1e-6, err_msg="d/d{} of {}".format(param, name))
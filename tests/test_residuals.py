@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+""" In-place residuals of the Schoolfield models give the same values as the original expressions """
+
+import numpy as np
+import pytest
+from tpcfit import model_funcs
+from conftest import models
+from tpcfit.models import ResidualWorkspace
+from tpcfit.synthetic import synthetic_curves
+
+def old_residuals(model_name, p, temps, log_traits, k, Tref):
+    """ Residuals as the models computed them before ResidualWorkspace """
+    if (model_name != "sharpeschoollow" and p["E"] >= p["Eh"]) or p["B0"] <= 0:
+        return np.full(len(temps), 1e10)
+    boltzmann = p["B0"] * np.exp(1) ** ((-p["E"] / k) * ((1 / temps) - (1 / Tref)))
+    if model_name == "sharpeschoolfull":
+        Th, Tl = p["Th"], p["Tl"]
+        if Th < (Tl + 1):
+            Th = Tl + 1
+        if Tl > Th - 1:
+            Tl = Th - 1
+        model = np.log(boltzmann / ((1 + (np.exp(1) ** ((p["El"] / k) * ((1 / Tl) - (1 / temps))))) + (np.exp(1) ** ((p["Eh"] / k) * ((1 / Th) - (1 / temps))))))
+    elif model_name == "sharpeschoolhigh":
+        model = np.log(boltzmann / (1 + (np.exp(1) ** ((p["Eh"] / k) * ((1 / p["Th"]) - (1 / temps))))))
+    else:
+        model = np.log(boltzmann / (1 + (np.exp(1) ** ((p["El"] / k) * ((1 / p["Tl"]) - (1 / temps))))))
+    return np.array(model - log_traits)
+
+def trial_params(rng, names):
+    values = {"B0": rng.uniform(-0.1, 2), "E": rng.uniform(0.05, 1.5), "Eh": rng.uniform(0.5, 4), "El": rng.uniform(0.05, 3),
+              "Th": rng.uniform(280, 330), "Tl": rng.uniform(273.15, 320)}
+    return {name: values[name] for name in names}
+
+@pytest.mark.parametrize("model_name", sorted(models))
+def test_workspace_residuals_match_original_expressions(model_name):
+    model_class, fcn2min = models[model_name]
+    data, truth = synthetic_curves(1, model_name, n_points=12, seed=4)
+    temps, traits = data["interactor1K"].to_numpy(), data["standardisedtraitvalue"].to_numpy()
+    resample, init = model_funcs(model_name)
+    params = init()
+    for name, value in truth.iloc[0].items():
+        params[name].set(value=value)
+    model = model_class(temps, traits, params)
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        values = trial_params(rng, model_class.param_names)
+        for name, value in values.items():
+            params[name].value = value
+        expected = old_residuals(model_name, values, temps, np.log(traits), model.k, model.Tref)
+        residuals = getattr(model, fcn2min)(params, temps, traits)
+        np.testing.assert_array_equal(residuals, expected)
+        # A fresh array every call (MINPACK keeps the returned array)
+        assert residuals is not getattr(model, fcn2min)(params, temps, traits)
+
+def test_workspace_is_rebuilt_for_another_curve():
+    temps, traits = np.linspace(280, 310, 6), np.linspace(1, 2, 6)
+    workspace = ResidualWorkspace(temps, traits)
+    assert workspace.matches(temps, traits, workspace.Tref)
+    assert not workspace.matches(temps + 1, traits, workspace.Tref)
+    assert not workspace.matches(temps, traits, workspace.Tref + 1)
+    np.testing.assert_array_equal(workspace.log_traits, np.log(traits))
+    np.testing.assert_array_equal(workspace.delta_inv_temps, 1 / temps - 1 / workspace.Tref)
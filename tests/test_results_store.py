@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+""" Results store inserts, filters, typed column queries and csv imports """
+
+import numpy as np
+import pandas as pd
+import pytest
+from tpcfit.results_store import ResultsStore, ResultsStoreException
+
+fits = [{"originalid": "MTD4538", "model_name": "sharpeschoolhigh", "E": 0.61, "aic": -12.5},
+        {"originalid": "MTD4539", "model_name": "sharpeschoollow", "E": 0.42, "aic": np.nan},
+        {"originalid": "MTD4540", "model_name": "sharpeschoolfull", "E": 0.75, "aic": -8.0}]
+
+@pytest.fixture
+def store():
+    with ResultsStore() as store:
+        store.insert(fits)
+        yield store
+
+def test_insert_adds_new_columns(store):
+    assert store.columns["E"] == "REAL" and store.columns["aic"] == "REAL"
+    assert store.insert([{"originalid": "MTD4541", "El": 1.8, "note": "refit"}]) == 1
+    assert store.columns["El"] == "REAL" and store.columns["note"] == "TEXT"
+    assert "El" in [row[1] for row in store.conn.execute("PRAGMA table_info(fits)")]
+    rows = store.query(columns=["originalid", "El", "note"], order_by="rowid")
+    assert rows["originalid"].tolist() == ["MTD4538", "MTD4539", "MTD4540", "MTD4541"]
+    assert rows["El"].isna().tolist() == [True, True, True, False] and rows["note"].iloc[-1] == "refit"
+    with pytest.raises(ResultsStoreException):
+        store.insert([{"E; DROP TABLE fits": 1.0}])
+
+def test_list_filters_match_with_in(store):
+    rows = store.query(originalid=["MTD4538", "MTD4540"], order_by="originalid")
+    assert rows["originalid"].tolist() == ["MTD4538", "MTD4540"]
+    assert len(store.query(originalid=("MTD4539",), model_name="sharpeschoolhigh")) == 0
+    assert store.query(model_name=np.array(["sharpeschoollow"]))["originalid"].tolist() == ["MTD4539"]
+    with pytest.raises(ResultsStoreException):
+        store.query(species="x")
+
+def test_arrays_have_nan_for_null_reals(store):
+    arrays = store.query(columns=["originalid", "aic"], as_frame=False, order_by="rowid")
+    assert arrays["aic"].dtype == float
+    np.testing.assert_array_equal(arrays["aic"], [-12.5, np.nan, -8.0])
+    assert arrays["originalid"].dtype == object and arrays["originalid"].tolist() == ["MTD4538", "MTD4539", "MTD4540"]
+    empty = store.query(columns=["aic"], as_frame=False, originalid="none")
+    assert len(empty["aic"]) == 0
+
+def test_order_by(store):
+    store.insert([{"originalid": "MTD4537", "model_name": "sharpeschoolhigh", "E": 0.5}])
+    assert store.query(order_by="rowid")["originalid"].tolist() == ["MTD4538", "MTD4539", "MTD4540", "MTD4537"]
+    assert store.query(order_by="E")["E"].tolist() == [0.42, 0.5, 0.61, 0.75]
+    assert store.query(order_by="rowid", limit=2)["originalid"].tolist() == ["MTD4538", "MTD4539"]
+    with pytest.raises(ResultsStoreException):
+        store.query(order_by="E DESC")
+
+def test_import_csv_drops_unnamed_columns(tmp_path):
+    path = str(tmp_path / "fits.csv")
+    # The row index written by R's write.csv
+    pd.DataFrame(fits).to_csv(path)
+    with ResultsStore() as store:
+        assert store.import_csv(path, chunksize=2) == 3
+        assert not any(col.startswith("Unnamed") for col in store.columns)
+        assert len(store) == 3
+        assert store.query(originalid="MTD4540")["E"].tolist() == [0.75]
+
+def test_query_plan_uses_the_originalid_index(store):
+    plan = " ".join(store.query_plan(originalid="MTD4538"))
+    assert "idx_fits_originalid" in plan
+    assert "idx_fits_originalid" in " ".join(store.query_plan(originalid=["MTD4538", "MTD4539"]))
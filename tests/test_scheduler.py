@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+""" Cost estimates order the curves, and the scheduler returns results in input order """
+
+import numpy as np
+import pandas as pd
+import pytest
+from tpcfit.scheduler import CurveScheduler, estimate_costs, make_batches
+from tpcfit.synthetic import synthetic_curves
+
+def datasets_of_sizes(sizes):
+    """ Synthetic curves truncated to different numbers of points """
+    data, truth = synthetic_curves(len(sizes), "sharpeschoolhigh", n_points=max(sizes), noise=0.05, seed=6)
+    curves = {curve_id: curve for curve_id, curve in data.groupby("originalid", sort=False)}
+    return {curve_id: curve.iloc[:size] for (curve_id, curve), size in zip(curves.items(), sizes)}
+
+def curve_summary(curve_id, temps, traits, iter=5):
+    return curve_id, len(temps), float(np.sum(temps)), float(np.sum(traits))
+
+def test_costs_grow_with_points():
+    datasets = datasets_of_sizes([6, 12, 9])
+    # Screened out, so there are no parameters to fit
+    datasets["flat"] = datasets["SYN0"].assign(standardisedtraitvalue=-1.0)
+    costs = estimate_costs(datasets, iter=5)
+    assert costs.index.tolist() == list(datasets)
+    assert costs["flat"] == 6 * 5 + 1
+    assert costs["SYN1"] > costs["SYN2"] > costs["SYN0"] > costs["flat"]
+
+def test_costs_from_total_evaluations():
+    datasets = datasets_of_sizes([6, 12, 9, 10])
+    history = pd.DataFrame({"originalid": ["SYN0", "SYN1", "SYN0"], "nfev_total": [50.0, 400.0, 1000.0]})
+    costs = estimate_costs(datasets, iter=5, history=history)
+    # The latest run of each curve, times its number of points
+    assert costs["SYN0"] == 1000.0 * 6
+    assert costs["SYN1"] == 400.0 * 12
+    prior = estimate_costs(datasets, iter=5)
+    ratio = np.median([1000.0 * 6 / prior["SYN0"], 400.0 * 12 / prior["SYN1"]])
+    np.testing.assert_allclose(costs[["SYN2", "SYN3"]], prior[["SYN2", "SYN3"]] * ratio)
+    # Fit times, where known, win
+    timed = estimate_costs(datasets, iter=5, history=history.assign(fit_time=[np.nan, 2.0, 0.5]))
+    assert timed["SYN0"] == 0.5 and timed["SYN1"] == 2.0
+
+def test_batches_most_expensive_first():
+    costs = pd.Series({"a": 1.0, "b": 50.0, "c": 2.0, "d": 30.0, "e": 1.0, "f": 2.0})
+    batches = make_batches(list(costs.index), costs, workers=2, tasks_per_worker=2)
+    # Curves above the target cost of a batch go alone, the cheap ones are grouped
+    assert batches[:2] == [["b"], ["d"]]
+    assert sorted(sum(batches, [])) == sorted(costs.index)
+    flat = sum(batches, [])
+    assert list(costs[flat]) == sorted(costs, reverse=True)
+    assert len(batches) < len(costs)
+
+@pytest.mark.parametrize("memmap", [False, True])
+def test_shared_results_in_input_order(tmp_path, memmap):
+    datasets = datasets_of_sizes([4, 12, 7, 9, 5, 11])
+    scheduler = CurveScheduler(curve_summary, workers=2, shared=True, shared_path=str(tmp_path / "curves.dat") if memmap else None, tasks_per_worker=2)
+    results = scheduler.run(datasets)
+    assert [result[0] for result in results] == list(datasets)
+    for (curve_id, n_points, temps, traits), dataset in zip(results, datasets.values()):
+        assert n_points == len(dataset)
+        assert temps == pytest.approx(dataset["interactor1K"].sum())
+        assert traits == pytest.approx(dataset["standardisedtraitvalue"].sum())
+    assert scheduler.utilization["curves"].sum() == len(datasets)
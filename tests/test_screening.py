@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+""" Every screening reason code, and the model chosen with it """
+
+import numpy as np
+import pandas as pd
+import pytest
+from tpcfit.screening import screen_curve, screen_datasets
+
+def temps(n):
+    return 283.15 + 3.0 * np.arange(n)
+
+def peaked(n, peak):
+    """ Traits rising up to index peak, then falling """
+    return np.exp(-0.3 * np.abs(np.arange(n) - peak))
+
+cases = [
+    # name, temps, traits, unique_temps, model_name, reason
+    ("full", temps(8), peaked(8, 5), None, "sharpeschoolfull", "ok"),
+    ("few_temps_full", temps(6), peaked(6, 3), None, "sharpeschoolhigh", "few_temps_full"),
+    ("no_high_peak", temps(6), peaked(6, 5), None, "sharpeschoollow", "no_high_peak"),
+    ("too_few_temps", temps(4), peaked(4, 2), None, None, "too_few_temps"),
+    ("repeated_temps", np.repeat(temps(4), 3), np.repeat(peaked(4, 2), 3), None, None, "too_few_temps"),
+    ("nonpositive_traits", temps(8), np.r_[peaked(7, 4), 0.0], None, None, "nonpositive_traits"),
+    ("missing_traits", temps(8), np.r_[peaked(7, 4), np.nan], None, None, "nonpositive_traits"),
+    ("empty", temps(0), peaked(0, 0), None, None, "nonpositive_traits"),
+    ("flat_traits", temps(8), np.ones(8), None, None, "flat_traits"),
+    ("no_rise", temps(8), peaked(8, 0), None, None, "no_rise"),
+    # The unique_temps column of clean data overrides the count
+    ("unique_temps_given", temps(8), peaked(8, 5), 6, "sharpeschoolhigh", "few_temps_full"),
+]
+
+@pytest.mark.parametrize("name, temps, traits, unique_temps, model_name, reason", cases, ids=[case[0] for case in cases])
+def test_screen_curve(name, temps, traits, unique_temps, model_name, reason):
+    assert screen_curve(temps, traits, unique_temps) == (model_name, reason)
+
+def test_screen_datasets():
+    datasets = {name: pd.DataFrame({"interactor1K": temps, "standardisedtraitvalue": traits}) for name, temps, traits, unique_temps, *_ in cases
+                if unique_temps is None}
+    screened = screen_datasets(datasets)
+    expected = {name: reason for name, temps, traits, unique_temps, model_name, reason in cases if unique_temps is None}
+    assert screened["originalid"].tolist() == list(datasets)
+    assert dict(zip(screened["originalid"], screened["screen"])) == expected
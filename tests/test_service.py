@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+""" Fitting service requests, replies and backpressure """
+
+import json
+import socket
+import threading
+import numpy as np
+import pytest
+from tpcfit.service import FitServer, FitClient, ServiceException, default_bounds, fit_batch
+
+def free_address():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return "tcp://127.0.0.1:{}".format(s.getsockname()[1])
+
+def handle(server, message, requests=None):
+    payload = message if isinstance(message, bytes) else json.dumps(message).encode()
+    return server._handle(payload, {} if requests is None else requests, iter(range(100)), b"client")
+
+def curve(i=0):
+    temps = np.linspace(283.15, 313.15, 8)
+    return {"id": "C{}".format(i), "temps": temps.tolist(), "traits": np.exp(-0.6 / 8.617e-5 * (1 / temps - 1 / 283.15)).tolist()}
+
+def test_handle_replies_to_commands():
+    server = FitServer(workers=1, max_pending=4)
+    assert handle(server, b"not json")[0]["status"] == "error"
+    assert handle(server, {"command": "nope"})[0]["status"] == "error"
+    assert handle(server, {"command": "fit", "curves": []}) == ({"status": "ok", "results": []}, [])
+    ping, items = handle(server, {"command": "ping"})
+    assert ping["status"] == "ok" and ping["max_pending"] == 4 and items == []
+
+@pytest.mark.parametrize("message", [[1], "fit", {"curves": {"temps": [1]}}, {"curves": [1]}, {"curves": [{"temps": [1]}]},
+                                     {"curves": [curve()], "iter": "x"}, {"curves": [curve()], "iter": 0},
+                                     {"curves": [curve()], "timeout": "1"}, {"curves": [curve()], "model": 3},
+                                     {"curves": [curve()], "bounds": [0, 1]}, {"curves": [curve()], "bounds": {"E": 1}}])
+def test_handle_rejects_malformed_requests(message):
+    server = FitServer(workers=1, max_pending=4)
+    requests = {}
+    reply, items = handle(server, message, requests)
+    assert reply["status"] == "error" and items == [] and requests == {} and server.stats["pending"] == 0
+
+def test_bad_curve_fails_alone():
+    items = [(0, i, c, "sharpeschoolhigh", default_bounds, 1, None) for i, c in enumerate([curve(0), None])]
+    (_, _, good), (_, _, bad) = fit_batch(items)
+    assert "error" not in good and good["id"] == "C0"
+    assert "error" in bad and bad["id"] == 1
+
+def test_handle_queues_curves_until_max_pending():
+    server = FitServer(workers=1, max_pending=4)
+    requests = {}
+    reply, items = handle(server, {"command": "fit", "curves": [curve(0), curve(1), curve(2)]}, requests)
+    assert reply is None and len(items) == 3 and server.stats["pending"] == 3
+    # Would fit once the pending curves drain
+    reply, items = handle(server, {"command": "fit", "curves": [curve(3), curve(4)]}, requests)
+    assert reply["status"] == "busy" and items == []
+    reply, items = handle(server, {"command": "fit", "curves": [curve(3)]}, requests)
+    assert reply is None and server.stats["pending"] == 4
+
+def test_handle_refuses_requests_larger_than_max_pending():
+    # Even when idle, busy would never clear for these
+    server = FitServer(workers=1, max_pending=2)
+    reply, items = handle(server, {"command": "fit", "curves": [curve(i) for i in range(3)]})
+    assert reply["status"] == "error" and items == [] and server.stats["busy"] == 0
+
+@pytest.fixture
+def server_address():
+    address = free_address()
+    server = FitServer(address, workers=1, batch_size=2, max_pending=3)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    yield address
+    client = FitClient(address, timeout=30)
+    client.stop()
+    client.close()
+    thread.join(30)
+    assert not thread.is_alive()
+
+def test_client_fits_curves_in_order(server_address):
+    client = FitClient(server_address, timeout=60)
+    results = client.fit([curve(0), curve(1)], model="sharpeschoolhigh", iter=1)
+    assert [result["id"] for result in results] == ["C0", "C1"]
+    assert all(result["model_name"] == "sharpeschoolhigh" and np.isfinite(result["aic"]) for result in results)
+    assert client.ping()["curves"] == 2
+    # Too large for the server: an immediate error rather than busy until the timeout
+    with pytest.raises(ServiceException, match="Split it"):
+        client.fit([curve(i) for i in range(4)], model="sharpeschoolhigh", iter=1)
+    client.close()
+
+def test_malformed_request_only_fails_its_client(server_address):
+    bad = FitClient(server_address, timeout=30)
+    with pytest.raises(ServiceException, match="iter"):
+        bad.request({"command": "fit", "curves": [curve(0)], "iter": "x"})
+    with pytest.raises(ServiceException, match="json object"):
+        bad.request([1])
+    bad.close()
+    client = FitClient(server_address, timeout=60)
+    results = client.fit([curve(1)], model="sharpeschoolhigh", iter=1)
+    assert results[0]["id"] == "C1" and np.isfinite(results[0]["aic"])
+    client.close()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+""" Sharded fits merge into the same table whatever the number of shards """
+
+import filecmp
+import json
+import os
+import subprocess
+import sys
+import pytest
+from tpcfit.sharding import merge_shards, write_manifest, shard_of, ShardingException
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, "Data", "eucalyptus.csv")
+
+def run_shards(tmp_path, n_shards):
+    """ Fit every shard of eucalyptus.csv with the pipeline and merge them """
+    paths = []
+    for shard in range(n_shards):
+        path = str(tmp_path / "shard_{}_of_{}.csv".format(shard, n_shards))
+        subprocess.run([sys.executable, "-W", "ignore", os.path.join(ROOT, "pipeline.py"), "-i", DATA, "-o", path,
+                        "--shard", "{}/{}".format(shard, n_shards), "--iter", "1"], check=True, capture_output=True, cwd=str(tmp_path))
+        paths.append(path)
+    merged = str(tmp_path / "merged_{}.csv".format(n_shards))
+    merge_shards(paths, merged)
+    return paths, merged
+
+def test_merge_is_byte_identical_whatever_the_shard_count(tmp_path):
+    merged = {n_shards: run_shards(tmp_path, n_shards) for n_shards in (1, 3, 10)}
+    # 10 shards of 7 curves: some shards are empty and only have a header
+    empty = [path for path in merged[10][0] if len(open(path).read().splitlines()) == 1]
+    assert empty
+    assert filecmp.cmp(merged[1][1], merged[3][1], shallow=False)
+    assert filecmp.cmp(merged[1][1], merged[10][1], shallow=False)
+
+def write_shard(tmp_path, shard, n_shards, text, curves):
+    path = str(tmp_path / "shard_{}.csv".format(shard))
+    with open(path, "w") as f:
+        f.write(text)
+    write_manifest(path, shard, n_shards, curves)
+    return path
+
+@pytest.mark.parametrize("empty_text", ["", "\n", "originalid,screen,aic,E\n"])
+def test_merge_accepts_empty_shards(tmp_path, empty_text):
+    ids = ["MTD{}".format(i) for i in range(20)]
+    curve = next(i for i in ids if shard_of(i, 2) == 0)
+    full = write_shard(tmp_path, 0, 2, "originalid,screen,aic\n{},ok,-3.0\n".format(curve), [curve])
+    empty = write_shard(tmp_path, 1, 2, empty_text, [])
+    with open(empty + ".manifest.json") as f:
+        assert json.load(f)["curves"] == []
+    output = str(tmp_path / "merged.csv")
+    assert merge_shards([full, empty], output) == 1
+    # The empty shard adds no columns
+    with open(output) as f:
+        assert f.read() == "originalid,screen,aic\n{},ok,-3.0\n".format(curve)
+
+def test_merge_rejects_an_incomplete_shard(tmp_path):
+    ids = ["MTD{}".format(i) for i in range(20)]
+    curve = next(i for i in ids if shard_of(i, 1) == 0)
+    path = write_shard(tmp_path, 0, 1, "", [curve])
+    with pytest.raises(ShardingException):
+        merge_shards([path], str(tmp_path / "merged.csv"))
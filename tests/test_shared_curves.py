@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+""" Shared memory and memory-mapped curve blocks round-trip every curve through read-only views, and are released on close """
+
+import os
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from tpcfit.shared_curves import SharedCurves, SharedCurvesException
+from tpcfit.synthetic import synthetic_curves
+
+@pytest.fixture
+def datasets():
+    data, truth = synthetic_curves(5, "sharpeschoolhigh", n_points=9, seed=8)
+    curves = {curve_id: curve for curve_id, curve in data.groupby("originalid", sort=False)}
+    # Curves of different lengths, so offsets matter
+    return {curve_id: curve.iloc[:4 + i] for i, (curve_id, curve) in enumerate(curves.items())}
+
+@pytest.mark.parametrize("memmap", [False, True])
+def test_round_trip_read_only(tmp_path, datasets, memmap):
+    path = str(tmp_path / "curves.dat") if memmap else None
+    curves = SharedCurves.from_datasets(datasets, path=path)
+    # As a worker process attaches to it
+    attached = SharedCurves.attach(*curves.spec())
+    try:
+        assert len(curves) == len(datasets)
+        assert curves.spec() == (sum(len(dataset) for dataset in datasets.values()), None if memmap else curves.name, path)
+        for curve_id, dataset in datasets.items():
+            for block in (curves, attached):
+                temps, traits = block.views(*curves.index[curve_id])
+                np.testing.assert_array_equal(temps, dataset["interactor1K"].to_numpy())
+                np.testing.assert_array_equal(traits, dataset["standardisedtraitvalue"].to_numpy())
+                with pytest.raises(ValueError):
+                    temps[0] = 0.0
+                with pytest.raises(ValueError):
+                    traits[:] = 1.0
+            temps, traits = curves[curve_id]
+            np.testing.assert_array_equal(traits, dataset["standardisedtraitvalue"].to_numpy())
+        with pytest.raises(SharedCurvesException):
+            curves["missing"]
+    finally:
+        attached.close()
+        curves.close()
+        curves.unlink()
+
+def test_shared_memory_released(datasets):
+    curves = SharedCurves.from_datasets(datasets)
+    name = curves.name
+    curves.close()
+    assert curves.data is None
+    curves.unlink()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+def test_memmap_file_released(tmp_path, datasets):
+    path = str(tmp_path / "curves.dat")
+    curves = SharedCurves.from_datasets(datasets, path=path)
+    assert os.path.getsize(path) == 2 * curves.n_points * 8
+    curves.close()
+    assert curves.data is None
+    curves.unlink()
+    assert not os.path.exists(path)
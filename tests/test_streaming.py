@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+""" Streaming pipeline: curves split between input chunks are held back until complete """
+
+import pandas as pd
+import pytest
+from tpcfit.streaming import complete_curves, StreamingPipeline, StreamingException
+
+def make_data():
+    # Curves of 3, 1, 4 and 2 rows
+    ids = ["A"] * 3 + ["B"] + ["C"] * 4 + ["D"] * 2
+    return pd.DataFrame({"originalid": ids, "x": range(len(ids))})
+
+def chunked(data, size):
+    return [data.iloc[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 100])
+def test_curves_are_never_split(size):
+    data = make_data()
+    out = list(complete_curves(chunked(data, size)))
+    # Every curve is in exactly one output chunk, whole
+    seen = {}
+    for i, chunk in enumerate(out):
+        for curve_id, rows in chunk.groupby("originalid"):
+            assert curve_id not in seen
+            seen[curve_id] = i
+            assert list(rows["x"]) == list(data.loc[data["originalid"] == curve_id, "x"])
+    assert sorted(seen) == ["A", "B", "C", "D"]
+    pd.testing.assert_frame_equal(pd.concat(out, ignore_index=True), data)
+
+def test_last_curve_is_held_until_the_next_chunk():
+    data = make_data()
+    chunks = iter(chunked(data, 2))
+    stream = complete_curves(chunks)
+    # The first chunk (A, A) could continue, so nothing is released yet; the second (A, B) completes A
+    first = next(stream)
+    assert list(first["originalid"]) == ["A", "A", "A"]
+
+def test_non_contiguous_curves_are_rejected():
+    data = pd.DataFrame({"originalid": ["A", "A", "B", "B", "A", "C"], "x": range(6)})
+    with pytest.raises(StreamingException):
+        list(complete_curves(chunked(data, 2)))
+
+def count_rows(curve_id, dataset):
+    return {"originalid": curve_id, "rows": len(dataset)}
+
+class Collect(object):
+    def __init__(self):
+        self.results = []
+
+    def __call__(self, result):
+        self.results.append(result)
+
+def split_curves(chunks):
+    for data in complete_curves(chunks):
+        for curve_id, dataset in data.groupby("originalid", sort=False):
+            yield curve_id, dataset
+
+def test_pipeline_fits_every_curve_whole():
+    data = make_data()
+    write = Collect()
+    pipeline = StreamingPipeline(read=lambda: chunked(data, 3), clean=split_curves, fit_func=count_rows, write=write, workers=1, queue_size=2)
+    assert pipeline.run() == 4
+    assert {r["originalid"]: r["rows"] for r in write.results} == {"A": 3, "B": 1, "C": 4, "D": 2}
+    assert len(pipeline.summary()) == len(pipeline.stats) + len(pipeline.queue_depths)
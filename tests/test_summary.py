@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+""" Default bounds of bootstrap_summary only apply to activation energies """
+
+import numpy as np
+import pandas as pd
+from tpcfit.summary import bootstrap_summary
+
+table = pd.DataFrame({"standardisedtraitname": ["a"] * 6,
+                      "E": [-0.2, 0.4, 0.6, 2.5, 3.5, np.nan],
+                      "Th": [290.0, 300.0, 305.0, 310.0, 315.0, 320.0]})
+
+def test_energies_keep_default_bounds():
+    assert bootstrap_summary(table, value_col="E", n_boot=50)["n"].tolist() == [3]
+    assert bootstrap_summary(table, value_col="E", n_boot=50, bounds=(-10, 10))["n"].tolist() == [5]
+
+def test_other_columns_are_not_bounded():
+    summary = bootstrap_summary(table, value_col="Th", n_boot=50)
+    assert summary["n"].tolist() == [6]
+    assert summary["trait_mean"].iloc[0] == table["Th"].mean()
+    assert bootstrap_summary(table, value_col="Th", n_boot=50, bounds=(295, 312))["n"].tolist() == [3]
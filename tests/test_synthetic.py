@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+""" Synthetic curves follow the equations the models are fitted with, including the Th >= Tl + 1 projection of the full model """
+
+import numpy as np
+import pytest
+from conftest import models
+from tpcfit import model_funcs
+from tpcfit.synthetic import schoolfield_log, schoolfield_log_jacobian, schoolfield_project, synthetic_curves, truth_bounds
+
+def test_true_parameters_are_never_projected():
+    # So the generated curves don't depend on the projection
+    assert truth_bounds["Th"][0] > truth_bounds["Tl"][1] + 1
+    data, truth = synthetic_curves(20, "sharpeschoolfull", seed=2)
+    assert np.all(truth["Th"] >= truth["Tl"] + 1)
+    projected = schoolfield_project("sharpeschoolfull", truth.to_dict("series"))
+    np.testing.assert_array_equal(projected["Th"], truth["Th"])
+
+def test_project_moves_th_of_the_full_model_only():
+    params = {"B0": 0.5, "E": 0.6, "Eh": 3.0, "El": 2.0, "Th": np.array([290.0, 296.0, 310.0]), "Tl": np.array([295.0, 295.0, 295.0])}
+    projected = schoolfield_project("sharpeschoolfull", params)
+    np.testing.assert_array_equal(projected["Th"], [296.0, 296.0, 310.0])
+    # A copy: the caller's values are left alone
+    np.testing.assert_array_equal(params["Th"], [290.0, 296.0, 310.0])
+    assert schoolfield_project("sharpeschoolhigh", params) is params
+
+@pytest.mark.parametrize("Th", [290.0, 305.0])
+def test_log_traits_match_the_fitted_residuals(Th):
+    model_class, fcn2min = models["sharpeschoolfull"]
+    data, truth = synthetic_curves(1, "sharpeschoolfull", n_points=12, seed=5)
+    temps, traits = data["interactor1K"].to_numpy(), data["standardisedtraitvalue"].to_numpy()
+    values = dict(truth.iloc[0], Th=Th, Tl=295.0)
+    params = model_funcs("sharpeschoolfull")[1]()
+    for name, value in values.items():
+        params[name].set(value=value)
+    residuals = getattr(model_class(temps, traits, params), fcn2min)(params, temps, traits)
+    np.testing.assert_allclose(schoolfield_log("sharpeschoolfull", temps, values), residuals + np.log(traits), rtol=1e-10)
+
+def test_jacobian_follows_the_projection():
+    temps = np.linspace(278.15, 318.15, 9)
+    params = {"B0": 0.5, "E": 0.6, "Eh": 3.0, "El": 2.0, "Th": 290.0, "Tl": 295.0}
+    log_traits, derivatives = schoolfield_log_jacobian("sharpeschoolfull", temps, params)
+    np.testing.assert_allclose(log_traits, schoolfield_log("sharpeschoolfull", temps, params))
+    # Th is below Tl + 1, so it doesn't move the curve and Tl moves both deactivation terms
+    np.testing.assert_array_equal(derivatives["Th"], 0.0)
+    h = 1e-6
+    numeric = (schoolfield_log("sharpeschoolfull", temps, dict(params, Tl=params["Tl"] + h)) -
+               schoolfield_log("sharpeschoolfull", temps, dict(params, Tl=params["Tl"] - h))) / (2 * h)
+    np.testing.assert_allclose(derivatives["Tl"], numeric, rtol=1e-5, atol=1e-8)
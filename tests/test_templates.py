@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+""" Template libraries survive a save/load round trip, and template starts that converge replace random restarts """
+
+import numpy as np
+import pytest
+from pipeline import vals
+from tpcfit.general_funcs import fit_tpc, resample_model
+from tpcfit.synthetic import synthetic_curves
+from tpcfit.templates import TemplateLibrary, TemplateException, template_params
+
+def curve_arrays(data, curve_id):
+    curve = data[data["originalid"] == curve_id]
+    return curve["interactor1K"].values, curve["standardisedtraitvalue"].values
+
+@pytest.fixture
+def library():
+    data, truth = synthetic_curves(6, "sharpeschoolhigh", n_points=10, seed=3)
+    library = TemplateLibrary()
+    for curve_id, estimates in truth.iterrows():
+        temps, traits = curve_arrays(data, curve_id)
+        assert library.add(curve_id, "sharpeschoolhigh", temps, traits, estimates.to_dict())
+    return library, data
+
+def test_save_load_round_trip(tmp_path, library):
+    library, data = library
+    path = str(tmp_path / "templates.npz")
+    library.save(path)
+    loaded = TemplateLibrary.load(path)
+
+    assert len(loaded) == len(library)
+    assert repr(loaded) == repr(library)
+    np.testing.assert_array_equal(loaded.grid, library.grid)
+    for model_name in template_params:
+        assert sorted(loaded._entries[model_name]) == sorted(library._entries[model_name])
+        for curve_id, (features, peak, values) in library._entries[model_name].items():
+            loaded_features, loaded_peak, loaded_values = loaded._entries[model_name][curve_id]
+            np.testing.assert_array_equal(loaded_features, features)
+            assert loaded_peak == peak
+            np.testing.assert_array_equal(loaded_values, values)
+
+    # The loaded library gives the same starts, and still takes new fits
+    for curve_id in data["originalid"].unique():
+        temps, traits = curve_arrays(data, curve_id)
+        assert loaded.starts("sharpeschoolhigh", temps, traits, 3) == library.starts("sharpeschoolhigh", temps, traits, 3)
+    temps, traits = curve_arrays(data, data["originalid"].iloc[0])
+    estimates = dict(zip(template_params["sharpeschoolfull"], [1.0, 0.6, 3.0, 1.0, 305.0, 280.0]))
+    assert loaded.add("new", "sharpeschoolfull", temps, traits, estimates)
+    assert "new" in loaded and len(loaded) == len(library) + 1
+
+def test_load_missing_and_wrong_version(tmp_path):
+    path = str(tmp_path / "templates.npz")
+    assert len(TemplateLibrary.load(path)) == 0
+    with pytest.raises(FileNotFoundError):
+        TemplateLibrary.load(path, missing_ok=False)
+    np.savez(path, version=np.array(99), grid=np.zeros(3))
+    with pytest.raises(TemplateException):
+        TemplateLibrary.load(path)
+
+def test_add_rejects_bad_estimates(library):
+    library, data = library
+    temps, traits = curve_arrays(data, data["originalid"].iloc[0])
+    assert not library.add("nan", "sharpeschoolhigh", temps, traits, {"B0": np.nan, "E": 0.6, "Eh": 3.0, "Th": 305.0})
+    assert not library.add("missing", "sharpeschoolhigh", temps, traits, {"B0": 1.0})
+    with pytest.raises(TemplateException):
+        library.add("unknown", "arrhenius", temps, traits, {})
+
+def evaluations_to_best(records, aic):
+    """ Function evaluations spent until a restart first reached aic """
+    nfev = 0
+    for record in records:
+        nfev += record["nfev"]
+        if record["aic"] is not None and record["aic"] <= aic + 1e-6:
+            return nfev
+
+def test_template_starts_need_fewer_evaluations(library):
+    library, data = library
+    curves, truth = synthetic_curves(8, "sharpeschoolhigh", n_points=10, seed=11)
+    plain_nfev, template_nfev = 0, 0
+    for curve_id in truth.index:
+        temps, traits = curve_arrays(curves, curve_id)
+        plain, with_templates = [], []
+        plain_fit = fit_tpc(temps, traits, vals, model_name="sharpeschoolhigh", iter=3, seed=1, metrics=plain)
+        template_fit = fit_tpc(temps, traits, vals, model_name="sharpeschoolhigh", iter=3, seed=1, metrics=with_templates, templates=library, n_templates=3)
+
+        # The same fit, with converged template starts taking the place of random restarts rather than adding to them
+        assert template_fit["aic"] == pytest.approx(plain_fit["aic"], abs=1e-6)
+        assert len(with_templates) == len(plain)
+        assert [record["start"] for record in with_templates] == library.starts("sharpeschoolhigh", temps, traits, 3)
+        plain_nfev += evaluations_to_best(plain, plain_fit["aic"])
+        template_nfev += evaluations_to_best(with_templates, template_fit["aic"])
+    assert template_nfev < plain_nfev
+
+def test_failed_starts_fall_back_to_random_restarts():
+    data, truth = synthetic_curves(1, "sharpeschoolhigh", n_points=10, seed=3)
+    temps, traits = curve_arrays(data, truth.index[0])
+    records = []
+    bad = [{"B0": np.nan, "E": 0.5, "Eh": 3.0, "Th": 305.0}, {"B0": np.inf}]
+    best = resample_model("sharpeschoolhigh", vals=vals, temps=temps, traits=traits, iter=2, metrics=records, starts=bad)
+    assert [record["status"] for record in records[:2]] == ["error", "error"]
+    assert len(records) == 4 and best.restart > 2
@@ -1,6 +1,57 @@
 #!/usr/bin/env python3
+""" tpcfit fits mechanistic models to thermal performance curves.
 
-# import all modules
-from tpcfit.starting_parameters import *
-from tpcfit.models import *
-from tpcfit.general_funcs import *
+Submodules are only imported when one of their names is first used (e.g. tpcfit.ResultsStore), and the heavy dependencies (lmfit, scipy.stats, pandas) only when they are needed, so importing tpcfit and running tools that don't fit curves stays cheap. The public API is the names below; `from tpcfit import *` imports all of them. The fitting service (tpcfit.service, needs pyzmq) is imported explicitly."""
+
+import importlib
+
+# Public names of each submodule
+_api = {
+    "starting_parameters": ("StartParamsException", "StartParams"),
+    "models": ("ThermalModelsException", "ResidualWorkspace", "ThermalModels", "SharpeSchoolfieldFull", "SharpeSchoolfieldHigh",
+               "SharpeSchoolfieldLow", "SharpeSchoolfieldlow"),
+    "general_funcs": ("restart_timeout", "start_params", "resample_ssf", "resample_ssh", "resample_ssl", "ssf_init", "ssh_init", "ssl_init",
+                      "resample_class", "model_funcs", "resample_model", "resample_funcs", "screened_models", "start_bounds", "fit_tpc",
+                      "refit_tpc", "get_datasets"),
+    "results_store": ("ResultsStoreException", "ResultsStore"),
+    "screening": ("SCREEN_OK", "SCREEN_FEW_TEMPS_FULL", "SCREEN_NO_HIGH_PEAK", "SCREEN_TOO_FEW_TEMPS", "SCREEN_NONPOSITIVE",
+                  "SCREEN_FLAT", "SCREEN_NO_RISE", "SCREEN_FIT_FAILED", "min_temps", "screen_curve", "screen_datasets"),
+    "shared_curves": ("SharedCurvesException", "SharedCurves"),
+    "scheduler": ("model_params", "estimate_costs", "make_batches", "CurveScheduler"),
+    "sharding": ("nondeterministic_cols", "leading_cols", "ShardingException", "curve_hash", "curve_seed", "shard_of",
+                 "parse_shard", "select_shard", "manifest_path", "write_manifest", "merge_shards"),
+    "streaming": ("StreamingException", "complete_curves", "StreamingPipeline"),
+    "synthetic": ("truth_bounds", "synthetic_models", "SyntheticException", "schoolfield_project", "schoolfield_log", "schoolfield_log_jacobian", "synthetic_curves",
+                  "synthetic_datasets", "recovery_error"),
+    "instrumentation": ("metric_cols", "fit_hooks", "add_fit_hook", "remove_fit_hook", "logging_hook", "fit_record",
+                        "metrics_table", "hot_curves"),
+    "progress": ("ProgressException", "fit_status", "format_duration", "ProgressReporter"),
+    "grouping": ("group_cols", "GroupingException", "group_key", "group_curves", "WarmStarts"),
+    "joint": ("joint_bounds", "JointFitException", "JointFit", "fit_joint_groups"),
+    "batched": ("BatchedException", "batched_lm", "BatchedModel", "BatchedSchoolfield", "best_model", "random_starts", "fit_batched"),
+    "crossval": ("CrossValidationException", "CrossValidation", "cross_validate", "cv_best_models"),
+    "profile_likelihood": ("profile_widths", "ProfileException", "ProfileLikelihood", "profile_fits"),
+    "plotting": ("plot_formats", "curve_points", "PlottingException", "model_curve", "CurvePlotter", "get_plotter", "render_pngs",
+                 "render_sheets", "plot_fits"),
+    "registry": ("expression_constants", "expression_functions", "RegistryException", "parse_expression", "variables", "log_expression", "differentiate",
+                 "compile_kernels", "RegisteredModel", "registered_models", "register_model"),
+    "summary": ("summary_stats", "estimate_bounds", "energy_cols", "SummaryException", "stat_name", "bootstrap_stats", "latitude_band",
+                "bootstrap_summary"),
+    "templates": ("template_params", "shape_grid", "TemplateException", "shape_features", "TemplateLibrary", "load_templates"),
+}
+
+# Public name -> submodule
+_where = {name: module for module, names in _api.items() for name in names}
+
+__all__ = sorted(_where)
+
+def __getattr__(name):
+    """ Import the submodule defining a public name on first use """
+    if name not in _where:
+        raise AttributeError("module 'tpcfit' has no attribute '{}'".format(name))
+    value = getattr(importlib.import_module("tpcfit." + _where[name]), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
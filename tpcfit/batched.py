@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" batched.py fits many small problems of the same Schoolfield model (curves x restarts) together with a vectorised Levenberg-Marquardt solver.
+
+lmfit drives one problem at a time through MINPACK, so the Python-level work of every iteration (parameter objects, residual calls, bookkeeping) is paid once per curve per restart, which dominates for 4-6 parameter problems of ~20 points. Here every iteration advances all problems at once: curves are padded to the same number of points, the residuals and analytic Jacobians of all problems come from one vectorised evaluation, and the damped Gauss-Newton systems are solved together. Each problem has its own damping, parameters held at a bound by the descent direction are left out of its step and the rest of the step is projected onto the bounds (B0 is stepped on a log scale, so it stays positive), Th is kept 1 K above Tl as ssf_fcn2min keeps it, infeasible trial steps (E >= Eh) are rejected, and problems leave the active set as they converge.
+
+Starting parameters are drawn from the same truncated normals as StartParams (with a numpy generator seeded per curve, which is much cheaper than scipy's frozen distributions). B0 only shifts the log model, so each start's B0 is first rescaled to the level of the curve's data: without it, most restarts of the full model spend their first steps on B0 and end on the E = Eh boundary. Each fitted problem has the estimates/AIC interface of the lmfit models (final_estimates, AIC, fit_result.nfev, ...). Time budgets, templates and warm starts are not supported.
+
+Example :
+    >>> results = fit_batched(datasets, vals, iter=5)
+    >>> models = BatchedSchoolfield("sharpeschoolhigh").fit([(temps, traits)], [[start_1, start_2]])
+"""
+
+import time
+import numpy as np
+from tpcfit.synthetic import schoolfield_log, schoolfield_log_jacobian, synthetic_models
+from tpcfit.joint import joint_bounds
+from tpcfit.screening import screen_curve, SCREEN_FIT_FAILED
+from tpcfit.sharding import curve_seed
+
+class BatchedException(Exception):
+    """ General purpose exception generator for batched fitting"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def batched_lm(evaluate, theta, free, lower, upper, log_cols, feasible=None, project=None, ftol=1e-12, xtol=1e-12, max_iter=200):
+    """ Levenberg-Marquardt iterations of many small least-squares problems in lockstep
+
+    Parameters
+    ----------
+    evaluate: callable
+        evaluate(problems, theta) -> (residuals, jac) of some problems at parameters theta (one row per problem):
+        residuals problems x points, jac problems x points x parameters (both 0 at padding)
+    theta: numpy array
+        Starting parameters (problems x parameters); columns that aren't free keep their values
+    free: numpy array
+        Columns varied in each problem (problems x free parameters)
+    lower, upper: numpy array
+        Bounds of each parameter
+    log_cols: numpy array
+        True for parameters stepped on a log scale (they must be positive)
+    feasible: callable, optional
+        feasible(theta) -> True for rows of parameters inside the feasible region; other trial steps are rejected
+    project: callable, optional
+        project(theta) -> parameters moved into the feasible region, applied to the starts and to every trial step after the bounds
+    ftol, xtol: float
+        Relative reduction of the residual sum of squares, and relative step, below which a problem has converged
+    max_iter: int
+        Maximum number of iterations
+
+    Returns
+    -------
+    theta: numpy array
+        Fitted parameters of each problem
+    rss: numpy array
+        Residual sum of squares of each problem (inf for problems that started outside the feasible region)
+    nfev: numpy array
+        Residual and Jacobian evaluations of each problem
+    converged: numpy array
+        False for problems stopped by max_iter
+    """
+    theta = np.array(theta, dtype=float)
+    n_problems, n_params = theta.shape
+    n_free = free.shape[1]
+    rows = np.arange(n_problems)[:, None]
+    u_lower = np.where(log_cols, np.log(np.maximum(lower, 1e-300)), lower)[free]
+    u_upper = np.where(log_cols, np.log(np.maximum(upper, 1e-300)), upper)[free]
+    theta[rows, free] = np.clip(theta[rows, free], lower[free], upper[free])
+    if project is not None:
+        theta = project(theta)
+
+    residuals, jac = evaluate(np.arange(n_problems), theta)
+    rss = np.sum(residuals ** 2, axis=1)
+    if feasible is not None:
+        rss[~feasible(theta)] = np.inf
+    rss[~np.isfinite(rss)] = np.inf
+    damping = np.full(n_problems, 1e-3)
+    nfev = np.ones(n_problems, dtype=int)
+    converged = np.zeros(n_problems, dtype=bool)
+    active = np.flatnonzero(np.isfinite(rss))
+    converged[~np.isfinite(rss)] = True
+
+    for iteration in range(max_iter):
+        if not len(active):
+            break
+        a_free = free[active]
+        a_rows = np.arange(len(active))[:, None]
+        # Damped Gauss-Newton systems of the free parameters (log-scale columns by the chain rule)
+        chain = np.where(log_cols, theta[active], 1.0)
+        J = np.take_along_axis(jac[active] * chain[:, None, :], a_free[:, None, :], axis=2)
+        jtj = np.einsum("pni,pnj->pij", J, J)
+        gradient = np.einsum("pni,pn->pi", J, residuals[active])
+        diagonal = np.einsum("pii->pi", jtj)
+        diagonal = np.maximum(diagonal, 1e-12 * np.maximum(diagonal.max(axis=1, keepdims=True), 1e-300))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            u = np.where(log_cols, np.log(theta[active]), theta[active])
+        u_free = np.take_along_axis(u, a_free, axis=1)
+        # Parameters at a bound the descent direction points out of stay there (the rest are stepped without them)
+        blocked = ((u_free <= u_lower[active]) & (gradient > 0)) | ((u_free >= u_upper[active]) & (gradient < 0))
+        jtj = np.where(blocked[:, :, None] | blocked[:, None, :], 0.0, jtj)
+        gradient = np.where(blocked, 0.0, gradient)
+        system = jtj + np.eye(n_free) * (damping[active, None] * diagonal)[:, None, :]
+        with np.errstate(invalid="ignore", over="ignore"):
+            try:
+                step = -np.linalg.solve(system, gradient[..., None])[..., 0]
+            except np.linalg.LinAlgError:
+                step = np.full(gradient.shape, np.nan)
+
+        # Project the step onto the bounds
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            trial_free = np.clip(u_free + step, u_lower[active], u_upper[active])
+            trial = theta[active].copy()
+            trial[a_rows, a_free] = np.where(log_cols[a_free], np.exp(trial_free), trial_free)
+        if project is not None:
+            trial = project(trial)
+            trial_free = np.take_along_axis(np.where(log_cols, np.log(trial), trial), a_free, axis=1)
+        trial_residuals, trial_jac = evaluate(active, trial)
+        trial_rss = np.sum(trial_residuals ** 2, axis=1)
+        if feasible is not None:
+            trial_rss[~feasible(trial)] = np.inf
+        nfev[active] += 1
+
+        better = trial_rss < rss[active]
+        accepted = active[better]
+        done = better & ((rss[active] - trial_rss <= ftol * rss[active]) |
+                         np.all(np.abs(trial_free - u_free) <= xtol * (np.abs(u_free) + xtol), axis=1))
+        theta[accepted], rss[accepted] = trial[better], trial_rss[better]
+        residuals[accepted], jac[accepted] = trial_residuals[better], trial_jac[better]
+        damping[accepted] = np.maximum(damping[accepted] / 3, 1e-12)
+        damping[active[~better]] *= 4
+        # A problem no damping can improve is at a (possibly bounded) minimum
+        done |= damping[active] >= 1e12
+        converged[active[done]] = True
+        active = active[~done]
+    return theta, rss, nfev, converged
+
+class BatchedModel(object):
+    """ One fitted problem of a batched fit, with the estimates/AIC interface of the lmfit models """
+
+    def __init__(self, model_name, temps, traits, estimates, initial_params, rss, nfev, success):
+        """
+        Parameters
+        ----------
+        model_name: str
+            Schoolfield model
+        temps: numpy array
+            Temperatures in Kelvin
+        traits: numpy array
+            Trait values
+        estimates: dict
+            Fitted parameters
+        initial_params: dict
+            Starting parameters
+        rss: float
+            Residual sum of squares (log scale)
+        nfev: int
+            Residual and Jacobian evaluations
+        success: bool
+            Whether the solver converged
+        """
+        self.model_name = model_name
+        self.temps, self.traits = temps, traits
+        self.final_estimates = estimates
+        self.initial_params = initial_params
+        self.timed_out = False
+        ndata, nvarys = len(temps), len(estimates)
+        # Same statistics as lmfit.MinimizerResult
+        self.fit_result = _FitResult(nfev=nfev, ndata=ndata, nvarys=nvarys, chisqr=rss, success=success,
+                                     aic=ndata * np.log(rss / ndata) + 2 * nvarys, bic=ndata * np.log(rss / ndata) + np.log(ndata) * nvarys,
+                                     message="Converged" if success else "Maximum number of iterations reached")
+        self.AIC = self.fit_result.aic
+        self.fits = np.exp(schoolfield_log(model_name, temps, estimates))
+
+    def mean_square(self):
+        """ Mean squared residual of the fit (log scale) """
+        return self.fit_result.chisqr / self.fit_result.ndata
+
+    def __repr__(self):
+        return "BatchedModel('{}', AIC={:.3f})".format(self.model_name, self.AIC)
+
+class _FitResult(object):
+    """ Fit statistics of a BatchedModel, named as in lmfit.MinimizerResult """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class BatchedSchoolfield(object):
+    """ Fits many curves and restarts of one Schoolfield model in lockstep """
+
+    def __init__(self, model_name="sharpeschoolhigh", ftol=1e-12, xtol=1e-12, max_iter=200):
+        """
+        Parameters
+        ----------
+        model_name: str
+            Schoolfield model
+        ftol, xtol: float
+            Convergence tolerances (see batched_lm)
+        max_iter: int
+            Maximum number of iterations
+        """
+        if model_name not in synthetic_models:
+            raise BatchedException("Unknown model '{}'. Choose from {}".format(model_name, sorted(synthetic_models)))
+        self.model_name = model_name
+        self.param_names = synthetic_models[model_name].param_names
+        self.ftol, self.xtol, self.max_iter = ftol, xtol, max_iter
+        self.lower = np.array([joint_bounds[name][0] for name in self.param_names])
+        self.upper = np.array([joint_bounds[name][1] for name in self.param_names])
+        self.log_cols = np.array([name == "B0" for name in self.param_names])
+
+    def pad(self, curves):
+        """ Temperatures, log traits and mask of the curves, padded to the longest (padding repeats a curve's points and is masked out) """
+        n_points = np.array([len(temps) for temps, traits in curves])
+        self.mask = np.arange(n_points.max())[None, :] < n_points[:, None]
+        self.temps = np.array([np.resize(np.asarray(temps, dtype=float), self.mask.shape[1]) for temps, traits in curves])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.log_traits = np.log(np.array([np.resize(np.asarray(traits, dtype=float), self.mask.shape[1]) for temps, traits in curves]))
+
+    def evaluate(self, curves, theta):
+        """ Residuals and Jacobian of curves (indices into the padded curves) at parameters theta, one row per curve
+
+        Returns
+        -------
+        residuals: numpy array
+            Curves x points (0 at padding)
+        jac: numpy array
+            Curves x points x parameters
+        """
+        params = {name: theta[:, j, None] for j, name in enumerate(self.param_names)}
+        with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+            log_model, derivatives = schoolfield_log_jacobian(self.model_name, self.temps[curves], params)
+        mask = self.mask[curves]
+        residuals = np.where(mask, log_model - self.log_traits[curves], 0.0)
+        jac = np.stack([np.where(mask, derivatives[name], 0.0) for name in self.param_names], axis=2)
+        return residuals, jac
+
+    def feasible(self, theta):
+        """ True for rows of parameters with E below Eh, as the lmfit models require """
+        if "Eh" not in self.param_names:
+            return np.ones(len(theta), dtype=bool)
+        return theta[:, self.param_names.index("E")] < theta[:, self.param_names.index("Eh")]
+
+    def project(self, theta):
+        """ Parameters with Th at least 1 K above Tl, moved as ssf_fcn2min moves them (other models are unchanged) """
+        if "Tl" not in self.param_names or "Th" not in self.param_names:
+            return theta
+        th, tl = self.param_names.index("Th"), self.param_names.index("Tl")
+        theta = theta.copy()
+        theta[:, th] = np.maximum(theta[:, th], theta[:, tl] + 1)
+        return theta
+
+    def fit(self, curves, starts):
+        """ Fit every curve from each of its starting points
+
+        Parameters
+        ----------
+        curves: list of tuples
+            (temps, traits) of each curve, with positive traits
+        starts: list of lists of dicts
+            Starting parameters of each restart of each curve
+
+        Returns
+        -------
+        models: list of lists
+            BatchedModel of each restart of each curve (None where the start was infeasible or the fit isn't finite).
+            initial_params have B0 rescaled to the level of the data.
+        """
+        self.pad(curves)
+        curve = np.array([c for c, curve_starts in enumerate(starts) for start in curve_starts], dtype=int)
+        theta = np.array([[start[name] for name in self.param_names] for curve_starts in starts for start in curve_starts], dtype=float)
+        models = [[None] * len(curve_starts) for curve_starts in starts]
+        if not len(curve):
+            return models
+        restart = np.concatenate([np.arange(len(curve_starts)) for curve_starts in starts])
+        free = np.broadcast_to(np.arange(len(self.param_names)), theta.shape)
+        # B0 is refitted on a log scale, so starts need a positive B0
+        theta[:, self.log_cols] = np.where(theta[:, self.log_cols] > 0, theta[:, self.log_cols], np.nan)
+
+        # B0 only shifts the log model, so rescale it to the level of the data before iterating
+        scaled = np.nan_to_num(theta, nan=1e-12)
+        residuals, jac = self.evaluate(curve, scaled)
+        b0 = self.param_names.index("B0")
+        with np.errstate(over="ignore", invalid="ignore"):
+            theta[:, b0] *= np.exp(-residuals.sum(axis=1) / self.mask[curve].sum(axis=1))
+
+        initial = theta.copy()
+        fitted, rss, nfev, converged = batched_lm(lambda problems, values: self.evaluate(curve[problems], values), np.nan_to_num(theta, nan=1e-12), free,
+                                                  self.lower, self.upper, self.log_cols, self.feasible, self.project, self.ftol, self.xtol, self.max_iter)
+        ok = np.isfinite(rss) & np.all(np.isfinite(initial), axis=1) & np.all(np.isfinite(fitted), axis=1)
+        for p in np.flatnonzero(ok):
+            c = curve[p]
+            temps, traits = curves[c]
+            models[c][restart[p]] = BatchedModel(self.model_name, np.asarray(temps, dtype=float), np.asarray(traits, dtype=float),
+                                                 dict(zip(self.param_names, fitted[p])), dict(zip(self.param_names, initial[p])),
+                                                 rss[p], nfev[p], converged[p])
+        return models
+
+def best_model(models):
+    """ Restart with the lowest AIC, as resample_class chooses it
+
+    Parameters
+    ----------
+    models: list
+        BatchedModel of each restart (None for failed restarts)
+
+    Returns
+    -------
+    best_model: BatchedModel
+        With restart (counting from 1) and nfev_total set, or None if every restart failed
+    """
+    fitted = [(i, model) for i, model in enumerate(models) if model is not None]
+    if not fitted:
+        return None
+    best_aic = min(model.AIC for i, model in fitted)
+    for i, model in fitted:
+        if model.AIC == best_aic:
+            best, best.restart = model, i + 1
+    best.nfev_total = sum(model.fit_result.nfev for i, model in fitted)
+    return best
+
+def random_starts(param_names, vals, iter=5, rng=None):
+    """ Random starting parameters drawn like StartParams: a normal centred on each sampling range, with half its width as standard deviation, truncated to the range
+
+    Parameters
+    ----------
+    param_names: tuple
+        Parameters of the model
+    vals: dict
+        dictionary of sampling bounds
+    iter: int
+        Number of restarts
+    rng: numpy Generator, optional
+        Random generator
+
+    Returns
+    -------
+    starts: list of dicts
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    low = np.array([vals[name][0] for name in param_names], dtype=float)
+    upp = np.array([vals[name][1] for name in param_names], dtype=float)
+    # Standard normal draws within one standard deviation, by rejection
+    draws = rng.standard_normal((iter, len(param_names)))
+    outside = np.abs(draws) > 1
+    while outside.any():
+        draws[outside] = rng.standard_normal(outside.sum())
+        outside = np.abs(draws) > 1
+    values = (low + upp) / 2 + draws * (upp - low) / 2
+    return [dict(zip(param_names, row)) for row in values]
+
+def fit_batched(datasets, vals, model_name=None, iter=5, seed=0, batch_size=1000, temps_col="interactor1K", traits_col="standardisedtraitvalue"):
+    """ Screen and fit every curve, advancing the restarts of many curves together
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    vals: dict
+        dictionary of sampling bounds
+    model_name: str, optional
+        Schoolfield model fitted to every curve (default: chosen per curve by screening)
+    iter: int
+        Number of random restarts per curve
+    seed: int
+        Base random seed; each curve's starts are drawn from curve_seed(originalid, seed)
+    batch_size: int
+        Curves fitted together at most (bounds memory)
+    temps_col, traits_col: str
+        Temperature (K) and trait columns
+
+    Returns
+    -------
+    results: list of dicts
+        As fit_tpc (screening reason code, model name, fit time, AIC, nfev, number of points and estimates), in the order of datasets.
+        fit_time is the time of the curve's batch shared equally between its curves.
+    """
+    if model_name is not None and model_name not in synthetic_models:
+        raise BatchedException("Batched fitting supports the Schoolfield models only, not '{}'".format(model_name))
+    results, pending = {}, {}
+    for curve_id, dataset in datasets.items():
+        temps, traits = np.array(dataset[temps_col], dtype=float), np.array(dataset[traits_col], dtype=float)
+        unique_temps = dataset["unique_temps"].iloc[0] if "unique_temps" in dataset.columns else None
+        result = {"originalid": curve_id}
+        if model_name is None:
+            curve_model, result["screen"] = screen_curve(temps, traits, unique_temps)
+        else:
+            curve_model, result["screen"] = model_name, None
+        result["model_name"] = curve_model
+        results[curve_id] = result
+        if curve_model is not None:
+            starts = random_starts(synthetic_models[curve_model].param_names, vals, iter, np.random.default_rng(curve_seed(curve_id, seed)))
+            pending.setdefault(curve_model, []).append((curve_id, temps, traits, starts))
+
+    for curve_model, curves in pending.items():
+        solver = BatchedSchoolfield(curve_model)
+        for first in range(0, len(curves), batch_size):
+            batch = curves[first:first + batch_size]
+            start = time.perf_counter()
+            models = solver.fit([(temps, traits) for curve_id, temps, traits, starts in batch], [starts for curve_id, temps, traits, starts in batch])
+            fit_time = (time.perf_counter() - start) / len(batch)
+            for (curve_id, temps, traits, starts), curve_models in zip(batch, models):
+                result = results[curve_id]
+                result["fit_time"] = fit_time
+                best = best_model(curve_models)
+                if best is None:
+                    result["screen"] = SCREEN_FIT_FAILED
+                    continue
+                result.update({"aic": best.AIC, "timed_out": best.timed_out, "nfev": best.fit_result.nfev, "nfev_total": best.nfev_total, "n_points": best.fit_result.ndata})
+                result.update(best.final_estimates)
+    return [results[curve_id] for curve_id in datasets]
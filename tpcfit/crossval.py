@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" crossval.py estimates the out-of-sample prediction error of Schoolfield fits by k-fold or leave-one-out cross-validation.
+
+AIC compares the full, high and low models by their in-sample fit and a parameter count, which says little on sparse curves where an extra deactivation term can bend through a single point. Cross-validation refits each model without each fold of a curve's points and scores the predictions of the held-out points (on the log scale the models are fitted on), so a model is only preferred if it predicts points it hasn't seen.
+
+Refitting every fold from random restarts would cost a full fit per fold. Instead each fold starts from the curve's full-data optimum, which is close to the fold's own, and the fold refits of all curves are solved together by the batched Levenberg-Marquardt solver of batched.py, so most folds converge in a few lockstep iterations. With approx=True, leave-one-out errors are approximated without any refit from the hat matrix of the full-data fit: the held-out residual of point i is r_i / (1 - h_ii), with h_ii the leverage of the point in the linearised problem (parameters at a bound are left out). The approximation only holds where the model is close to linear in its parameters over the change a single point makes, i.e. on dense, well-determined curves. On sparse or strongly curved fits it can be far off (on MTD4543 of Data/eucalyptus.csv it gives a cv_rmse of 10.2 where refitting gives 0.45), so use it to screen many curves and refit the ones that matter.
+
+Example :
+    >>> errors, points = cross_validate(datasets, pd.read_csv("Results/fits.csv"), vals=vals, models=("sharpeschoolfull", "sharpeschoolhigh"), folds=5)
+    >>> cv_best_models(errors)
+"""
+
+import time
+import numpy as np
+from tpcfit.lazy_imports import lazy_import
+from tpcfit.synthetic import schoolfield_log, synthetic_models
+from tpcfit.batched import BatchedSchoolfield, fit_batched
+from tpcfit.sharding import curve_seed
+
+# Imported on first use
+pd = lazy_import("pandas")
+
+class CrossValidationException(Exception):
+    """ General purpose exception generator for cross-validation"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+class CrossValidation(object):
+    """ Cross-validated prediction errors of the fits of one Schoolfield model to many curves """
+
+    def __init__(self, model_name, folds=None, approx=False, seed=0, batch_size=4096, ftol=1e-10, xtol=1e-10, max_iter=200):
+        """
+        Parameters
+        ----------
+        model_name: str
+            Schoolfield model
+        folds: int, optional
+            Number of folds (default: leave-one-out). Curves with fewer points are left out one point at a time.
+        approx: bool
+            Approximate leave-one-out errors from the hat matrix of the full-data fits instead of refitting (folds is then ignored).
+            Only valid where the fits are close to linear around their optimum (see the module docstring).
+        seed: int
+            Base random seed; each curve's points are assigned to folds from curve_seed(originalid, seed)
+        batch_size: int
+            Fold refits solved together at most (bounds memory)
+        ftol, xtol: float
+            Convergence tolerances of the refits (see batched_lm)
+        max_iter: int
+            Maximum number of iterations of each refit
+        """
+        if model_name not in synthetic_models:
+            raise CrossValidationException("Unknown model '{}'. Choose from {}".format(model_name, sorted(synthetic_models)))
+        if folds is not None and folds < 2:
+            raise CrossValidationException("Cross-validation needs at least 2 folds, not {}".format(folds))
+        self.model_name = model_name
+        self.param_names = synthetic_models[model_name].param_names
+        self.folds, self.approx, self.seed, self.batch_size = folds, approx, seed, batch_size
+        self.solver = BatchedSchoolfield(model_name, ftol, xtol, max_iter)
+
+    @property
+    def method(self):
+        """ "approx_loo", "loo" or "kfold" """
+        if self.approx:
+            return "approx_loo"
+        return "loo" if self.folds is None else "kfold"
+
+    def _stack(self, datasets, estimates, temps_col, traits_col):
+        """ Positive points of every curve with estimates and more points than parameters """
+        self.ids, self.temps, self.traits, thetas = [], [], [], []
+        for curve_id, theta in estimates.items():
+            if curve_id not in datasets or not np.all(np.isfinite(theta)):
+                continue
+            dataset = datasets[curve_id]
+            temps, traits = dataset[temps_col].to_numpy(dtype=float), dataset[traits_col].to_numpy(dtype=float)
+            keep = np.isfinite(temps) & np.isfinite(traits) & (traits > 0)
+            if keep.sum() <= len(self.param_names):
+                continue
+            self.ids.append(curve_id)
+            self.temps.append(temps[keep])
+            self.traits.append(traits[keep])
+            thetas.append(theta)
+        if not self.ids:
+            raise CrossValidationException("No curve has estimates and enough points to cross-validate {}".format(self.model_name))
+        self.theta = np.clip(np.array(thetas, dtype=float), self.solver.lower, self.solver.upper)
+        self.theta = self.solver.project(self.theta)
+
+    def assign_folds(self, curve_id, n_points):
+        """ Fold of each point of a curve (each point its own fold for leave-one-out) """
+        if self.folds is None or self.folds >= n_points:
+            return np.arange(n_points)
+        rng = np.random.default_rng(curve_seed(curve_id, self.seed))
+        return rng.permutation(n_points) % self.folds
+
+    def _refit(self):
+        """ Held-out residuals of every point from refits without its fold, each started from the full-data optimum
+
+        Returns
+        -------
+        folds: list of numpy arrays
+            Fold of each point of each curve
+        residuals: list of numpy arrays
+            Held-out log residual of each point (NaN where the fold's refit failed)
+        """
+        folds = [self.assign_folds(curve_id, len(temps)) for curve_id, temps in zip(self.ids, self.temps)]
+        residuals = [np.full(len(temps), np.nan) for temps in self.temps]
+        # One problem per curve and fold, with enough training points to fit the model
+        problems = [(c, fold) for c, curve_folds in enumerate(folds) for fold in np.unique(curve_folds)
+                    if np.sum(curve_folds != fold) >= len(self.param_names)]
+        self.nfev = 0
+        for batch in np.array_split(np.arange(len(problems)), max(1, int(np.ceil(len(problems) / self.batch_size)))):
+            if not len(batch):
+                continue
+            curves, starts = [], []
+            for p in batch:
+                c, fold = problems[p]
+                train = folds[c] != fold
+                curves.append((self.temps[c][train], self.traits[c][train]))
+                starts.append([dict(zip(self.param_names, self.theta[c]))])
+            models = self.solver.fit(curves, starts)
+            for p, (model,) in zip(batch, models):
+                if model is None:
+                    continue
+                c, fold = problems[p]
+                test = folds[c] == fold
+                residuals[c][test] = schoolfield_log(self.model_name, self.temps[c][test], model.final_estimates) - np.log(self.traits[c][test])
+                self.nfev += model.fit_result.nfev
+        return folds, residuals
+
+    def _leverage(self):
+        """ Approximate leave-one-out residuals of every point from the hat matrix of the full-data fits
+
+        Returns
+        -------
+        folds: list of numpy arrays
+            Each point's own index
+        residuals: list of numpy arrays
+            r_i / (1 - h_ii) for each point (NaN where the point alone determines the fit)
+        """
+        self.solver.pad(list(zip(self.temps, self.traits)))
+        theta = self.theta
+        residuals, jac = self.solver.evaluate(np.arange(len(self.ids)), theta)
+        # Derivatives on the scale the parameters are fitted on, without parameters held at a bound
+        jac = jac * np.where(self.solver.log_cols, theta, 1.0)[:, None, :]
+        at_bound = np.isclose(theta, self.solver.lower, rtol=1e-9, atol=0) | np.isclose(theta, self.solver.upper, rtol=1e-9, atol=0)
+        jac = np.where(at_bound[:, None, :], 0.0, jac)
+        jtj = np.einsum("cni,cnj->cij", jac, jac)
+        leverage = np.einsum("cni,cij,cnj->cn", jac, np.linalg.pinv(jtj, hermitian=True), jac)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            loo = np.where(1 - leverage > 1e-8, residuals / (1 - leverage), np.nan)
+        self.nfev = 1
+        n_points = [len(temps) for temps in self.temps]
+        return [np.arange(n) for n in n_points], [loo[c, :n] for c, n in enumerate(n_points)]
+
+    def fit(self, datasets, estimates, temps_col="interactor1K", traits_col="standardisedtraitvalue"):
+        """ Cross-validate the fits of every curve
+
+        Parameters
+        ----------
+        datasets: dict
+            Dictionary of curves with originalid as keys (from get_datasets)
+        estimates: dict or pandas DataFrame
+            originalid -> full-data parameter estimates of the model (e.g. fit results indexed by originalid)
+        temps_col, traits_col: str
+            Temperature (K) and trait columns
+
+        Returns
+        -------
+        self: CrossValidation
+            With errors (one row per curve), points (held-out residual of every point), nfev and wall set
+        """
+        start = time.perf_counter()
+        if hasattr(estimates, "iterrows"):
+            estimates = {curve_id: row for curve_id, row in estimates.iterrows()}
+        estimates = {curve_id: np.array([theta[name] for name in self.param_names], dtype=float) for curve_id, theta in estimates.items()}
+        self._stack(datasets, estimates, temps_col, traits_col)
+        folds, residuals = self._leverage() if self.approx else self._refit()
+        self._summarise(folds, residuals)
+        self.wall = time.perf_counter() - start
+        return self
+
+    def _summarise(self, folds, residuals):
+        """ Per-curve error table and per-point table """
+        rows, points = [], []
+        for c, curve_id in enumerate(self.ids):
+            log_residuals = schoolfield_log(self.model_name, self.temps[c], dict(zip(self.param_names, self.theta[c]))) - np.log(self.traits[c])
+            failed = np.isnan(residuals[c])
+            held_out = residuals[c][~failed]
+            rows.append({"originalid": curve_id, "model_name": self.model_name, "method": self.method, "n_points": len(self.temps[c]),
+                         "n_folds": len(np.unique(folds[c])), "n_failed": int(failed.sum()),
+                         "rmse": np.sqrt(np.mean(log_residuals ** 2)),
+                         "cv_rmse": np.sqrt(np.mean(held_out ** 2)) if len(held_out) else np.nan})
+            points.append(pd.DataFrame({"originalid": curve_id, "model_name": self.model_name, "temp": self.temps[c], "fold": folds[c],
+                                        "residual": log_residuals, "cv_residual": residuals[c]}))
+        self.errors = pd.DataFrame(rows)
+        self.points = pd.concat(points, ignore_index=True)
+
+    def __repr__(self):
+        return "CrossValidation('{}', method='{}', folds={})".format(self.model_name, self.method, self.folds)
+
+def cross_validate(datasets, results=None, vals=None, models=None, folds=None, approx=False, iter=5, seed=0, **kwargs):
+    """ Cross-validated prediction errors of every curve, for its fitted model or for several models
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    results: pandas DataFrame, optional
+        Fit results with originalid, model_name and parameter estimates (e.g. the pipeline's results), used as the full-data optima
+    vals: dict, optional
+        Dictionary of sampling bounds, needed to fit the curves models doesn't have results for
+    models: tuple, optional
+        Schoolfield models to cross-validate on every curve (default: each curve's model in results). Curves without results for a model are
+        fitted to it first with fit_batched.
+    folds: int, optional
+        Number of folds (default: leave-one-out)
+    approx: bool
+        Approximate leave-one-out errors from the hat matrix instead of refitting (only valid for fits close to linear around their optimum)
+    iter: int
+        Number of random restarts of the full-data fits of curves without results
+    seed: int
+        Base random seed of those restarts and of the fold assignment
+    kwargs: keyword arguments
+        Passed to CrossValidation (batch_size, max_iter, ...)
+
+    Returns
+    -------
+    errors: pandas DataFrame
+        In-sample and cross-validated RMSE (log scale) of each curve and model, with the full-data AIC where it was fitted here or is in results
+    points: pandas DataFrame
+        In-sample and held-out residual of every point
+    """
+    if results is not None:
+        results = results.drop_duplicates("originalid", keep="last")
+        results = results.loc[results["originalid"].isin(datasets.keys())]
+    fit_missing = models is not None
+    if models is None:
+        if results is None:
+            raise CrossValidationException("Give the fit results to cross-validate, or the models to fit and cross-validate")
+        models = [model_name for model_name in results["model_name"].dropna().unique() if model_name in synthetic_models]
+
+    errors, points = [], []
+    for model_name in models:
+        fits = results.loc[results["model_name"] == model_name] if results is not None else pd.DataFrame(columns=["originalid"])
+        estimates = fits.set_index("originalid")[list(synthetic_models[model_name].param_names)] if len(fits) else pd.DataFrame()
+        aic = fits.set_index("originalid")["aic"] if "aic" in fits.columns else pd.Series(dtype=float)
+        # Curves fitted to another model (or not at all) are fitted to the models asked for first
+        missing = [curve_id for curve_id in datasets if curve_id not in estimates.index] if fit_missing else []
+        if missing:
+            if vals is None:
+                raise CrossValidationException("{} curves have no {} fit: give vals to fit them".format(len(missing), model_name))
+            fitted = pd.DataFrame(fit_batched({curve_id: datasets[curve_id] for curve_id in missing}, vals, model_name=model_name, iter=iter, seed=seed))
+            fitted = fitted.dropna(subset=["aic"]) if "aic" in fitted.columns else fitted.iloc[:0]
+            if len(fitted):
+                fitted = fitted.set_index("originalid")
+                estimates = pd.concat([estimates, fitted[list(synthetic_models[model_name].param_names)]])
+                aic = pd.concat([aic, fitted["aic"].astype(float)])
+        if not len(estimates):
+            continue
+        try:
+            cv = CrossValidation(model_name, folds=folds, approx=approx, seed=seed, **kwargs).fit(datasets, estimates)
+        except CrossValidationException:
+            # e.g. no curve has enough points
+            continue
+        errors.append(cv.errors.assign(aic=cv.errors["originalid"].map(aic)))
+        points.append(cv.points)
+    if not errors:
+        return pd.DataFrame(), pd.DataFrame()
+    return pd.concat(errors, ignore_index=True), pd.concat(points, ignore_index=True)
+
+def cv_best_models(errors):
+    """ Model with the lowest cross-validated RMSE of each curve, next to the model with the lowest AIC
+
+    Parameters
+    ----------
+    errors: pandas DataFrame
+        Output of cross_validate for several models
+
+    Returns
+    -------
+    best: pandas DataFrame
+        originalid, cv_model, cv_rmse and aic_model of each curve
+    """
+    scored = errors.dropna(subset=["cv_rmse"])
+    best = scored.loc[scored.groupby("originalid", sort=False)["cv_rmse"].idxmin(), ["originalid", "model_name", "cv_rmse"]]
+    best = best.rename(columns={"model_name": "cv_model"}).set_index("originalid")
+    if "aic" in errors.columns:
+        with_aic = errors.dropna(subset=["aic"])
+        best["aic_model"] = with_aic.loc[with_aic.groupby("originalid", sort=False)["aic"].idxmin()].set_index("originalid")["model_name"]
+    return best.reset_index()
@@ -6,12 +6,158 @@ NOTE: Resampling methods are included here to avoid multiple inheritance for now
 
 """
 
+import time
 import numpy as np
-from lmfit import minimize, Minimizer, Parameters
-from tpcfit import *
+from tpcfit.lazy_imports import lazy_import
+from tpcfit.starting_parameters import StartParams
+from tpcfit.models import ResidualWorkspace, SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow
+from tpcfit.screening import screen_curve, SCREEN_FIT_FAILED
+from tpcfit.instrumentation import fit_record
 
+# Imported on first use
+pd = lazy_import("pandas")
+lmfit = lazy_import("lmfit")
 
-def resample_ssf(params = None, vals = None, temps=None, traits=None, fit_pars=None, iter = 5):
+
+def restart_timeout(timeout, deadline):
+    """ Work out the time budget for the next restart of a curve
+
+    Parameters
+    ----------
+    timeout: float
+        Per-fit budget in seconds (or None)
+    deadline: float
+        time.perf_counter() value at which the curve's budget runs out (or None)
+
+    Returns
+    -------
+    fit_timeout: float
+        Budget for the next fit (or None for no limit)
+    expired: bool
+        True if the curve's budget has already run out
+    """
+    if deadline is None:
+        return timeout, False
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        return None, True
+    if timeout is None:
+        return remaining, False
+    return min(timeout, remaining), False
+
+def start_params(params, start):
+    """ Copy of params with the starting values in start
+
+    Parameters
+    ----------
+    params: lmfit.parameter.Parameters
+        Parameters of the model
+    start: dict
+        Starting value of each parameter (others keep their value)
+
+    Returns
+    -------
+    params: lmfit.parameter.Parameters
+        New parameters object (values outside a parameter's bounds are clipped by lmfit)
+    """
+    new_params = params.copy()
+    for name, value in start.items():
+        if name in new_params:
+            new_params[name].value = value
+    return new_params
+
+def resample_class(model_class, params, vals, temps, traits, iter=5, timeout=None, curve_timeout=None, metrics=None, curve_id=None, starts=None):
+    """ Fit a model class from several starting points and keep the best fit
+
+    Parameters
+    ----------
+    model_class: class
+        ThermalModels subclass, called as model_class(temps, traits, fit_pars, timeout, workspace). A fit failed if the model has no AIC.
+    params: lmfit.parameter.Parameters
+        Parameters of the model (with their bounds)
+    vals: dict
+        dictionary of sampling bounds
+    temps: np array
+        Temperature values in Kelvin
+    traits: np array
+        Trait values
+    iter: int
+        Number of restarts, counting given starts that converge; the rest start from random parameters
+    timeout: float
+        Wall-clock budget in seconds for each fit (None for no limit)
+    curve_timeout: float
+        Wall-clock budget in seconds for all restarts (None for no limit).
+        Restarts that don't fit in the budget are skipped.
+    metrics: list, optional
+        If given, the fit record of every restart (see tpcfit.instrumentation) is appended to it
+    curve_id: str, optional
+        originalid of the curve, for the fit records
+    starts: list of dicts, optional
+        Starting parameter values tried before the random restarts. Each one that converges replaces a random restart, so random restarts are only run for the starts that fail.
+
+    Returns
+    -------
+    best_model: ThermalModels
+        Model with the lowest AIC. best_model.timed_out is True if its fit or the curve's restarts were cut short by a time budget.
+        best_model.restart is the restart (counting from 1) that found it and best_model.nfev_total the function evaluations over all restarts.
+        Raises ValueError if no restart succeeded.
+    """
+    deadline = None if curve_timeout is None else time.perf_counter() + curve_timeout
+    curve_timed_out = False
+
+    # Invariants and residual buffers shared by all restarts of the curve
+    workspace = ResidualWorkspace(temps, traits)
+
+    # Given starts are tried first, and each one that converges takes the place of a random restart
+    models = []
+    aics = []
+    # Restarts counted against iter: random ones, and given starts that converged
+    counted = 0
+    restart = 0
+    for start in list(starts or []) + [None] * iter:
+        if start is None and counted >= iter:
+            break
+        if start is None:
+            counted += 1
+        fit_timeout, expired = restart_timeout(timeout, deadline)
+        if expired:
+            curve_timed_out = True
+            break
+        restart += 1
+        try:
+            if start is not None:
+                new_params = start_params(params, start)
+            else:
+                new_params = StartParams(params, vals)
+            model = model_class(temps=temps, traits=traits, fit_pars=new_params, timeout=fit_timeout, workspace=workspace)
+        except Exception:
+            # A start the model can't even be set up from is a failed restart like any other
+            continue
+        record = fit_record(model, restart, curve_id)
+        if metrics is not None:
+            metrics.append(record)
+        # Skip restarts where the optimizer failed
+        if getattr(model, "AIC", None) is not None:
+            model.restart = restart
+            models.append(model)
+            aics.append(model.AIC)
+            if start is not None and model.fit_result.success and not model.timed_out:
+                counted += 1
+
+    best_aic = min(aics)
+
+    for j in models:
+        if j.AIC == best_aic:
+            best_model = j
+
+    best_model.nfev_total = sum(m.fit_result.nfev for m in models)
+
+    if curve_timed_out:
+        best_model.timed_out = True
+
+    return best_model
+
+def resample_ssf(params = None, vals = None, temps=None, traits=None, fit_pars=None, iter = 5, timeout=None, curve_timeout=None, metrics=None, curve_id=None, starts=None):
     """ Function to resample ssf model
     Parameters
     ----------
@@ -26,7 +172,24 @@ def resample_ssf(params = None, vals = None, temps=None, traits=None, fit_pars=N
     fat_pars: lmfit.parameter.Parameters
         Parameters for re-fitting
     iter: int
-        Number of times to re-fit model """
+        Number of times to re-fit model
+    timeout: float
+        Wall-clock budget in seconds for each fit (None for no limit)
+    curve_timeout: float
+        Wall-clock budget in seconds for all restarts (None for no limit).
+        Restarts that don't fit in the budget are skipped.
+    metrics: list, optional
+        If given, the fit record of every restart (see tpcfit.instrumentation) is appended to it
+    curve_id: str, optional
+        originalid of the curve, for the fit records
+    starts: list of dicts, optional
+        Starting parameter values (e.g. from a TemplateLibrary) tried first, each one that converges replacing a random restart
+
+    Returns
+    -------
+    best_model: SharpeSchoolfieldFull
+        Model with the lowest AIC. best_model.timed_out is True if its fit or the curve's restarts were cut short by a time budget.
+        best_model.restart is the restart (counting from 1) that found it and best_model.nfev_total the function evaluations over all restarts """
     if params is not None:
         params = params
     if vals is not None:
@@ -39,24 +202,9 @@ def resample_ssf(params = None, vals = None, temps=None, traits=None, fit_pars=N
         fit_pars = fit_pars
     iter=iter
 
-    models = []
-    aics = []
-    for i in range(iter):
-        new_params = StartParams(params, vals)
-        model = SharpeSchoolfieldFull(temps=temps, traits=traits, fit_pars=new_params)
-        if model is not None:
-            models.append(model)
-            aics.append(model.AIC)
-
-    best_aic = min(aics)
+    return resample_class(SharpeSchoolfieldFull, params, vals, temps, traits, iter=iter, timeout=timeout, curve_timeout=curve_timeout, metrics=metrics, curve_id=curve_id, starts=starts)
 
-    for j in models:
-        if j.AIC == best_aic:
-            best_model = j
-
-    return best_model
-
-def resample_ssh(params = None, vals = None, temps=None, traits=None, fit_pars=None, iter = 5):
+def resample_ssh(params = None, vals = None, temps=None, traits=None, fit_pars=None, iter = 5, timeout=None, curve_timeout=None, metrics=None, curve_id=None, starts=None):
     """ Function to resample ssf model
     Parameters
     ----------
@@ -71,7 +219,24 @@ def resample_ssh(params = None, vals = None, temps=None, traits=None, fit_pars=N
     fat_pars: lmfit.parameter.Parameters
         Parameters for re-fitting
     iter: int
-        Number of times to re-fit model """
+        Number of times to re-fit model
+    timeout: float
+        Wall-clock budget in seconds for each fit (None for no limit)
+    curve_timeout: float
+        Wall-clock budget in seconds for all restarts (None for no limit).
+        Restarts that don't fit in the budget are skipped.
+    metrics: list, optional
+        If given, the fit record of every restart (see tpcfit.instrumentation) is appended to it
+    curve_id: str, optional
+        originalid of the curve, for the fit records
+    starts: list of dicts, optional
+        Starting parameter values (e.g. from a TemplateLibrary) tried first, each one that converges replacing a random restart
+
+    Returns
+    -------
+    best_model: SharpeSchoolfieldHigh
+        Model with the lowest AIC. best_model.timed_out is True if its fit or the curve's restarts were cut short by a time budget.
+        best_model.restart is the restart (counting from 1) that found it and best_model.nfev_total the function evaluations over all restarts """
     if params is not None:
         params = params
     if vals is not None:
@@ -84,23 +249,9 @@ def resample_ssh(params = None, vals = None, temps=None, traits=None, fit_pars=N
         fit_pars = fit_pars
     iter=iter
 
-    models = []
-    aics = []
-    for i in range(iter):
-        new_params = StartParams(params, vals)
-        model = SharpeSchoolfieldHigh(temps=temps, traits=traits, fit_pars=new_params)
-        models.append(model)
-        aics.append(model.AIC)
+    return resample_class(SharpeSchoolfieldHigh, params, vals, temps, traits, iter=iter, timeout=timeout, curve_timeout=curve_timeout, metrics=metrics, curve_id=curve_id, starts=starts)
 
-    best_aic = min(aics)
-
-    for j in models:
-        if j.AIC == best_aic:
-            best_model = j
-
-    return best_model
-
-def resample_ssl(params = None, vals = None, temps=None, traits=None, fit_pars=None, iter = 5):
+def resample_ssl(params = None, vals = None, temps=None, traits=None, fit_pars=None, iter = 5, timeout=None, curve_timeout=None, metrics=None, curve_id=None, starts=None):
     """ Function to resample ssl model
     Parameters
     ----------
@@ -115,7 +266,24 @@ def resample_ssl(params = None, vals = None, temps=None, traits=None, fit_pars=N
     fat_pars: lmfit.parameter.Parameters
         Parameters for re-fitting
     iter: int
-        Number of times to re-fit model """
+        Number of times to re-fit model
+    timeout: float
+        Wall-clock budget in seconds for each fit (None for no limit)
+    curve_timeout: float
+        Wall-clock budget in seconds for all restarts (None for no limit).
+        Restarts that don't fit in the budget are skipped.
+    metrics: list, optional
+        If given, the fit record of every restart (see tpcfit.instrumentation) is appended to it
+    curve_id: str, optional
+        originalid of the curve, for the fit records
+    starts: list of dicts, optional
+        Starting parameter values (e.g. from a TemplateLibrary) tried first, each one that converges replacing a random restart
+
+    Returns
+    -------
+    best_model: SharpeSchoolfieldLow
+        Model with the lowest AIC. best_model.timed_out is True if its fit or the curve's restarts were cut short by a time budget.
+        best_model.restart is the restart (counting from 1) that found it and best_model.nfev_total the function evaluations over all restarts """
     if params is not None:
         params = params
     if vals is not None:
@@ -128,21 +296,7 @@ def resample_ssl(params = None, vals = None, temps=None, traits=None, fit_pars=N
         fit_pars = fit_pars
     iter=iter
 
-    models = []
-    aics = []
-    for i in range(iter):
-        new_params = StartParams(params, vals)
-        model = SharpeSchoolfieldLow(temps=temps, traits=traits, fit_pars=new_params)
-        models.append(model)
-        aics.append(model.AIC)
-
-    best_aic = min(aics)
-
-    for j in models:
-        if j.AIC == best_aic:
-            best_model = j
-
-    return best_model
+    return resample_class(SharpeSchoolfieldLow, params, vals, temps, traits, iter=iter, timeout=timeout, curve_timeout=curve_timeout, metrics=metrics, curve_id=curve_id, starts=starts)
 
 def ssf_init(B0=None, E=None, Eh=None, El=None, Th=None, Tl=None, randomise=True):
     """ Initialise full schoolfield parameters
@@ -182,7 +336,7 @@ def ssf_init(B0=None, E=None, Eh=None, El=None, Th=None, Tl=None, randomise=True
     if Tl is not None:
         Tl=Tl
 
-    params = Parameters()
+    params = lmfit.Parameters()
     params.add("B0", value=B0, vary=True, min=-np.inf, max=np.inf)
     params.add("E", value=E, vary=True, min = 10E-3, max=np.inf)
     params.add("Eh", value=Eh, vary=True, min = 10E-3, max=np.inf)
@@ -226,7 +380,7 @@ def ssh_init(B0=None, E=None, Eh=None, Th=None, randomise=True):
     if Th is not None:
         Th=Th
 
-    params = Parameters()
+    params = lmfit.Parameters()
     params.add("B0", value=B0, vary=True, min=-np.inf, max=np.inf)
     params.add("E", value=E, vary=True, min = 10E-3, max=np.inf)
     params.add("Eh", value=Eh, vary=True, min = 10E-3, max=np.inf)
@@ -263,12 +417,12 @@ def ssl_init(B0=None, E=None, El=None, Tl=None, randomise=True):
         B0=B0
     if E is not None:
         E=E
-    if Eh is not None:
-        Eh=Eh
+    if El is not None:
+        El=El
     if Tl is not None:
         Tl=Tl
 
-    params = Parameters()
+    params = lmfit.Parameters()
     params.add("B0", value=B0, vary=True, min=-np.inf, max=np.inf)
     params.add("E", value=E, vary=True, min = 10E-3, max=np.inf)
     params.add("El", value=El, vary=True, min = 10E-3, max=np.inf)
@@ -281,6 +435,243 @@ def ssl_init(B0=None, E=None, El=None, Tl=None, randomise=True):
     return params
 
 
+def model_funcs(model_name):
+    """ Resampling and parameter initialisation functions of a model
+
+    Parameters
+    ----------
+    model_name: str
+        Schoolfield model or a model declared in tpcfit.registry
+
+    Returns
+    -------
+    funcs: tuple
+        (resample, init) from resample_funcs. Raises ValueError for unknown models.
+    """
+    if model_name not in resample_funcs:
+        # Declared models are added to resample_funcs when the registry is imported
+        import tpcfit.registry
+    if model_name not in resample_funcs:
+        raise ValueError("Unknown model '{}'. Choose from {}".format(model_name, sorted(resample_funcs)))
+    return resample_funcs[model_name]
+
+def resample_model(model_name, vals=None, temps=None, traits=None, iter=5, timeout=None, curve_timeout=None, metrics=None, curve_id=None, starts=None):
+    """ Resample a schoolfield model chosen by name
+
+    Parameters
+    ----------
+    model_name: str
+        "sharpeschoolfull", "sharpeschoolhigh", "sharpeschoollow" or a model declared in tpcfit.registry
+    vals: dict
+        dictionary of sampling bounds. Bounds for parameters the model
+        doesn't use are ignored, and declared models use their own starting ranges for parameters it doesn't have
+    temps: np array
+        Temperature values in Kelvin
+    traits: np array
+        Trait values
+    iter: int
+        Number of restarts, counting given starts that converge; the rest start from random parameters
+    timeout: float
+        Wall-clock budget in seconds for each fit
+    curve_timeout: float
+        Wall-clock budget in seconds for all restarts
+    metrics: list, optional
+        If given, the fit record of every restart (see tpcfit.instrumentation) is appended to it
+    curve_id: str, optional
+        originalid of the curve, for the fit records
+    starts: list of dicts, optional
+        Starting parameter values tried before the random restarts, each one that converges replacing a random restart
+
+    Returns
+    -------
+    best_model: ThermalModels
+        Best model (lowest AIC), or None if every restart failed
+    """
+    resample, init = model_funcs(model_name)
+    params = init()
+    # Declared models fall back on their own starting ranges
+    defaults = start_bounds.get(model_name, {})
+    model_vals = {key: vals[key] if vals is not None and key in vals else defaults[key] for key in params.keys()}
+
+    # resample functions fail on min() if no restart succeeded
+    try:
+        return resample(params=params, vals=model_vals, temps=temps, traits=traits, iter=iter, timeout=timeout, curve_timeout=curve_timeout, metrics=metrics, curve_id=curve_id, starts=starts)
+    except ValueError:
+        return None
+
+def _fit_summary(best_mod):
+    """ AIC, timeout flag, nfev (of the best restart and over all restarts), number of points and parameter estimates of a fitted model """
+    summary = {"aic": best_mod.AIC, "timed_out": best_mod.timed_out, "nfev": best_mod.fit_result.nfev, "nfev_total": best_mod.nfev_total, "n_points": best_mod.fit_result.ndata}
+    summary.update(best_mod.final_estimates)
+    return summary
+
+def fit_tpc(temps, traits, vals, model_name=None, unique_temps=None, iter=5, timeout=None, curve_timeout=None, seed=None, metrics=None, curve_id=None, templates=None, n_templates=3, warm_starts=None):
+    """ Screen and fit a single thermal performance curve
+
+    Parameters
+    ----------
+    temps: np array
+        Temperature values in Kelvin
+    traits: np array
+        Trait values
+    vals: dict
+        dictionary of sampling bounds
+    model_name: str, optional
+        Model to fit. If None, a feasible model is chosen by screen_curve
+    unique_temps: int, optional
+        Number of unique temperatures (counted if not given)
+    iter: int
+        Number of restarts, counting given starts that converge; the rest start from random parameters
+    timeout: float
+        Wall-clock budget in seconds for each fit
+    curve_timeout: float
+        Wall-clock budget in seconds for all restarts
+    seed: int, optional
+        Seed for the random starting parameters
+    metrics: list, optional
+        If given, the fit record of every restart (see tpcfit.instrumentation) is appended to it
+    curve_id: str, optional
+        originalid of the curve, for the fit records
+    templates: TemplateLibrary, optional
+        Fits of similar curves to start from (see tpcfit.templates)
+    n_templates: int
+        Number of restarts started from the nearest fits in templates. They are run first, and each one that converges replaces one of the iter random restarts.
+    warm_starts: WarmStarts, optional
+        Estimates of the previous fit in the curve's group (see tpcfit.grouping). The curve is fitted once from them, and only if that fit fails, times out or doesn't converge with the usual restarts. They are then updated with this fit.
+
+    Returns
+    -------
+    result: dict
+        Screening reason code, model name, fit time, AIC, nfev (of the best restart and over all restarts), number of points fitted and parameter estimates (and whether the warm start was kept, with warm_starts)
+    """
+    result = {}
+    if seed is not None:
+        np.random.seed(seed)
+
+    # Choose a feasible model, or skip the curve
+    if model_name is None:
+        model_name, result["screen"] = screen_curve(temps, traits, unique_temps)
+        if model_name is None:
+            result["model_name"] = None
+            return result
+    else:
+        result["screen"] = None
+
+    start = time.perf_counter()
+    best_mod = None
+
+    # Fit once from the previous fit of the curve's group
+    warm = warm_starts.start(model_name, traits) if warm_starts is not None else None
+    if warm is not None:
+        best_mod = resample_model(model_name, vals=vals, temps=temps, traits=traits, iter=0, timeout=timeout, curve_timeout=curve_timeout, metrics=metrics, curve_id=curve_id, starts=[warm])
+        if best_mod is not None and (best_mod.timed_out or not best_mod.fit_result.success):
+            best_mod = None
+        if curve_timeout is not None:
+            curve_timeout = curve_timeout - (time.perf_counter() - start)
+    if warm_starts is not None:
+        result["warm_start"] = best_mod is not None
+
+    # Otherwise resample model, starting from the fits of similar curves first
+    if best_mod is None:
+        starts = templates.starts(model_name, temps, traits, n_templates) if templates is not None else None
+        best_mod = resample_model(model_name, vals=vals, temps=temps, traits=traits, iter=iter, timeout=timeout, curve_timeout=curve_timeout, metrics=metrics, curve_id=curve_id, starts=starts)
+    result["model_name"] = model_name
+    result["fit_time"] = time.perf_counter() - start
+    if best_mod is None:
+        result["screen"] = SCREEN_FIT_FAILED
+        return result
+
+    # Collect estimates
+    result.update(_fit_summary(best_mod))
+
+    if warm_starts is not None and not best_mod.timed_out:
+        warm_starts.update(model_name, traits, best_mod.final_estimates)
+
+    return result
+
+def refit_tpc(temps, traits, vals, previous, n_previous=None, iter=5, timeout=None, curve_timeout=None, seed=None, metrics=None, curve_id=None, mse_ratio=2.0):
+    """ Refit a curve that has gained points, starting from its previous fit
+
+    The curve is fitted once from the previous estimates. The usual random restarts are only run if the data show a regime change: the warm fit fails, times out or doesn't converge, screening now chooses a different model, or the mean squared residual has grown by more than mse_ratio. The restarts are then compared with the warm fit and the better one is kept.
+
+    Parameters
+    ----------
+    temps: np array
+        Temperature values in Kelvin (all points, old and new)
+    traits: np array
+        Trait values
+    vals: dict
+        dictionary of sampling bounds for the restarts
+    previous: dict
+        Previous fit (a fit_tpc result or results store row) with model_name, aic and parameter estimates
+    n_previous: int, optional
+        Number of points of the previous fit (default: previous["n_points"]). Without it, the residual test is skipped.
+    iter: int
+        Number of random restarts if the fit escalates
+    timeout: float
+        Wall-clock budget in seconds for each fit
+    curve_timeout: float
+        Wall-clock budget in seconds for the restarts
+    seed: int, optional
+        Seed for the random starting parameters
+    metrics: list, optional
+        If given, the fit record of every fit (see tpcfit.instrumentation) is appended to it
+    curve_id: str, optional
+        originalid of the curve, for the fit records
+    mse_ratio: float
+        Growth in mean squared residual (log scale) taken as a regime change
+
+    Returns
+    -------
+    result: dict
+        As fit_tpc, with "refit" set to "warm" if the warm fit was kept, otherwise the reason it escalated ("failed", "model" or "residuals"; "model" only for the Schoolfield models)
+    """
+    model_name = previous.get("model_name")
+    try:
+        init = model_funcs(model_name)[1]
+    except ValueError:
+        raise ValueError("Previous fit has no model to refit: '{}'".format(model_name))
+    # Only the Schoolfield models are chosen by screening, declared models are refitted as such
+    screened = model_name in screened_models
+    if seed is not None:
+        np.random.seed(seed)
+
+    start = time.perf_counter()
+    params = init()
+    warm = {name: previous.get(name) for name in params.keys()}
+    if not all(value is not None and np.isfinite(value) for value in warm.values()):
+        raise ValueError("Previous fit has missing estimates: {}".format(warm))
+
+    # Refit from the previous optimum, and check whether it still describes the curve
+    best_mod = resample_model(model_name, vals=vals, temps=temps, traits=traits, iter=0, timeout=timeout, curve_timeout=curve_timeout, metrics=metrics, curve_id=curve_id, starts=[warm])
+    n_previous = n_previous if n_previous is not None else previous.get("n_points")
+    failed = best_mod is None or best_mod.timed_out or not best_mod.fit_result.success
+    reason = None
+    if screened and screen_curve(temps, traits)[0] not in (None, model_name):
+        reason = "model"
+    elif failed:
+        reason = "failed"
+    elif pd.notna(n_previous) and pd.notna(previous.get("aic")):
+        # Invert AIC = n * log(chisqr / n) + 2 * nvarys for the previous mean squared residual
+        previous_mse = np.exp((previous["aic"] - 2 * len(params)) / n_previous)
+        if best_mod.mean_square() > mse_ratio * previous_mse:
+            reason = "residuals"
+
+    result = {"screen": None, "model_name": model_name}
+    if reason is not None:
+        # Regime change: fall back to a full fit, keeping the warm fit if it is still better
+        if curve_timeout is not None:
+            curve_timeout = curve_timeout - (time.perf_counter() - start)
+        full = fit_tpc(temps, traits, vals, model_name=None if screened else model_name, iter=iter, timeout=timeout, curve_timeout=curve_timeout, metrics=metrics, curve_id=curve_id)
+        if failed or (full.get("aic") is not None and full["aic"] <= best_mod.AIC):
+            result, best_mod = full, None
+
+    result["fit_time"] = time.perf_counter() - start
+    if best_mod is not None:
+        result.update(_fit_summary(best_mod))
+    result["refit"] = reason if reason is not None else "warm"
+    return result
+
 def get_datasets(data):
     """ Split unique datasets by originalid
 
@@ -304,3 +695,14 @@ def get_datasets(data):
         datasets[i] = id
 
     return datasets
+
+# Resampling and parameter initialisation functions for each model name (tpcfit.registry adds the declared models)
+resample_funcs = {SharpeSchoolfieldFull.model_name: (resample_ssf, ssf_init),
+                  SharpeSchoolfieldHigh.model_name: (resample_ssh, ssh_init),
+                  SharpeSchoolfieldLow.model_name: (resample_ssl, ssl_init)}
+
+# Models chosen by screen_curve
+screened_models = tuple(resample_funcs)
+
+# Default starting ranges of declared models, for parameters missing from the caller's sampling bounds
+start_bounds = {}
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" grouping.py fits related curves (e.g. replicates of a species and trait) one after another, each starting from the group's previous fit.
+
+Curves of the same species and trait often have near-identical E and Th, so once one curve of a group has been fitted from random restarts, the next can usually be fitted from its estimates alone. The richest curve of each group (most unique temperatures) is fitted first. A warm start that fails, times out or doesn't converge falls back to the usual random restarts.
+
+Example :
+    >>> for group_id, curve_ids in group_curves(datasets).items():
+    ...     warm_starts = WarmStarts()
+    ...     for curve_id in curve_ids:
+    ...         fit_tpc(temps, traits, vals, warm_starts=warm_starts)
+"""
+
+import numpy as np
+
+# Columns identifying a group of related curves
+group_cols = ("interactor1", "standardisedtraitname")
+
+class GroupingException(Exception):
+    """ General purpose exception generator for grouped fitting"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def group_key(dataset, by=group_cols):
+    """ Group of a curve, or None if any of its group columns is missing
+
+    Parameters
+    ----------
+    dataset: pandas DataFrame
+        Rows of a single curve
+    by: tuple
+        Group columns
+
+    Returns
+    -------
+    key: str
+        Values of the group columns joined by "|"
+    """
+    values = [dataset[col].iloc[0] for col in by]
+    if any(value is None or value != value for value in values):
+        return None
+    return "|".join(str(value) for value in values)
+
+def group_curves(datasets, by=group_cols, temps_col="interactor1K"):
+    """ Split curves into groups of related curves, richest curve first
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    by: tuple
+        Group columns (curves missing any of them are fitted on their own)
+    temps_col: str
+        Temperature column
+
+    Returns
+    -------
+    groups: dict
+        Group key -> originalids, in decreasing order of unique temperatures. Groups are in order of first appearance.
+    """
+    missing = [col for col in by if len(datasets) and col not in next(iter(datasets.values())).columns]
+    if missing:
+        raise GroupingException("Group columns {} not in the data".format(missing))
+
+    groups = {}
+    for curve_id, dataset in datasets.items():
+        key = group_key(dataset, by)
+        groups.setdefault(key if key is not None else "|{}".format(curve_id), []).append(curve_id)
+    for key, ids in groups.items():
+        # sorted is stable, so ties keep the input order
+        groups[key] = sorted(ids, key=lambda curve_id: -datasets[curve_id][temps_col].nunique())
+    return groups
+
+class WarmStarts(object):
+    """ Best estimates of the last fit of each model in a group, used to start the group's next fit """
+
+    def __init__(self):
+        # model_name -> (estimates, peak trait value)
+        self.estimates = {}
+
+    def start(self, model_name, traits):
+        """ Starting parameters for a curve from the group's previous fit of the model
+
+        Parameters
+        ----------
+        model_name: str
+            Model to be fitted
+        traits: numpy array
+            Trait values of the curve
+
+        Returns
+        -------
+        start: dict
+            Parameter values with B0 (if the model has it) scaled to the curve's peak trait value, or None if the group hasn't fitted the model yet
+        """
+        if model_name not in self.estimates:
+            return None
+        estimates, peak = self.estimates[model_name]
+        start = dict(estimates)
+        new_peak = np.nanmax(traits)
+        if "B0" in start and peak > 0 and new_peak > 0:
+            start["B0"] = start["B0"] * new_peak / peak
+        return start
+
+    def update(self, model_name, traits, estimates):
+        """ Keep the estimates of a successful fit for the group's next curve
+
+        Parameters
+        ----------
+        model_name: str
+            Model that was fitted
+        traits: numpy array
+            Trait values of the curve
+        estimates: dict
+            Parameter estimates of the fit (ignored unless all finite)
+        """
+        if all(np.isfinite(value) for value in estimates.values()):
+            self.estimates[model_name] = (dict(estimates), np.nanmax(traits))
+
+    def __repr__(self):
+        return "WarmStarts({})".format(sorted(self.estimates))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" instrumentation.py collects per-fit metrics so slow batches can be explained.
+
+Every fit (each random restart of each curve) produces a record with its function and Jacobian evaluations, wall and CPU time, outcome (ok, timed_out or error), exception type, convergence message and starting and final parameters. Records can be collected into a list passed down through fit_tpc and resample_model, turned into a metrics table with metrics_table, and pushed elsewhere as they happen by registering hooks with add_fit_hook.
+
+Example :
+    >>> add_fit_hook(logging_hook())
+    >>> metrics = []
+    >>> fit_tpc(temps, traits, vals, metrics=metrics)
+    >>> hot_curves(metrics_table(metrics))
+"""
+
+import logging
+from tpcfit.lazy_imports import lazy_import
+
+# Imported on first use
+pd = lazy_import("pandas")
+
+# Columns of the metrics table (followed by the starting and final parameters)
+metric_cols = ("originalid", "model_name", "restart", "status", "error", "message", "success",
+               "nfev", "njev", "wall", "cpu", "aic", "chisqr")
+
+# Callables called with every fit record
+fit_hooks = []
+
+def add_fit_hook(hook):
+    """ Register a callable to be called with every fit record
+
+    Hooks registered before a process pool is started are inherited by its workers (on platforms that fork).
+
+    Parameters
+    ----------
+    hook: callable
+        hook(record) with record a dict (see fit_record)
+    """
+    if hook not in fit_hooks:
+        fit_hooks.append(hook)
+
+def remove_fit_hook(hook):
+    """ Unregister a hook added with add_fit_hook """
+    if hook in fit_hooks:
+        fit_hooks.remove(hook)
+
+def logging_hook(logger=None, level=logging.DEBUG):
+    """ Make a hook that logs every fit record
+
+    Parameters
+    ----------
+    logger: logging.Logger, optional
+        Logger to use (default: the "tpcfit" logger)
+    level: int
+        Log level of successful fits. Errors are logged as warnings.
+
+    Returns
+    -------
+    hook: callable
+    """
+    logger = logger if logger is not None else logging.getLogger("tpcfit")
+
+    def hook(record):
+        logger.log(logging.WARNING if record.get("status") == "error" else level,
+                   "%s %s restart %s: %s nfev=%s wall=%.3fs %s", record.get("originalid"), record.get("model_name"),
+                   record.get("restart"), record.get("status"), record.get("nfev"), record.get("wall") or 0.0,
+                   record.get("error") or record.get("message") or "")
+    return hook
+
+def fit_record(model, restart, curve_id=None):
+    """ Build the record of one fit and pass it to the registered hooks
+
+    Parameters
+    ----------
+    model: ThermalModels
+        A model after fitting (successful or not)
+    restart: int
+        Restart number, counting from 1
+    curve_id: str, optional
+        originalid of the curve
+
+    Returns
+    -------
+    record: dict
+        Model name, restart, outcome, evaluations, timings and parameters of the fit
+    """
+    record = dict(model.metrics, originalid=curve_id, restart=restart)
+    for hook in fit_hooks:
+        hook(record)
+    return record
+
+def metrics_table(records):
+    """ Turn fit records into a table with one row per fit
+
+    Parameters
+    ----------
+    records: list of dicts
+        Records from fit_record (e.g. collected with fit_tpc(..., metrics=records))
+
+    Returns
+    -------
+    table: pandas DataFrame
+        metric_cols, then start_<param> and <param> columns with the starting and final parameters
+    """
+    rows = []
+    for record in records:
+        row = {col: record.get(col) for col in metric_cols}
+        row.update({"start_" + name: value for name, value in (record.get("start") or {}).items()})
+        row.update(record.get("estimates") or {})
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    for col in metric_cols:
+        if col not in table.columns:
+            table[col] = None
+    return table
+
+def hot_curves(table, n=10):
+    """ Curves that took longest to fit over all their restarts
+
+    Parameters
+    ----------
+    table: pandas DataFrame
+        Output of metrics_table
+    n: int
+        Number of curves to return
+
+    Returns
+    -------
+    hot: pandas DataFrame
+        Restarts, errors, timeouts, total nfev and total wall and CPU time of the n slowest curves
+    """
+    table = table.assign(errors=table["status"] == "error", timeouts=table["status"] == "timed_out")
+    hot = table.groupby("originalid", dropna=False).agg(model_name=("model_name", "first"), restarts=("restart", "size"),
+                                                        errors=("errors", "sum"), timeouts=("timeouts", "sum"),
+                                                        nfev=("nfev", "sum"), wall=("wall", "sum"), cpu=("cpu", "sum"))
+    return hot.sort_values("wall", ascending=False).head(n)
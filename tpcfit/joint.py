@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" joint.py fits groups of curves jointly, with some parameters shared by every curve or drawn from a group-level distribution.
+
+All curves of a group are stacked into one least-squares problem: the Schoolfield log residuals of every point, plus (for hierarchical parameters) one residual (value - group mean) / sd per curve. Each point only depends on its own curve's parameters and the group-level ones, so the Jacobian is block-sparse. scipy's least_squares gets its sparsity pattern, which lets it estimate the Jacobian with a fixed number of residual evaluations however many curves there are, and solve each step with LSMR on the sparse matrix. Time and memory grow linearly with the number of curves.
+
+Example :
+    >>> joint = JointFit("sharpeschoolhigh", shared=("E",)).fit(datasets, starts=results)
+    >>> joint.group  # shared E and its standard error
+    >>> joint.estimates  # per-curve B0, Eh and Th
+    >>> JointFit("sharpeschoolhigh", shared=(), hierarchical={"E": 0.1}).fit(datasets, starts=results)
+"""
+
+import time
+import numpy as np
+from tpcfit.lazy_imports import lazy_import
+from tpcfit.synthetic import schoolfield_log, synthetic_models
+from tpcfit.sharding import curve_seed
+from tpcfit.grouping import group_cols, group_curves
+from tpcfit.general_funcs import fit_tpc
+
+# Imported on first use
+pd = lazy_import("pandas")
+optimize = lazy_import("scipy.optimize")
+sparse = lazy_import("scipy.sparse")
+linalg = lazy_import("scipy.sparse.linalg")
+
+# Parameter bounds (as in ssf_init etc., with B0 positive since the model is logged)
+joint_bounds = {"B0": (1e-12, np.inf), "E": (10E-3, np.inf), "Eh": (10E-3, np.inf), "El": (10E-3, np.inf),
+                "Th": (273.15, np.inf), "Tl": (273.15, np.inf)}
+
+class JointFitException(Exception):
+    """ General purpose exception generator for JointFit"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+class JointFit(object):
+    """ Joint fit of a group of curves with shared or hierarchical parameters """
+
+    def __init__(self, model_name="sharpeschoolhigh", shared=("E",), hierarchical=None, ftol=1e-10, xtol=1e-10, max_nfev=None):
+        """
+        Parameters
+        ----------
+        model_name: str
+            Model fitted to every curve
+        shared: tuple
+            Parameters with a single value for all curves
+        hierarchical: dict, optional
+            Parameter -> standard deviation of its group-level normal distribution. Each curve gets its own value, pulled towards a fitted group mean.
+        ftol, xtol: float
+            Convergence tolerances of least_squares
+        max_nfev: int, optional
+            Maximum number of residual evaluations
+        """
+        if model_name not in synthetic_models:
+            raise JointFitException("Unknown model '{}'. Choose from {}".format(model_name, sorted(synthetic_models)))
+        self.model_name = model_name
+        self.param_names = synthetic_models[model_name].param_names
+        self.shared = tuple(shared)
+        self.hierarchical = dict(hierarchical or {})
+        unknown = [name for name in self.shared + tuple(self.hierarchical) if name not in self.param_names]
+        if unknown:
+            raise JointFitException("{} aren't parameters of {}".format(unknown, model_name))
+        if set(self.shared) & set(self.hierarchical):
+            raise JointFitException("A parameter can't be both shared and hierarchical")
+        self.local = tuple(name for name in self.param_names if name not in self.shared)
+        self.ftol, self.xtol, self.max_nfev = ftol, xtol, max_nfev
+
+    def _stack(self, datasets, temps_col, traits_col):
+        """ Concatenate the points of every curve with enough positive points """
+        ids, temps, traits, point_curve, skipped = [], [], [], [], []
+        for curve_id, dataset in datasets.items():
+            curve_temps, curve_traits = dataset[temps_col].to_numpy(dtype=float), dataset[traits_col].to_numpy(dtype=float)
+            keep = np.isfinite(curve_temps) & np.isfinite(curve_traits) & (curve_traits > 0)
+            # A curve needs more unique temperatures than it has own parameters
+            if len(np.unique(curve_temps[keep])) <= len(self.local):
+                skipped.append(curve_id)
+                continue
+            point_curve.append(np.full(keep.sum(), len(ids)))
+            ids.append(curve_id)
+            temps.append(curve_temps[keep])
+            traits.append(curve_traits[keep])
+        if not ids:
+            raise JointFitException("No curve has enough points to fit {}".format(self.model_name))
+        self.ids, self.skipped = ids, skipped
+        self.temps = np.concatenate(temps)
+        self.log_traits = np.log(np.concatenate(traits))
+        self.point_curve = np.concatenate(point_curve)
+
+    def _layout(self):
+        """ Columns of the parameter vector: shared values, hierarchical means, then one block of local parameters per curve """
+        self.n_global = len(self.shared) + len(self.hierarchical)
+        self.n_params = self.n_global + len(self.ids) * len(self.local)
+        self._hier_cols = [self.local.index(name) for name in self.hierarchical]
+        self._hier_sd = np.array(list(self.hierarchical.values()), dtype=float)
+
+    def _unpack(self, x):
+        """ Parameter values per point (or scalars for shared parameters) and the local block """
+        local = x[self.n_global:].reshape(len(self.ids), len(self.local))
+        params = dict(zip(self.shared, x[:len(self.shared)]))
+        for j, name in enumerate(self.local):
+            params[name] = local[self.point_curve, j]
+        return params, local
+
+    def _residuals(self, x):
+        params, local = self._unpack(x)
+        with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+            residuals = schoolfield_log(self.model_name, self.temps, params) - self.log_traits
+        if not self.hierarchical:
+            return residuals
+        # Each curve's hierarchical parameters, standardised around the group means
+        means = x[len(self.shared):self.n_global]
+        prior = (local[:, self._hier_cols] - means) / self._hier_sd
+        return np.concatenate([residuals, prior.T.ravel()])
+
+    def sparsity(self):
+        """ Sparsity pattern of the Jacobian (residuals x parameters)
+
+        Returns
+        -------
+        sparsity: scipy.sparse.csr_matrix
+            1 where a residual depends on a parameter
+        """
+        n_points, n_local, n_curves = len(self.temps), len(self.local), len(self.ids)
+        rows, cols = [], []
+        # Points depend on the shared parameters and their own curve's block
+        point_rows = np.arange(n_points)
+        for j in range(len(self.shared)):
+            rows.append(point_rows)
+            cols.append(np.full(n_points, j))
+        for j in range(n_local):
+            rows.append(point_rows)
+            cols.append(self.n_global + self.point_curve * n_local + j)
+        # Prior rows depend on a group mean and one curve's value
+        for h, j in enumerate(self._hier_cols):
+            prior_rows = n_points + h * n_curves + np.arange(n_curves)
+            rows.extend([prior_rows, prior_rows])
+            cols.extend([np.full(n_curves, len(self.shared) + h), self.n_global + np.arange(n_curves) * n_local + j])
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        n_rows = n_points + len(self.hierarchical) * n_curves
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_rows, self.n_params))
+
+    def _start(self, starts):
+        """ Starting vector from per-curve estimates (missing curves get the median of the others) """
+        starts = starts.reindex(self.ids)
+        missing = [name for name in self.param_names if name not in starts.columns]
+        if missing:
+            raise JointFitException("Starting estimates have no {} column".format(missing))
+        medians = starts[list(self.param_names)].median()
+        if medians.isna().any():
+            raise JointFitException("No curve has starting estimates")
+        starts = starts[list(self.param_names)].fillna(medians)
+        x0 = [medians[name] for name in self.shared] + [medians[name] for name in self.hierarchical]
+        x0 = np.concatenate([x0, starts[list(self.local)].to_numpy(dtype=float).ravel()])
+
+        lower = [joint_bounds[name][0] for name in self.shared + tuple(self.hierarchical)] + [joint_bounds[name][0] for name in self.local] * len(self.ids)
+        upper = [joint_bounds[name][1] for name in self.shared + tuple(self.hierarchical)] + [joint_bounds[name][1] for name in self.local] * len(self.ids)
+        lower, upper = np.array(lower, dtype=float), np.array(upper, dtype=float)
+        # least_squares needs a strictly feasible start
+        return np.clip(x0, lower + 1e-9, np.where(np.isfinite(upper), upper - 1e-9, np.inf)), (lower, upper)
+
+    def independent_fits(self, datasets, vals, iter=5, seed=0, temps_col="interactor1K", traits_col="standardisedtraitvalue"):
+        """ Fit every curve on its own (the default starting point of the joint fit)
+
+        Returns
+        -------
+        starts: pandas DataFrame
+            Estimates of every curve, indexed by originalid
+        """
+        rows = {}
+        for curve_id, dataset in datasets.items():
+            rows[curve_id] = fit_tpc(dataset[temps_col].to_numpy(dtype=float), dataset[traits_col].to_numpy(dtype=float), vals,
+                                     model_name=self.model_name, iter=iter, seed=curve_seed(curve_id, seed))
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+    def fit(self, datasets, starts=None, vals=None, iter=5, seed=0, temps_col="interactor1K", traits_col="standardisedtraitvalue"):
+        """ Fit the curves jointly
+
+        Parameters
+        ----------
+        datasets: dict
+            Dictionary of curves with originalid as keys (from get_datasets)
+        starts: pandas DataFrame, optional
+            Per-curve starting estimates indexed by originalid (or with an originalid column), e.g. the pipeline's results. Fitted independently if not given.
+        vals: dict, optional
+            Sampling bounds for the independent fits (needed without starts)
+        iter: int
+            Random restarts of the independent fits
+        seed: int
+            Base random seed of the independent fits
+        temps_col, traits_col: str
+            Temperature (K) and trait columns
+
+        Returns
+        -------
+        self: JointFit
+            With estimates (per curve), group (shared values and hierarchical means with standard errors), aic, nfev, success and wall set
+        """
+        start = time.perf_counter()
+        self._stack(datasets, temps_col, traits_col)
+        self._layout()
+
+        if starts is None:
+            if vals is None:
+                raise JointFitException("Give either starting estimates or sampling bounds (vals) for independent fits")
+            starts = self.independent_fits({curve_id: datasets[curve_id] for curve_id in self.ids}, vals, iter=iter, seed=seed,
+                                           temps_col=temps_col, traits_col=traits_col)
+        elif "originalid" in starts.columns:
+            starts = starts.drop_duplicates("originalid", keep="last").set_index("originalid")
+        x0, bounds = self._start(starts)
+
+        self.result = optimize.least_squares(self._residuals, x0, jac_sparsity=self.sparsity(), bounds=bounds, method="trf",
+                                             tr_solver="lsmr", x_scale="jac", ftol=self.ftol, xtol=self.xtol, max_nfev=self.max_nfev)
+        self.wall = time.perf_counter() - start
+        self.success = self.result.success
+        self.nfev = self.result.nfev
+        self._summarise()
+        return self
+
+    def _summarise(self):
+        """ Per-curve estimates, group-level values with standard errors, and AIC over the data points """
+        x = self.result.x
+        n_points = len(self.temps)
+        residuals = self.result.fun[:n_points]
+        chisqr = np.sum(residuals ** 2)
+        self.aic = n_points * np.log(chisqr / n_points) + 2 * self.n_params
+
+        local = x[self.n_global:].reshape(len(self.ids), len(self.local))
+        estimates = pd.DataFrame(local, index=pd.Index(self.ids, name="originalid"), columns=list(self.local))
+        for j, name in enumerate(self.shared):
+            estimates[name] = x[j]
+        self.estimates = estimates[list(self.param_names)]
+
+        names = list(self.shared) + [name + "_mean" for name in self.hierarchical]
+        self.group = pd.DataFrame({"estimate": x[:self.n_global], "stderr": self.stderr(np.arange(self.n_global))}, index=names)
+
+    def stderr(self, cols):
+        """ Standard errors of some parameters from the sparse Jacobian at the solution
+
+        Parameters
+        ----------
+        cols: array
+            Columns of the parameter vector
+
+        Returns
+        -------
+        stderr: numpy array
+            NaN if the problem is singular at the solution
+        """
+        jac = sparse.csc_matrix(self.result.jac)
+        dof = jac.shape[0] - jac.shape[1]
+        if dof <= 0 or len(cols) == 0:
+            return np.full(len(cols), np.nan)
+        variance = 2 * self.result.cost / dof
+        try:
+            # Only the needed columns of (J'J)^-1, from one sparse factorisation
+            lu = linalg.splu((jac.T @ jac).tocsc())
+            unit = np.zeros((jac.shape[1], len(cols)))
+            unit[cols, np.arange(len(cols))] = 1.0
+            diagonal = lu.solve(unit)[cols, np.arange(len(cols))]
+        except RuntimeError:
+            return np.full(len(cols), np.nan)
+        with np.errstate(invalid="ignore"):
+            return np.sqrt(diagonal * variance)
+
+    def __repr__(self):
+        return "JointFit('{}', shared={}, hierarchical={})".format(self.model_name, self.shared, self.hierarchical)
+
+def fit_joint_groups(datasets, by=group_cols, model_name="sharpeschoolhigh", shared=("E",), hierarchical=None, starts=None, **kwargs):
+    """ Fit every group of related curves jointly (see tpcfit.grouping)
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    by: tuple
+        Group columns
+    model_name, shared, hierarchical:
+        As JointFit
+    starts: pandas DataFrame, optional
+        Per-curve starting estimates
+    kwargs: keyword arguments
+        Passed to JointFit.fit
+
+    Returns
+    -------
+    estimates: pandas DataFrame
+        Per-curve estimates with a group column
+    groups: pandas DataFrame
+        Group-level estimates and standard errors, curves, AIC, nfev and convergence of each group
+    """
+    estimates, groups = [], []
+    for key, ids in group_curves(datasets, by=by).items():
+        try:
+            joint = JointFit(model_name, shared, hierarchical).fit({curve_id: datasets[curve_id] for curve_id in ids}, starts=starts, **kwargs)
+        except JointFitException:
+            # e.g. no curve of the group has enough points
+            continue
+        estimates.append(joint.estimates.assign(group=key))
+        row = {"group": key, "curves": len(joint.ids), "aic": joint.aic, "nfev": joint.nfev, "success": joint.success}
+        for name, values in joint.group.iterrows():
+            row[name] = values["estimate"]
+            row[name + "_stderr"] = values["stderr"]
+        groups.append(row)
+    if not estimates:
+        return pd.DataFrame(), pd.DataFrame()
+    return pd.concat(estimates), pd.DataFrame(groups).set_index("group")
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" lazy_imports.py defers importing heavy dependencies (lmfit, scipy.stats, pandas) until they are first used.
+
+lmfit alone takes over a second to import (it pulls in scipy.stats, pandas and matplotlib), which every CLI call and spawned worker would otherwise pay even when it never fits a curve."""
+
+import types
+import importlib
+
+class LazyModule(types.ModuleType):
+    """ Stand-in for a module that imports it on first attribute access """
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def _load(self):
+        module = importlib.import_module(self.__name__)
+        # Later lookups find the attributes directly, without going through __getattr__
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return "LazyModule('{}')".format(self.__name__)
+
+def lazy_import(name):
+    """ Module that is only imported when one of its attributes is first used
+
+    Parameters
+    ----------
+    name: str
+        Full module name, e.g. "scipy.stats"
+
+    Returns
+    -------
+    module: LazyModule
+    """
+    return LazyModule(name)
@@ -2,10 +2,14 @@
 # -*- coding: utf-8 -*-
 """ models.py contains all available mathematical models to be fitted to thermal performance curves.
 
-NOTE: Currently only Sharpe-Schoolfield variants """
+NOTE: Currently only Sharpe-Schoolfield variants (other models are declared in tpcfit.registry) """
 
+import time
 import numpy as np
-from lmfit import minimize, Minimizer, Parameters
+from tpcfit.lazy_imports import lazy_import
+
+# Imported on first fit
+lmfit = lazy_import("lmfit")
 
 class ThermalModelsException(Exception):
     """ General purpose exception generator for ThermalModels"""
@@ -17,6 +21,46 @@ class ThermalModelsException(Exception):
     def __str__(self):
         return "{}".format(self.msg)
 
+class ResidualWorkspace(object):
+    """ Per-curve invariants and scratch buffers for evaluating residuals without allocating
+
+    1/T, 1/T - 1/Tref and the log traits are computed once, and every residual call of every restart of a curve evaluates the model in the same scratch buffers. Only the returned residual array is new on each call: scipy's MINPACK wrapper keeps the array returned by the function rather than copying it, so it can't be reused.
+    """
+
+    def __init__(self, temps, traits, Tref=None):
+        """
+        Parameters
+        ----------
+        temps: numpy array
+            Temperature array in Kelvin
+        traits: numpy array
+            Trait array (not logged)
+        Tref: float, optional
+            Reference temperature (default: ThermalModels.Tref)
+        """
+        self.Tref = ThermalModels.Tref if Tref is None else Tref
+        self.temps = np.asarray(temps, dtype=float)
+        self.traits = np.asarray(traits, dtype=float)
+        self.inv_temps = 1 / self.temps
+        self.delta_inv_temps = self.inv_temps - (1 / self.Tref)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.log_traits = np.log(self.traits)
+        # Boltzmann-Arrhenius term and low and high temperature inactivation terms
+        self.boltzmann = np.empty_like(self.temps)
+        self.low = np.empty_like(self.temps)
+        self.high = np.empty_like(self.temps)
+
+    def matches(self, temps, traits, Tref):
+        """ True if the workspace was built for this curve and reference temperature """
+        return self.Tref == Tref and np.array_equal(self.temps, temps) and np.array_equal(self.traits, traits)
+
+    def penalty(self):
+        """ Residuals returned for parameters outside the feasible region """
+        return np.full(len(self.temps), 1e10)
+
+    def __repr__(self):
+        return "ResidualWorkspace(n={}, Tref={})".format(len(self.temps), self.Tref)
+
 class ThermalModels(object):
     """ Class containing thermal models for fitting """
     # Set some useful class variables
@@ -38,7 +82,12 @@ class ThermalModels(object):
     _err_zero_neg_vals = ("Zero or negative values not accepted. Please supply positive values only.")
 
 
-    def __init__(self, temps=None, traits=None, fit_pars=None):
+    def __init__(self, temps=None, traits=None, fit_pars=None, timeout=None, workspace=None):
+        # Wall-clock budget for a single fit in seconds (None for no limit)
+        self.timeout = timeout
+        self.timed_out = False
+        # Instrumentation of the last fit (see minimize_timed)
+        self.metrics = {}
         if temps is not None:
             self.temps = temps
             if not isinstance(temps, np.ndarray):
@@ -59,23 +108,131 @@ class ThermalModels(object):
 
         if fit_pars is not None:
             self.fit_pars = fit_pars
-        if not isinstance(fit_pars, Parameters):
+        if not isinstance(fit_pars, lmfit.Parameters):
             self.fit_pars = self.fit_pars.gauss_params
             #raise ThermalModelsException(self._err_nonparam)
         elif self.fit_pars is None:
             raise ThermalModelsException(self._err_novals)
 
+        # Invariants and buffers for the residuals, shared by the restarts of a curve when given
+        if temps is not None and traits is not None:
+            if workspace is None or not workspace.matches(temps, traits, self.Tref):
+                workspace = ResidualWorkspace(temps, traits, self.Tref)
+            self.workspace = workspace
+
     @classmethod
     def set_Tref(cls, Tref_val):
         """ Allow user to set their own reference temperature """
         cls.Tref = Tref_val
 
+    def refit(self, temps, traits, timeout=None, workspace=None):
+        """ Fit the same model to new data (e.g. the curve with points added), starting from this fit's estimates
+
+        Parameters
+        ----------
+        temps: numpy array
+            Temperature array in Kelvin
+        traits: numpy array
+            Trait array
+        timeout: float, optional
+            Wall-clock budget in seconds (default: this model's)
+        workspace: ResidualWorkspace, optional
+            Invariants and buffers for the new data
+
+        Returns
+        -------
+        model: ThermalModels
+            New model of the same class (check its fit_result and AIC as for any fit)
+        """
+        if getattr(self, "fit_result", None) is None:
+            raise ThermalModelsException("Only a fitted model can be refitted")
+        # The fitted parameters keep their bounds
+        params = self.fit_result.params.copy()
+        return type(self)(temps, traits, params, timeout=self.timeout if timeout is None else timeout, workspace=workspace)
+
+    def mean_square(self):
+        """ Mean squared (log scale) residual of the fit """
+        return self.fit_result.chisqr / self.fit_result.ndata
+
+    def minimize_timed(self, fcn2min, Dfun=None):
+        """ Minimize a model within the wall-clock budget self.timeout
+
+        If the budget runs out the optimizer is aborted and the result is reset to the best parameters evaluated so far, with self.timed_out set to True.
+
+        Parameters
+        ----------
+        fcn2min: callable
+            function to be minimized by the optimizer
+        Dfun: callable, optional
+            Jacobian of fcn2min, called with the same arguments and returning one column per varying parameter (finite differences if None)
+
+        Function evaluations, wall and CPU time, the outcome and the starting and final parameters are recorded in self.metrics (see tpcfit.instrumentation), whether the fit succeeds or raises.
+
+        Returns
+        -------
+        model: lmfit.MinimizerResult
+            Model result object (also kept as self.fit_result)
+        """
+        self.metrics = {"model_name": getattr(self, "model_name", None), "start": self.fit_pars.valuesdict()}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            result = self._minimize(fcn2min, Dfun)
+        except Exception as e:
+            self.metrics.update(status="error", error=type(e).__name__, message=str(e),
+                                wall=time.perf_counter() - wall, cpu=time.process_time() - cpu)
+            raise
+
+        self.metrics.update(status="timed_out" if self.timed_out else "ok", success=result.success, message=result.message,
+                            nfev=result.nfev, njev=getattr(result, "njev", None), aic=result.aic, chisqr=result.chisqr,
+                            estimates=result.params.valuesdict(), wall=time.perf_counter() - wall, cpu=time.process_time() - cpu)
+        return result
+
+    def _minimize(self, fcn2min, Dfun=None):
+        """ minimize_timed without the instrumentation """
+        self.timed_out = False
+        if self.timeout is None:
+            self.fit_result = lmfit.minimize(fcn2min, self.fit_pars, args=(self.temps, self.traits), Dfun=Dfun, xtol = 1e-12, ftol = 1e-12, maxfev = 100000)
+            return self.fit_result
+
+        deadline = time.perf_counter() + self.timeout
+        best = {"ssr": np.inf, "values": None}
+
+        def iter_cb(params, iter, resid, *args, **kws):
+            # Keep track of the best parameters evaluated so far
+            ssr = np.sum(resid ** 2)
+            if ssr < best["ssr"]:
+                best["ssr"] = ssr
+                best["values"] = params.valuesdict()
+            # Returning True aborts the fit
+            if time.perf_counter() > deadline:
+                self.timed_out = True
+                return True
+            return False
+
+        result = lmfit.minimize(fcn2min, self.fit_pars, args=(self.temps, self.traits), iter_cb=iter_cb, Dfun=Dfun, xtol = 1e-12, ftol = 1e-12, maxfev = 100000)
+
+        if self.timed_out and best["values"] is not None:
+            # Reset the result to the best parameters and recalculate fit statistics
+            for name, value in best["values"].items():
+                result.params[name].value = value
+            result.residual = fcn2min(result.params, self.temps, self.traits)
+            result.chisqr = np.sum(result.residual ** 2)
+            ndata = len(result.residual)
+            result.aic = ndata * np.log(result.chisqr / ndata) + 2 * result.nvarys
+            result.bic = ndata * np.log(result.chisqr / ndata) + np.log(ndata) * result.nvarys
+            result.message = "Fit timed out after {} seconds.".format(self.timeout)
+
+        self.fit_result = result
+        return result
+
 class SharpeSchoolfieldFull(ThermalModels):
 
     model_name = "sharpeschoolfull"
 
-    def __init__(self, temps, traits, fit_pars):
-        super().__init__(temps, traits, fit_pars)
+    param_names = ("B0", "E", "Eh", "El", "Th", "Tl")
+
+    def __init__(self, temps, traits, fit_pars, timeout=None, workspace=None):
+        super().__init__(temps, traits, fit_pars, timeout, workspace)
         self.ssf_model = self.fit_ssf(temps, traits, fit_pars)
         if self.ssf_model is not None:
             # Return fitted trait values
@@ -87,17 +244,17 @@ class SharpeSchoolfieldFull(ThermalModels):
             # Return AIC score
             self.AIC = self.ssf_aic(self.ssf_model)
 
-    def ssf_fcn2min(self, temps, traits, fit_pars):
+    def ssf_fcn2min(self, fit_pars, temps, traits):
         """ Function to be minimized
 
         Parameters
         ----------
+        fit_pars: lmfit.parameter.Parameters
+            Trial parameters supplied by the optimizer
         temps: numpy array
             Temperature array in Kelvin
         traits: numpy array
-            Trait array
-        params: lmfit.parameter.Parameters
-            Dictionary of parameters to fit full schoolfield model
+            Log trait array
 
         Returns
         -------
@@ -107,16 +264,18 @@ class SharpeSchoolfieldFull(ThermalModels):
         """
 
         # Set parameter values
-        B0 = self.fit_pars["B0"].value
-        E = self.fit_pars["E"].value
-        Eh = self.fit_pars["Eh"].value
-        El = self.fit_pars["El"].value
-        Th = self.fit_pars["Th"].value
-        Tl = self.fit_pars["Tl"].value
+        B0 = fit_pars["B0"].value
+        E = fit_pars["E"].value
+        Eh = fit_pars["Eh"].value
+        El = fit_pars["El"].value
+        Th = fit_pars["Th"].value
+        Tl = fit_pars["Tl"].value
+
+        ws = self.workspace
 
-        # Eh must be greater than Eh
-        if E >= Eh:
-            return 1e10
+        # Eh must be greater than Eh and B0 positive (the model is logged)
+        if E >= Eh or B0 <= 0:
+            return ws.penalty()
 
         # TH must be greater than Tl
         if Th < (Tl + 1):
@@ -126,10 +285,24 @@ class SharpeSchoolfieldFull(ThermalModels):
         if Tl > Th - 1:
             Tl = Th - 1
 
-        model = np.log((B0 * np.exp(1)**((-E / self.k) * ((1 / self.temps) - (1 / self.Tref)))) / ((1 + (np.exp(1)**((El / self.k) * ((1 / Tl) - (1 / self.temps))))) + (np.exp(1)**((Eh / self.k) * ((1 / Th) - (1 / self.temps))))))
-
-        # Return residual array
-        return np.array(np.exp(model) - self.traits)
+        # log((B0 * e**((-E / k) * (1/T - 1/Tref))) / ((1 + e**((El / k) * (1/Tl - 1/T))) + e**((Eh / k) * (1/Th - 1/T)))), in place
+        b, low, high = ws.boltzmann, ws.low, ws.high
+        np.multiply(-E / self.k, ws.delta_inv_temps, out=b)
+        np.power(np.e, b, out=b)
+        np.multiply(B0, b, out=b)
+        np.subtract(1 / Tl, ws.inv_temps, out=low)
+        np.multiply(El / self.k, low, out=low)
+        np.power(np.e, low, out=low)
+        np.add(1, low, out=low)
+        np.subtract(1 / Th, ws.inv_temps, out=high)
+        np.multiply(Eh / self.k, high, out=high)
+        np.power(np.e, high, out=high)
+        np.add(low, high, out=low)
+        np.divide(b, low, out=b)
+        np.log(b, out=b)
+
+        # Return residual array (on the log scale, as traits are logged before fitting)
+        return b - ws.log_traits
 
     def ssf_fitted_vals(self, ssf_model):
         """ Called by a fit model only: A function to estimate the trait value at a given temperature according
@@ -188,7 +361,7 @@ class SharpeSchoolfieldFull(ThermalModels):
 
         # Minimize model
         try:
-            self.ssf_model = minimize(self.ssf_fcn2min, self.fit_pars, args=(self.temps, self.traits), xtol = 1e-12, ftol = 1e-12, maxfev = 100000)
+            self.ssf_model = self.minimize_timed(self.ssf_fcn2min)
         except Exception:
             return None
 
@@ -252,8 +425,10 @@ class SharpeSchoolfieldHigh(ThermalModels):
 
     model_name = "sharpeschoolhigh"
 
-    def __init__(self, temps, traits, fit_pars):
-        super().__init__(temps, traits, fit_pars)
+    param_names = ("B0", "E", "Eh", "Th")
+
+    def __init__(self, temps, traits, fit_pars, timeout=None, workspace=None):
+        super().__init__(temps, traits, fit_pars, timeout, workspace)
         self.ssh_model = self.fit_ssh(temps, traits, fit_pars)
         if self.ssh_model is not None:
             # Return fitted trait values
@@ -265,17 +440,17 @@ class SharpeSchoolfieldHigh(ThermalModels):
             # Return AIC score
             self.AIC = self.ssh_aic(self.ssh_model)
 
-    def ssh_fcn2min(self, temps, traits, fit_pars):
+    def ssh_fcn2min(self, fit_pars, temps, traits):
         """ Function to be minimized
 
         Parameters
         ----------
+        fit_pars: lmfit.parameter.Parameters
+            Trial parameters supplied by the optimizer
         temps: numpy array
             Temperature array in Kelvin
         traits: numpy array
-            Trait array
-        params: lmfit.parameter.Parameters
-            Dictionary of parameters to fit full schoolfield model
+            Log trait array
 
         Returns
         -------
@@ -285,25 +460,37 @@ class SharpeSchoolfieldHigh(ThermalModels):
         """
 
         # Set parameter values
-        B0 = self.fit_pars["B0"].value
-        E = self.fit_pars["E"].value
-        Eh = self.fit_pars["Eh"].value
-        Th = self.fit_pars["Th"].value
-
-        # Eh must be greater than Eh
-        if E >= Eh:
-            return 1e10
-
-        model = np.log((B0 * np.exp(1)**((-E / self.k) * ((1 / self.temps) - (1 / self.Tref)))) / (1 + (np.exp(1)**((Eh / self.k) * ((1 / Th) - (1 / self.temps))))))
-
-        # Return residual array
-        return np.array(np.exp(model) - self.traits)
-
-    def ssf_fitted_vals(self, ssh_model):
+        B0 = fit_pars["B0"].value
+        E = fit_pars["E"].value
+        Eh = fit_pars["Eh"].value
+        Th = fit_pars["Th"].value
+
+        ws = self.workspace
+
+        # Eh must be greater than Eh and B0 positive (the model is logged)
+        if E >= Eh or B0 <= 0:
+            return ws.penalty()
+
+        # log((B0 * e**((-E / k) * (1/T - 1/Tref))) / (1 + e**((Eh / k) * (1/Th - 1/T)))), in place
+        b, inact = ws.boltzmann, ws.high
+        np.multiply(-E / self.k, ws.delta_inv_temps, out=b)
+        np.power(np.e, b, out=b)
+        np.multiply(B0, b, out=b)
+        np.subtract(1 / Th, ws.inv_temps, out=inact)
+        np.multiply(Eh / self.k, inact, out=inact)
+        np.power(np.e, inact, out=inact)
+        np.add(1, inact, out=inact)
+        np.divide(b, inact, out=b)
+        np.log(b, out=b)
+
+        # Return residual array (on the log scale, as traits are logged before fitting)
+        return b - ws.log_traits
+
+    def ssh_fitted_vals(self, ssh_model):
         """ Called by a fit model only: A function to estimate the trait value at a given temperature.
         Parameters
         ----------
-        ssf_model: lmfit.MinimizerResult
+        ssh_model: lmfit.MinimizerResult
             Minimizer result of a successful fit
 
         Returns
@@ -352,7 +539,7 @@ class SharpeSchoolfieldHigh(ThermalModels):
 
         # Minimize model
         try:
-            self.ssh_model = minimize(self.ssh_fcn2min, self.fit_pars, args=(self.temps, self.traits), xtol = 1e-12, ftol = 1e-12, maxfev = 100000)
+            self.ssh_model = self.minimize_timed(self.ssh_fcn2min)
         except Exception:
             return None
 
@@ -374,11 +561,11 @@ class SharpeSchoolfieldHigh(ThermalModels):
         self.final_estimates = self.ssh_model.params.valuesdict()
         return self.final_estimates
 
-    def ssf_init_params(self, ssf_model):
+    def ssh_init_params(self, ssh_model):
         """ Get parameter estimtes from the model
         Parameters
         ----------
-        ssf_model : lmfit.MinimizerResult
+        ssh_model : lmfit.MinimizerResult
             A successful model result
 
         Returns
@@ -390,11 +577,11 @@ class SharpeSchoolfieldHigh(ThermalModels):
         self.initial_params = self.ssh_model.init_values
         return self.initial_params
 
-    def ssf_aic(self, ssh_model):
+    def ssh_aic(self, ssh_model):
         """ Get model AIC score
         Parameters
         ----------
-        ssf_model : lmfit.MinimizerResult
+        ssh_model : lmfit.MinimizerResult
             A successful model result
 
         Returns
@@ -412,13 +599,15 @@ class SharpeSchoolfieldHigh(ThermalModels):
         def __str__(self):
             pass
 
-class SharpeSchoolfieldlow(ThermalModels):
+class SharpeSchoolfieldLow(ThermalModels):
 
     model_name = "sharpeschoollow"
 
-    def __init__(self, temps, traits, fit_pars):
-        super().__init__(temps, traits, fit_pars)
-        self.ssl_model = self.fit_ssh(temps, traits, fit_pars)
+    param_names = ("B0", "E", "El", "Tl")
+
+    def __init__(self, temps, traits, fit_pars, timeout=None, workspace=None):
+        super().__init__(temps, traits, fit_pars, timeout, workspace)
+        self.ssl_model = self.fit_ssl(temps, traits, fit_pars)
         if self.ssl_model is not None:
             # Return fitted trait values
             self.ssl_fits = self.ssl_fitted_vals(self.ssl_model)
@@ -427,19 +616,19 @@ class SharpeSchoolfieldlow(ThermalModels):
             # Return initial parameter values supplied to the model
             self.initial_params = self.ssl_init_params(self.ssl_model)
             # Return AIC score
-            self.AIC = self.ssh_aic(self.ssl_model)
+            self.AIC = self.ssl_aic(self.ssl_model)
 
-    def ssl_fcn2min(self, temps, traits, fit_pars):
+    def ssl_fcn2min(self, fit_pars, temps, traits):
         """ Function to be minimized
 
         Parameters
         ----------
+        fit_pars: lmfit.parameter.Parameters
+            Trial parameters supplied by the optimizer
         temps: numpy array
             Temperature array in Kelvin
         traits: numpy array
-            Trait array
-        params: lmfit.parameter.Parameters
-            Dictionary of parameters to fit full schoolfield model
+            Log trait array
 
         Returns
         -------
@@ -449,17 +638,33 @@ class SharpeSchoolfieldlow(ThermalModels):
         """
 
         # Set parameter values
-        B0 = self.fit_pars["B0"].value
-        E = self.fit_pars["E"].value
-        El = self.fit_pars["Eh"].value
-        Tl = self.fit_pars["Th"].value
-
-        model = np.log((B0 * np.exp(1)**((-E / self.k) * ((1 / self.temps) - (1 / self.Tref)))) / (1 + (np.exp(1)**((El / self.k) * ((1 / Tl) - (1 / self.temps))))))
-
-        # Return residual array
-        return np.array(np.exp(model) - self.traits)
-
-    def ssf_fitted_vals(self, ssl_model):
+        B0 = fit_pars["B0"].value
+        E = fit_pars["E"].value
+        El = fit_pars["El"].value
+        Tl = fit_pars["Tl"].value
+
+        ws = self.workspace
+
+        # B0 must be positive (the model is logged)
+        if B0 <= 0:
+            return ws.penalty()
+
+        # log((B0 * e**((-E / k) * (1/T - 1/Tref))) / (1 + e**((El / k) * (1/Tl - 1/T)))), in place
+        b, inact = ws.boltzmann, ws.low
+        np.multiply(-E / self.k, ws.delta_inv_temps, out=b)
+        np.power(np.e, b, out=b)
+        np.multiply(B0, b, out=b)
+        np.subtract(1 / Tl, ws.inv_temps, out=inact)
+        np.multiply(El / self.k, inact, out=inact)
+        np.power(np.e, inact, out=inact)
+        np.add(1, inact, out=inact)
+        np.divide(b, inact, out=b)
+        np.log(b, out=b)
+
+        # Return residual array (on the log scale, as traits are logged before fitting)
+        return b - ws.log_traits
+
+    def ssl_fitted_vals(self, ssl_model):
         """ Called by a fit model only: A function to estimate the trait value at a given temperature.
         Parameters
         ----------
@@ -474,21 +679,21 @@ class SharpeSchoolfieldlow(ThermalModels):
         """
 
         # Get best-fit model parameters
-        B0 = self.ssh_model.params["B0"].value
-        E = self.ssh_model.params["E"].value
-        El = self.ssh_model.params["Eh"].value
-        Tl = self.ssh_model.params["Th"].value
+        B0 = self.ssl_model.params["B0"].value
+        E = self.ssl_model.params["E"].value
+        El = self.ssl_model.params["El"].value
+        Tl = self.ssl_model.params["Tl"].value
 
         # Define model
         model = np.log((B0 * np.exp(1)**((-E / self.k) * ((1 / self.temps) - (1 / self.Tref)))) / (1 + (np.exp(1)**((El / self.k) * ((1 / Tl) - (1 / self.temps))))))
 
         # Get untransformed fitted values
-        self.ssh_fits = np.array(np.exp(model))
+        self.ssl_fits = np.array(np.exp(model))
 
         return self.ssl_fits
 
-    def fit_ssh(self, temps, traits, fit_pars):
-        """ Fitting function for schoolfield full model
+    def fit_ssl(self, temps, traits, fit_pars):
+        """ Fitting function for schoolfield low model
 
         Parameters
         ----------
@@ -512,17 +717,17 @@ class SharpeSchoolfieldlow(ThermalModels):
 
         # Minimize model
         try:
-            self.ssl_model = minimize(self.ssl_fcn2min, self.fit_pars, args=(self.temps, self.traits), xtol = 1e-12, ftol = 1e-12, maxfev = 100000)
+            self.ssl_model = self.minimize_timed(self.ssl_fcn2min)
         except Exception:
             return None
 
         return self.ssl_model
 
-    def ssh_estimates(self, ssl_model):
+    def ssl_estimates(self, ssl_model):
         """ Get parameter estimtes from the model
         Parameters
         ----------
-        ssh_model : lmfit.MinimizerResult
+        ssl_model : lmfit.MinimizerResult
             A successful model result
 
         Returns
@@ -534,7 +739,7 @@ class SharpeSchoolfieldlow(ThermalModels):
         self.final_estimates = self.ssl_model.params.valuesdict()
         return self.final_estimates
 
-    def ssf_init_params(self, ssl_model):
+    def ssl_init_params(self, ssl_model):
         """ Get parameter estimtes from the model
         Parameters
         ----------
@@ -550,7 +755,7 @@ class SharpeSchoolfieldlow(ThermalModels):
         self.initial_params = self.ssl_model.init_values
         return self.initial_params
 
-    def ssf_aic(self, ssl_model):
+    def ssl_aic(self, ssl_model):
         """ Get model AIC score
         Parameters
         ----------
@@ -571,3 +776,6 @@ class SharpeSchoolfieldlow(ThermalModels):
         # readable representation of the object (for user)
         def __str__(self):
             pass
+
+# Keep the original (lower case) name working
+SharpeSchoolfieldlow = SharpeSchoolfieldLow
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" plotting.py draws the observed points and fitted curve of every fitted curve, for visual checks of a whole run.
+
+Plotting one pyplot figure per curve is dominated by creating and tearing down figures. Here each worker process keeps one figure on the non-interactive Agg canvas (pyplot is never imported), with the axes, lines and titles of every panel created once; each curve only replaces the data of those artists before the figure is written. Curves are split into batches that are rendered over a process pool, either as one PNG per curve or as multi-page PDF sheets of several panels per page (one PDF per batch).
+
+Example :
+    >>> paths = plot_fits(datasets, results, "Results/plots", workers=4)
+    >>> paths = plot_fits(datasets, results, "Results/plots", format="pdf", rows=4, cols=4)
+"""
+
+import os
+import multiprocessing
+import numpy as np
+from tpcfit.lazy_imports import lazy_import
+from tpcfit.models import SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow
+from tpcfit.synthetic import schoolfield_log
+
+# Imported on first plot
+mpl_figure = lazy_import("matplotlib.figure")
+backend_agg = lazy_import("matplotlib.backends.backend_agg")
+backend_pdf = lazy_import("matplotlib.backends.backend_pdf")
+
+# Output formats of plot_fits
+plot_formats = ("png", "pdf")
+
+# Points on each fitted curve
+curve_points = 100
+
+class PlottingException(Exception):
+    """ General purpose exception generator for plotting"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def model_curve(model_name, temps, estimates):
+    """ Trait values of a fitted model
+
+    Parameters
+    ----------
+    model_name: str
+        Schoolfield model or a model declared in tpcfit.registry
+    temps: numpy array
+        Temperatures in Kelvin
+    estimates: dict
+        Parameter estimates
+
+    Returns
+    -------
+    traits: numpy array
+    """
+    if model_name in (SharpeSchoolfieldFull.model_name, SharpeSchoolfieldHigh.model_name, SharpeSchoolfieldLow.model_name):
+        return np.exp(schoolfield_log(model_name, temps, estimates))
+    from tpcfit.registry import registered_models
+    if model_name not in registered_models:
+        raise PlottingException("Unknown model '{}'".format(model_name))
+    model = registered_models[model_name]
+    log_traits, = model.kernels.model(temps, model.k, model.Tref, *[estimates[name] for name in model.param_names])
+    return np.exp(np.broadcast_to(log_traits, np.shape(temps)))
+
+class CurvePlotter(object):
+    """ One reusable Agg figure with a grid of panels, each drawing one curve's points and fit """
+
+    def __init__(self, rows=1, cols=1, panel_size=(4, 3), dpi=100):
+        """
+        Parameters
+        ----------
+        rows: int
+            Panels per column of a page
+        cols: int
+            Panels per row of a page
+        panel_size: tuple
+            Width and height of each panel in inches
+        dpi: int
+            Resolution of PNGs
+        """
+        self.rows, self.cols, self.dpi = rows, cols, dpi
+        self.figure = mpl_figure.Figure(figsize=(panel_size[0] * cols, panel_size[1] * rows), dpi=dpi)
+        self.canvas = backend_agg.FigureCanvasAgg(self.figure)
+        axes = self.figure.subplots(rows, cols, squeeze=False).ravel()
+        # Artists of each panel, created once and updated for every curve
+        self.panels = []
+        for ax in axes:
+            observed, = ax.plot([], [], "o", color="black", markersize=4)
+            fitted, = ax.plot([], [], "-", color="tab:red", linewidth=1.5)
+            # Placeholder text, so the layout leaves room for the titles
+            title = ax.set_title("curve (model, AIC 0.0)", fontsize=9)
+            ax.set_xlabel("Temperature (°C)", fontsize=8)
+            ax.set_ylabel("Trait value", fontsize=8)
+            ax.tick_params(labelsize=7)
+            self.panels.append((ax, observed, fitted, title))
+        # Lay the panels out once; the layout engine would otherwise rerun on every save
+        self.figure.tight_layout()
+        self.figure.set_layout_engine("none")
+
+    def __len__(self):
+        return len(self.panels)
+
+    def draw(self, panel, curve_id, temps, traits, result):
+        """ Show a curve in a panel
+
+        Parameters
+        ----------
+        panel: int
+            Index of the panel (row major)
+        curve_id: str
+            originalid of the curve
+        temps: numpy array
+            Temperatures in Kelvin
+        traits: numpy array
+            Trait values
+        result: dict
+            Fit result with model_name, aic and parameter estimates
+        """
+        ax, observed, fitted, title = self.panels[panel]
+        ax.set_visible(True)
+        observed.set_data(temps - 273.15, traits)
+        grid = np.linspace(np.min(temps), np.max(temps), curve_points)
+        fitted.set_data(grid - 273.15, model_curve(result["model_name"], grid, result))
+        title.set_text("{} ({}, AIC {:.1f})".format(curve_id, result["model_name"], result["aic"]))
+        ax.relim()
+        ax.autoscale_view()
+
+    def clear(self, first=0):
+        """ Hide the panels from first on (e.g. on the last page of a sheet) """
+        for ax, observed, fitted, title in self.panels[first:]:
+            ax.set_visible(False)
+
+    def save_png(self, path):
+        """ Write the figure as a PNG (drawn once, straight from the Agg canvas) """
+        self.canvas.print_png(path)
+
+# Plotters created in this process: (rows, cols, panel_size, dpi) -> CurvePlotter
+_plotters = {}
+
+def get_plotter(rows=1, cols=1, panel_size=(4, 3), dpi=100):
+    """ CurvePlotter for a layout, created once per process """
+    key = (rows, cols, tuple(panel_size), dpi)
+    if key not in _plotters:
+        _plotters[key] = CurvePlotter(rows, cols, panel_size, dpi)
+    return _plotters[key]
+
+def _file_name(curve_id):
+    """ File name of a curve's PNG (path separators replaced) """
+    return "{}.png".format(str(curve_id).replace(os.sep, "_"))
+
+def render_pngs(curves, directory, panel_size=(4, 3), dpi=100):
+    """ Render one PNG per curve
+
+    Parameters
+    ----------
+    curves: list of tuples
+        (originalid, temps, traits, result) of each curve
+    directory: str
+        Output directory
+    panel_size: tuple
+        Figure size in inches
+    dpi: int
+        Resolution
+
+    Returns
+    -------
+    paths: list
+        Paths written
+    """
+    plotter = get_plotter(1, 1, panel_size, dpi)
+    paths = []
+    for curve_id, temps, traits, result in curves:
+        plotter.draw(0, curve_id, temps, traits, result)
+        path = os.path.join(directory, _file_name(curve_id))
+        plotter.save_png(path)
+        paths.append(path)
+    return paths
+
+def render_sheets(curves, path, rows=4, cols=4, panel_size=(4, 3)):
+    """ Render curves as a multi-page PDF of rows x cols panels per page
+
+    Parameters
+    ----------
+    curves: list of tuples
+        (originalid, temps, traits, result) of each curve
+    path: str
+        Path of the PDF
+    rows: int
+        Panels per column of a page
+    cols: int
+        Panels per row of a page
+    panel_size: tuple
+        Size of each panel in inches
+
+    Returns
+    -------
+    paths: list
+        [path]
+    """
+    plotter = get_plotter(rows, cols, panel_size)
+    per_page = len(plotter)
+    with backend_pdf.PdfPages(path) as pdf:
+        for start in range(0, len(curves), per_page):
+            page = curves[start:start + per_page]
+            for panel, (curve_id, temps, traits, result) in enumerate(page):
+                plotter.draw(panel, curve_id, temps, traits, result)
+            plotter.clear(len(page))
+            pdf.savefig(plotter.figure)
+    return [path]
+
+def _render_batch(task):
+    """ Render a batch of curves in a worker """
+    index, curves, directory, format, rows, cols, panel_size, dpi = task
+    if format == "png":
+        return render_pngs(curves, directory, panel_size, dpi)
+    return render_sheets(curves, os.path.join(directory, "sheets_{:04d}.pdf".format(index)), rows, cols, panel_size)
+
+def plot_fits(datasets, results, directory, format="png", workers=None, rows=4, cols=4, panel_size=(4, 3), dpi=100,
+              batch_size=None, temps_col="interactor1K", traits_col="standardisedtraitvalue"):
+    """ Plot the observed points and fitted curve of every fitted curve
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    results: pandas DataFrame or list of dicts
+        Fit results with originalid, model_name, aic and parameter estimates. Curves without a fit are skipped.
+    directory: str
+        Output directory (created if missing)
+    format: str
+        "png" (one file per curve) or "pdf" (sheets of rows x cols curves, one PDF per batch)
+    workers: int
+        Number of worker processes (default: number of CPUs; 1 renders in this process)
+    rows: int
+        Panels per column of a PDF page
+    cols: int
+        Panels per row of a PDF page
+    panel_size: tuple
+        Size of each panel in inches
+    dpi: int
+        Resolution of PNGs
+    batch_size: int, optional
+        Curves per batch (default: spread over about 4 batches per worker, in whole PDF pages)
+    temps_col: str
+        Temperature column (Kelvin)
+    traits_col: str
+        Trait column
+
+    Returns
+    -------
+    paths: list
+        Files written, in the order of the curves
+    """
+    if format not in plot_formats:
+        raise PlottingException("Unknown plot format '{}'. Choose from {}".format(format, plot_formats))
+    records = results.to_dict("records") if hasattr(results, "to_dict") else list(results)
+    curves = []
+    for result in records:
+        curve_id = result["originalid"]
+        aic = result.get("aic")
+        if curve_id not in datasets or result.get("model_name") is None or aic is None or aic != aic:
+            continue
+        dataset = datasets[curve_id]
+        curves.append((curve_id, np.asarray(dataset[temps_col], dtype=float), np.asarray(dataset[traits_col], dtype=float), result))
+
+    os.makedirs(directory, exist_ok=True)
+    workers = workers if workers is not None else os.cpu_count()
+    if batch_size is None:
+        batch_size = max(1, -(-len(curves) // max(workers * 4, 1)))
+        if format == "pdf":
+            # Whole pages, so only the last page of each PDF has empty panels
+            batch_size = -(-batch_size // (rows * cols)) * rows * cols
+    tasks = [(i, curves[start:start + batch_size], directory, format, rows, cols, panel_size, dpi)
+             for i, start in enumerate(range(0, len(curves), batch_size))]
+
+    if workers <= 1 or len(tasks) <= 1:
+        batches = [_render_batch(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            batches = pool.map(_render_batch, tasks, chunksize=1)
+    return [path for batch in batches for path in batch]
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" profile_likelihood.py computes profile-likelihood confidence intervals of the Schoolfield parameters of fitted curves.
+
+Standard errors from the covariance of a least-squares fit assume the log-likelihood is quadratic around the optimum, which it often isn't for Th, Tl, Eh and El when the peak or trough is near the edge of the data. The profile likelihood of a parameter holds it fixed at values on a grid and refits the others; the interval is where the deviance n * log(RSS / RSS_min) stays below the chi-squared quantile.
+
+Profiles walk outwards from each curve's estimate in both directions, one grid step at a time, and each grid point is refitted starting from the solution at its neighbour. The refits of a step (every curve, parameter and direction still walking) are solved together by the batched Levenberg-Marquardt solver of batched.py: the residuals and analytic Jacobians of all of them come from one vectorised evaluation on curves padded to the same length, each refit has its own damping, and refits leave the batch as they converge. A direction stops once its deviance has crossed the threshold or its parameter reaches a bound. Grid steps are set from each curve's standard errors and widen geometrically when the profile is flatter than they suggest.
+
+Example :
+    >>> intervals, profiles = profile_fits(datasets, pd.read_csv("Results/fits.csv"), params=("Th", "Eh"))
+"""
+
+import time
+import numpy as np
+from tpcfit.lazy_imports import lazy_import
+from tpcfit.synthetic import synthetic_models
+from tpcfit.batched import batched_lm, BatchedSchoolfield
+
+# Imported on first use
+pd = lazy_import("pandas")
+special = lazy_import("scipy.special")
+
+# Largest distance walked from the estimate along each parameter (B0 is limited to its own value)
+profile_widths = {"E": 2.0, "Eh": 10.0, "El": 10.0, "Th": 30.0, "Tl": 30.0}
+
+class ProfileException(Exception):
+    """ General purpose exception generator for profile likelihoods"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+class ProfileLikelihood(object):
+    """ Profile likelihoods and intervals of the parameters of many curves fitted with the same model """
+
+    def __init__(self, model_name="sharpeschoolhigh", params=None, level=0.95, n_steps=10, z_max=3.0, max_steps=16, batch_size=4096,
+                 ftol=1e-10, xtol=1e-10, max_iter=200):
+        """
+        Parameters
+        ----------
+        model_name: str
+            Schoolfield model the curves were fitted with
+        params: tuple, optional
+            Parameters to profile (default: all parameters of the model)
+        level: float
+            Confidence level of the intervals
+        n_steps: int
+            Grid steps on each side of the estimate covering z_max standard errors
+        z_max: float
+            Standard errors covered by the first n_steps steps
+        max_steps: int
+            Grid steps on each side at most; steps after n_steps double in size
+        batch_size: int
+            Refits solved together at most (bounds memory)
+        ftol, xtol: float
+            Relative reduction of the residual sum of squares, and relative step, below which a refit has converged
+        max_iter: int
+            Maximum number of iterations of each grid step
+        """
+        if model_name not in synthetic_models:
+            raise ProfileException("Unknown model '{}'. Choose from {}".format(model_name, sorted(synthetic_models)))
+        self.model_name = model_name
+        self.param_names = synthetic_models[model_name].param_names
+        self.params = tuple(params) if params is not None else self.param_names
+        unknown = [name for name in self.params if name not in self.param_names]
+        if unknown:
+            raise ProfileException("{} aren't parameters of {}".format(unknown, model_name))
+        if not 0 < level < 1:
+            raise ProfileException("Confidence level must be between 0 and 1, not {}".format(level))
+        self.level, self.n_steps, self.z_max, self.max_steps, self.batch_size = level, n_steps, z_max, max_steps, batch_size
+        self.ftol, self.xtol, self.max_iter = ftol, xtol, max_iter
+        # Padded curves, residuals and bounds of the batched solver
+        self.solver = BatchedSchoolfield(model_name, ftol, xtol, max_iter)
+        self.lower, self.upper = self.solver.lower, self.solver.upper
+
+    def _stack(self, datasets, estimates, temps_col, traits_col):
+        """ Points of every curve with estimates and more positive points than parameters, padded to the longest curve """
+        ids, temps, traits, thetas = [], [], [], []
+        for curve_id, theta in estimates.items():
+            if curve_id not in datasets or not np.all(np.isfinite(theta)):
+                continue
+            dataset = datasets[curve_id]
+            curve_temps, curve_traits = dataset[temps_col].to_numpy(dtype=float), dataset[traits_col].to_numpy(dtype=float)
+            keep = np.isfinite(curve_temps) & np.isfinite(curve_traits) & (curve_traits > 0)
+            if keep.sum() <= len(self.param_names):
+                continue
+            ids.append(curve_id)
+            temps.append(curve_temps[keep])
+            traits.append(curve_traits[keep])
+            thetas.append(theta)
+        if not ids:
+            raise ProfileException("No curve has estimates and enough points to profile {}".format(self.model_name))
+        self.ids = ids
+        self.n_points = np.array([len(curve_temps) for curve_temps in temps])
+        self.solver.pad(list(zip(temps, traits)))
+        self.theta = np.clip(np.array(thetas, dtype=float), self.lower, self.upper)
+        self.theta = self.solver.project(self.theta)
+
+    def _rss(self, theta):
+        """ Residual sum of squares of every curve at parameters theta (curves x parameters) """
+        residuals, jac = self.solver.evaluate(np.arange(len(self.ids)), theta)
+        return np.sum(residuals ** 2, axis=1)
+
+    def stderr(self, theta):
+        """ Standard errors of every curve's parameters from the Jacobian at theta
+
+        Returns
+        -------
+        stderr: numpy array
+            Curves x parameters, NaN where a curve's problem is singular
+        """
+        n_params = theta.shape[1]
+        residuals, jac = self.solver.evaluate(np.arange(len(self.ids)), theta)
+        jtj = np.einsum("cni,cnj->cij", jac, jac)
+        variance = np.sum(residuals ** 2, axis=1) / np.maximum(self.n_points - n_params, 1)
+        # Invert the correlation form of J'J, whose conditioning doesn't depend on the parameter scales
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.sqrt(np.einsum("cii->ci", jtj))
+            corr = jtj / scale[:, :, None] / scale[:, None, :]
+            ok = np.all(np.isfinite(corr), axis=(1, 2)) & (scale.min(axis=1) > 0)
+            ok[ok] = np.linalg.cond(corr[ok]) < 1e12
+            stderr = np.full(theta.shape, np.nan)
+            if ok.any():
+                diagonal = np.einsum("cii->ci", np.linalg.inv(corr[ok])) / scale[ok] ** 2
+                stderr[ok] = np.sqrt(diagonal * variance[ok, None])
+        return stderr
+
+    def _steps(self, theta, stderr):
+        """ First grid step of every curve and profiled parameter """
+        steps = np.empty((len(theta), len(self.params)))
+        for p, name in enumerate(self.params):
+            j = self.param_names.index(name)
+            width = profile_widths.get(name, np.inf)
+            cap = np.minimum(width, np.abs(theta[:, j])) if name == "B0" else np.full(len(theta), width)
+            span = np.where(np.isfinite(stderr[:, j]), self.z_max * stderr[:, j], cap)
+            span = np.clip(np.minimum(span, cap), 1e-6 * np.maximum(np.abs(theta[:, j]), 1), None)
+            steps[:, p] = span / self.n_steps
+        return steps
+
+    def _offset(self, step):
+        """ Distance from the estimate (in units of the first step) of grid step number step """
+        if step <= self.n_steps:
+            return float(step)
+        return self.n_steps * 2.0 ** (step - self.n_steps)
+
+    def _refit(self, curves, fixed_cols, fixed_values, starts):
+        """ Refit many curves at once, each with one parameter held fixed
+
+        Parameters
+        ----------
+        curves: numpy array
+            Curve of each problem
+        fixed_cols: numpy array
+            Fixed parameter of each problem
+        fixed_values: numpy array
+            Value of the fixed parameter
+        starts: numpy array
+            Starting parameters of each problem (problems x parameters)
+
+        Returns
+        -------
+        theta: numpy array
+            Fitted parameters of each problem (with the fixed values)
+        rss: numpy array
+            Residual sum of squares of each problem
+        nfev: int
+            Number of batched evaluations
+        """
+        n_problems, n_params = starts.shape
+        # Columns of the free parameters of each problem
+        free = np.arange(n_params - 1)[None, :]
+        free = free + (free >= fixed_cols[:, None])
+        theta = starts.copy()
+        theta[np.arange(n_problems), fixed_cols] = fixed_values
+        theta, rss, nfev, converged = batched_lm(lambda problems, values: self.solver.evaluate(curves[problems], values), theta, free,
+                                                 self.lower, self.upper, self.solver.log_cols, feasible=self.solver.feasible,
+                                                 project=self.solver.project, ftol=self.ftol, xtol=self.xtol, max_iter=self.max_iter)
+        # The projection can move a fixed Th up to Tl + 1, which describes the same curve, so report the grid value
+        theta[np.arange(n_problems), fixed_cols] = fixed_values
+        return theta, rss, nfev.max()
+
+    def fit(self, datasets, estimates, temps_col="interactor1K", traits_col="standardisedtraitvalue"):
+        """ Profile the parameters of every curve
+
+        Parameters
+        ----------
+        datasets: dict
+            Dictionary of curves with originalid as keys (from get_datasets)
+        estimates: dict or pandas DataFrame
+            originalid -> parameter estimates of the model (e.g. fit results indexed by originalid)
+        temps_col, traits_col: str
+            Temperature (K) and trait columns
+
+        Returns
+        -------
+        self: ProfileLikelihood
+            With intervals (one row per curve and parameter), profiles (every grid point), nfev and wall set
+        """
+        start = time.perf_counter()
+        if hasattr(estimates, "iterrows"):
+            estimates = {curve_id: row for curve_id, row in estimates.iterrows()}
+        estimates = {curve_id: np.array([theta[name] for name in self.param_names], dtype=float) for curve_id, theta in estimates.items()}
+        self._stack(datasets, estimates, temps_col, traits_col)
+        # Chi-squared quantile with one degree of freedom (scipy.stats is slow to import)
+        self.threshold = special.ndtri((1 + self.level) / 2) ** 2
+
+        n_curves = len(self.ids)
+        rss_hat = self._rss(self.theta)
+        se = self.stderr(self.theta)
+        steps = self._steps(self.theta, se)
+
+        # Walkers: one per curve, profiled parameter and direction
+        curve = np.repeat(np.arange(n_curves), 2 * len(self.params))
+        param = np.tile(np.repeat(np.arange(len(self.params)), 2), n_curves)
+        direction = np.tile([-1.0, 1.0], n_curves * len(self.params))
+        cols = np.array([self.param_names.index(name) for name in self.params])[param]
+        step = steps[curve, param]
+        current = self.theta[curve].copy()
+        active = np.ones(len(curve), dtype=bool)
+
+        # Grid points: (walker, value, rss, parameters)
+        points = [(w, self.theta[curve[w], cols[w]], rss_hat[curve[w]], self.theta[curve[w]]) for w in range(len(curve))]
+        self.nfev = 0
+        for k in range(1, self.max_steps + 1):
+            values = self.theta[curve, cols] + direction * self._offset(k) * step
+            # Stop at the bounds of the profiled parameter
+            active &= (values >= self.lower[cols]) & (values <= self.upper[cols])
+            walkers = np.flatnonzero(active)
+            if not len(walkers):
+                break
+            for batch in np.array_split(walkers, -(-len(walkers) // self.batch_size)):
+                theta, rss, nfev = self._refit(curve[batch], cols[batch], values[batch], current[batch])
+                self.nfev += nfev
+                for w, value, walker_rss, walker_theta in zip(batch, values[batch], rss, theta):
+                    points.append((w, value, walker_rss, walker_theta))
+                ok = np.isfinite(rss)
+                current[batch[ok]] = theta[ok]
+                deviance = self.n_points[curve[batch]] * np.log(rss / rss_hat[curve[batch]])
+                # A direction stops once it has crossed the threshold (or its refit failed)
+                active[batch[~ok | (deviance > self.threshold)]] = False
+
+        self._summarise(points, curve, param, rss_hat, se)
+        self.wall = time.perf_counter() - start
+        return self
+
+    def _summarise(self, points, curve, param, rss_hat, se):
+        """ Profile table, and the interval where each profile's deviance crosses the threshold """
+        walker = np.array([point[0] for point in points])
+        value = np.array([point[1] for point in points])
+        rss = np.array([point[2] for point in points])
+        theta = np.array([point[3] for point in points])
+        # Deviance from the best fit found, in case a profile improves on the estimate
+        best = rss_hat.copy()
+        np.fmin.at(best, curve[walker], rss)
+        deviance = self.n_points[curve[walker]] * np.log(rss / best[curve[walker]])
+
+        profiles = pd.DataFrame(theta, columns=list(self.param_names))
+        profiles.insert(0, "originalid", np.array(self.ids, dtype=object)[curve[walker]])
+        profiles.insert(1, "model_name", self.model_name)
+        profiles.insert(2, "param", np.array(self.params, dtype=object)[param[walker]])
+        profiles.insert(3, "value", value)
+        profiles.insert(4, "deviance", deviance)
+        profiles.insert(5, "rss", rss)
+        # Each grid point once (the estimate is shared by both directions), in increasing order
+        self.profiles = profiles.drop_duplicates(["originalid", "param", "value"]).sort_values(["originalid", "param", "value"], kind="stable")
+        self.profiles = self.profiles.reset_index(drop=True)
+
+        rows = []
+        for (curve_id, name), profile in self.profiles.groupby(["originalid", "param"], sort=False):
+            c, j = self.ids.index(curve_id), self.param_names.index(name)
+            estimate = self.theta[c, j]
+            values, deviances = profile["value"].to_numpy(), profile["deviance"].to_numpy()
+            below, above = values <= estimate, values >= estimate
+            rows.append({"originalid": curve_id, "model_name": self.model_name, "param": name, "estimate": estimate,
+                         "lower": self._crossing(values[below][::-1], deviances[below][::-1]),
+                         "upper": self._crossing(values[above], deviances[above]),
+                         "stderr": se[c, j], "points": len(values)})
+        self.intervals = pd.DataFrame(rows)
+
+    def _crossing(self, values, deviances):
+        """ Where a profile walking away from the estimate first crosses the threshold (linear interpolation), NaN if it doesn't """
+        over = np.flatnonzero(~(deviances <= self.threshold))
+        if not len(over) or over[0] == 0 or not np.isfinite(deviances[over[0]]):
+            return np.nan
+        i = over[0]
+        fraction = (self.threshold - deviances[i - 1]) / (deviances[i] - deviances[i - 1])
+        return values[i - 1] + fraction * (values[i] - values[i - 1])
+
+    def __repr__(self):
+        return "ProfileLikelihood('{}', params={}, level={})".format(self.model_name, self.params, self.level)
+
+def profile_fits(datasets, results, params=None, **kwargs):
+    """ Profile-likelihood intervals of every fitted curve, profiling each model's curves together
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    results: pandas DataFrame
+        Fit results with originalid, model_name and parameter estimates (e.g. the pipeline's results). Curves without a Schoolfield fit are skipped.
+    params: tuple, optional
+        Parameters to profile, where the model has them (default: all)
+    kwargs: keyword arguments
+        Passed to ProfileLikelihood (level, n_steps, ...)
+
+    Returns
+    -------
+    intervals: pandas DataFrame
+        Estimate, lower and upper bounds (NaN where the profile doesn't cross the threshold), and covariance standard error of each curve and parameter
+    profiles: pandas DataFrame
+        Value, deviance and refitted parameters at every grid point
+    """
+    results = results.drop_duplicates("originalid", keep="last").set_index("originalid")
+    intervals, profiles = [], []
+    for model_name, fits in results.groupby("model_name", sort=False):
+        if model_name not in synthetic_models:
+            continue
+        param_names = synthetic_models[model_name].param_names
+        model_params = tuple(name for name in (params or param_names) if name in param_names)
+        if not model_params:
+            continue
+        try:
+            profile = ProfileLikelihood(model_name, model_params, **kwargs).fit(datasets, fits[list(param_names)])
+        except ProfileException:
+            # e.g. no curve has enough points
+            continue
+        intervals.append(profile.intervals)
+        profiles.append(profile.profiles)
+    if not intervals:
+        return pd.DataFrame(), pd.DataFrame()
+    return pd.concat(intervals, ignore_index=True), pd.concat(profiles, ignore_index=True)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" progress.py reports the progress of a batch fit while it runs.
+
+Fit functions are wrapped so that every curve sends a start and a done event to a queue shared with the worker processes. A monitor thread in the main process turns the events into a periodic status line (curves done, curves per second, rolling ETA, failure rate and the slowest curves still being fitted) and, optionally, a JSON-lines event log for dashboards. A curve that stays at the top of the in-flight list for a long time is a straggler; a run whose done count stops moving while nothing is in flight is hung.
+
+Example :
+    >>> with ProgressReporter(total=len(datasets), events="Results/events.jsonl") as progress:
+    ...     results = [progress.wrap(fit_curve)(curve_id, dataset) for curve_id, dataset in datasets.items()]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import functools
+import threading
+import collections
+import multiprocessing
+from tpcfit.screening import SCREEN_FIT_FAILED
+
+# Marks the end of the event queue
+_STOP = "stop"
+
+class ProgressException(Exception):
+    """ General purpose exception generator for ProgressReporter"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def fit_status(result):
+    """ Outcome of a fit from its result dict
+
+    Parameters
+    ----------
+    result: dict
+        Result of a fit function (e.g. fit_curve)
+
+    Returns
+    -------
+    status: str
+        "ok", "timed_out", "failed" or "skipped"
+    """
+    if not isinstance(result, dict):
+        return "ok"
+    if result.get("screen") == SCREEN_FIT_FAILED:
+        return "failed"
+    if result.get("model_name") is None:
+        return "skipped"
+    if result.get("timed_out"):
+        return "timed_out"
+    return "ok"
+
+def _report_fit(fit_func, events, curve_id, *args, **kwargs):
+    """ Call a fit function, sending start and done events for the curve """
+    events.put({"event": "start", "originalid": curve_id, "pid": os.getpid(), "time": time.time()})
+    try:
+        result = fit_func(curve_id, *args, **kwargs)
+    except Exception as e:
+        events.put({"event": "done", "originalid": curve_id, "pid": os.getpid(), "time": time.time(), "status": "error", "error": type(e).__name__})
+        raise
+    events.put({"event": "done", "originalid": curve_id, "pid": os.getpid(), "time": time.time(), "status": fit_status(result)})
+    return result
+
+def format_duration(seconds):
+    """ Format seconds as e.g. 1h02m, 4m35s or 12.3s """
+    if seconds is None or seconds != seconds or seconds == float("inf"):
+        return "?"
+    if seconds >= 3600:
+        return "{}h{:02d}m".format(int(seconds // 3600), int(seconds % 3600 // 60))
+    if seconds >= 60:
+        return "{}m{:02d}s".format(int(seconds // 60), int(seconds % 60))
+    return "{:.1f}s".format(seconds)
+
+class ProgressReporter(object):
+    """ Live progress, throughput and ETA of a batch fit """
+
+    def __init__(self, total=None, events=None, interval=5.0, stream=sys.stderr, window=60.0, slowest=3):
+        """
+        Parameters
+        ----------
+        total: int, optional
+            Number of curves to fit (no ETA if unknown)
+        events: str, optional
+            Path of a JSON-lines file for start, done and progress events
+        interval: float
+            Seconds between status lines and progress events
+        stream: file, optional
+            Where status lines are printed (None for no status lines)
+        window: float
+            Seconds of recent completions used for the rate and ETA
+        slowest: int
+            Number of in-flight curves shown
+        """
+        self.total = total
+        self.events = events
+        self.interval = interval
+        self.stream = stream
+        self.window = window
+        self.slowest = slowest
+        self.counts = collections.Counter()
+        self.in_flight = {}
+        self._recent = collections.deque()
+        self._manager = None
+        self._thread = None
+        self._started = False
+
+    @property
+    def enabled(self):
+        """ False if there is nowhere to report to, in which case fit functions are left unwrapped """
+        return self.events is not None or self.stream is not None
+
+    def start(self):
+        """ Start the event queue and the monitor thread """
+        self._started = True
+        if not self.enabled:
+            return self
+        # A manager queue can be pickled, so wrapped fit functions work in any pool
+        self._manager = multiprocessing.Manager()
+        self.queue = self._manager.Queue()
+        self._file = open(self.events, "a") if self.events is not None else None
+        self.start_time = time.time()
+        self._write({"event": "begin", "time": self.start_time, "total": self.total})
+        self._thread = threading.Thread(target=self._monitor, daemon=True)
+        self._thread.start()
+        return self
+
+    def wrap(self, fit_func):
+        """ Wrap a fit function fit_func(curve_id, ...) so it reports its progress
+
+        Parameters
+        ----------
+        fit_func: callable
+            Picklable fit function taking the curve id as its first argument
+
+        Returns
+        -------
+        fit_func: callable
+            Picklable wrapped function with the same arguments
+        """
+        if not self._started:
+            raise ProgressException("Call start() (or use ProgressReporter as a context manager) before wrapping fit functions")
+        if not self.enabled:
+            return fit_func
+        return functools.partial(_report_fit, fit_func, self.queue)
+
+    def stop(self):
+        """ Stop the monitor, print a final status line and close the event log """
+        self._started = False
+        if self._thread is None:
+            return
+        self.queue.put({"event": _STOP})
+        self._thread.join()
+        self._thread = None
+        summary = self.summary()
+        self._write(dict(summary, event="end"))
+        self._print(summary, final=True)
+        if self._file is not None:
+            self._file.close()
+        self._manager.shutdown()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _monitor(self):
+        """ Consume events until stopped, reporting every interval """
+        next_report = time.time() + self.interval
+        while True:
+            try:
+                event = self.queue.get(timeout=max(next_report - time.time(), 0.01))
+            except queue.Empty:
+                event = None
+            if event is not None:
+                if event["event"] == _STOP:
+                    return
+                self._update(event)
+                self._write(event)
+            if time.time() >= next_report:
+                summary = self.summary()
+                self._write(dict(summary, event="progress"))
+                self._print(summary)
+                next_report = time.time() + self.interval
+
+    def _update(self, event):
+        if event["event"] == "start":
+            self.in_flight[event["originalid"]] = (event["pid"], event["time"])
+        elif event["event"] == "done":
+            self.in_flight.pop(event["originalid"], None)
+            self.counts[event["status"]] += 1
+            self._recent.append(event["time"])
+
+    def summary(self):
+        """ Current progress
+
+        Returns
+        -------
+        summary: dict
+            Curves done (by outcome), in flight and remaining; rate over the recent window; ETA; failure rate and slowest in-flight curves
+        """
+        now = time.time()
+        while self._recent and self._recent[0] < now - self.window:
+            self._recent.popleft()
+        done = sum(self.counts.values())
+        elapsed = now - self.start_time
+
+        # Rate over the recent window, or the whole run while it is shorter than the window
+        span = min(self.window, elapsed)
+        rate = len(self._recent) / span if span > 0 else 0.0
+        remaining = self.total - done if self.total is not None else None
+        eta = remaining / rate if remaining is not None and rate > 0 else None
+
+        slowest = sorted(self.in_flight.items(), key=lambda item: item[1][1])[:self.slowest]
+        return {"time": now, "elapsed": elapsed, "done": done, "total": self.total, "in_flight": len(self.in_flight),
+                "rate": rate, "eta": eta, "failure_rate": (self.counts["failed"] + self.counts["error"]) / done if done else 0.0,
+                "counts": dict(self.counts),
+                "slowest": [{"originalid": str(curve_id), "pid": pid, "running": now - start} for curve_id, (pid, start) in slowest]}
+
+    def _write(self, event):
+        if self._file is not None:
+            self._file.write(json.dumps(event, default=str) + "\n")
+            self._file.flush()
+
+    def _print(self, summary, final=False):
+        if self.stream is None:
+            return
+        total = "/{}".format(summary["total"]) if summary["total"] is not None else ""
+        line = "[{}] {}{} curves, {:.2f} curves/s, ETA {}, failed {:.1%}".format(
+            "done" if final else format_duration(summary["elapsed"]), summary["done"], total,
+            summary["rate"], format_duration(summary["eta"]) if not final else "0s", summary["failure_rate"])
+        if summary["slowest"]:
+            line += ", slowest in flight: " + ", ".join("{} ({}, pid {})".format(s["originalid"], format_duration(s["running"]), s["pid"]) for s in summary["slowest"])
+        print(line, file=self.stream)
+        self.stream.flush()
+
+    def __repr__(self):
+        return "ProgressReporter(total={}, events='{}')".format(self.total, self.events)
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" registry.py declares thermal performance models as expressions, so adding a model doesn't mean writing another ThermalModels subclass.
+
+A model is an expression in the temperature T (Kelvin), its parameters and the constants k and Tref, with bounds and starting ranges for each parameter. From the expression the registry generates two vectorised kernels, the model itself and its analytic derivatives with respect to every parameter (common subexpressions are computed once), compiles them once per process and generates a ThermalModels subclass fitted with them. Declared models plug into resample_model, fit_tpc and everything built on them by name.
+
+Expressions may use +, -, *, /, ** and the functions exp, log, sqrt and pos (pos(x) is x clipped to a small positive number, for models that are 0 outside a temperature range). Like the Schoolfield models, they are fitted to log trait values, and the kernels evaluate the log of the model directly: the log is taken through products, quotients, powers, square roots and exponentials, so nothing under- or overflows, and log(pos(x)) continues linearly below the clip, so a fit starting with points outside a model's range still has a gradient back into it. Every factor of a model should therefore be positive where it is fitted.
+
+Example :
+    >>> register_model("arrhenius", "B0 * exp(-E / k * (1 / T - 1 / Tref))",
+    ...                bounds={"B0": (0, np.inf), "E": (10E-3, np.inf)},
+    ...                start={"B0": (0.05, 1.2), "E": (0.05, 0.85)})
+    >>> fit_tpc(temps, traits, vals, model_name="arrhenius")
+"""
+
+import ast
+import types
+import functools
+import numpy as np
+from tpcfit.lazy_imports import lazy_import
+from tpcfit.models import ThermalModels
+from tpcfit import general_funcs
+
+# Imported on first fit
+lmfit = lazy_import("lmfit")
+
+# Names an expression can use besides its parameters
+expression_constants = ("T", "k", "Tref")
+
+# Functions an expression can use
+expression_functions = ("exp", "log", "sqrt", "pos")
+
+# Floor of pos(x)
+_eps = 1e-2
+
+# Source of each operation, given the source of its operands
+_formats = {"add": "({} + {})", "sub": "({} - {})", "mul": "({} * {})", "div": "({} / {})", "pow": "({} ** {})", "neg": "(-{})",
+            "exp": "np.exp({})", "log": "np.log({})", "sqrt": "np.sqrt({})", "pos": "np.maximum({}, _eps)", "step": "({} > _eps)",
+            "logpos": "(np.log(np.maximum({0}, _eps)) + np.minimum({0} - _eps, 0.0) / _eps)", "dlogpos": "(1.0 / np.maximum({}, _eps))"}
+
+_binary = {ast.Add: "add", ast.Sub: "sub", ast.Mult: "mul", ast.Div: "div", ast.Pow: "pow"}
+
+class RegistryException(Exception):
+    """ General purpose exception generator for the model registry"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def parse_expression(expression):
+    """ Parse a model expression into a tree of nested tuples
+
+    Parameters
+    ----------
+    expression: str
+        Model expression, e.g. "B0 * exp(-E / k * (1 / T - 1 / Tref))"
+
+    Returns
+    -------
+    tree: tuple
+        ("num", value), ("var", name) or (operation, operand, ...), with the operations of _formats
+    """
+    try:
+        node = ast.parse(expression.strip(), mode="eval").body
+    except SyntaxError as e:
+        raise RegistryException("Can't parse model expression '{}': {}".format(expression, e))
+
+    def convert(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return ("num", float(node.value))
+        if isinstance(node, ast.Name):
+            return ("var", node.id)
+        if isinstance(node, ast.BinOp) and type(node.op) in _binary:
+            return (_binary[type(node.op)], convert(node.left), convert(node.right))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = convert(node.operand)
+            return _neg(operand) if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in expression_functions and len(node.args) == 1 and not node.keywords:
+            return (node.func.id, convert(node.args[0]))
+        raise RegistryException("Unsupported term in model expression '{}': only numbers, names, + - * / ** and {} are allowed".format(expression, ", ".join(expression_functions)))
+
+    return convert(node)
+
+def variables(tree):
+    """ Names used by an expression tree """
+    if tree[0] == "var":
+        return {tree[1]}
+    if tree[0] == "num":
+        return set()
+    return set().union(*(variables(operand) for operand in tree[1:]))
+
+# Constructors that fold numbers and drop zeros and ones, so derivatives stay small
+def _is(tree, value):
+    return tree[0] == "num" and tree[1] == value
+
+def _add(a, b):
+    if _is(a, 0):
+        return b
+    if _is(b, 0):
+        return a
+    if a[0] == "num" and b[0] == "num":
+        return ("num", a[1] + b[1])
+    return ("add", a, b)
+
+def _sub(a, b):
+    if _is(b, 0):
+        return a
+    if _is(a, 0):
+        return _neg(b)
+    if a[0] == "num" and b[0] == "num":
+        return ("num", a[1] - b[1])
+    return ("sub", a, b)
+
+def _mul(a, b):
+    if _is(a, 0) or _is(b, 0):
+        return ("num", 0.0)
+    if _is(a, 1):
+        return b
+    if _is(b, 1):
+        return a
+    if a[0] == "num" and b[0] == "num":
+        return ("num", a[1] * b[1])
+    return ("mul", a, b)
+
+def _div(a, b):
+    if _is(a, 0):
+        return ("num", 0.0)
+    if _is(b, 1):
+        return a
+    return ("div", a, b)
+
+def _pow(a, b):
+    if _is(b, 1):
+        return a
+    return ("pow", a, b)
+
+def _neg(a):
+    if a[0] == "num":
+        return ("num", -a[1])
+    if a[0] == "neg":
+        return a[1]
+    return ("neg", a)
+
+def log_expression(tree):
+    """ Log of an expression tree, taken through products, quotients, powers, square roots, exponentials and pos
+
+    Parameters
+    ----------
+    tree: tuple
+        Expression tree (from parse_expression)
+
+    Returns
+    -------
+    log_tree: tuple
+        Expression tree of the log. log(pos(x)) is ("logpos", x), which is log(x) above the clip and continues linearly (with the same slope) below it.
+    """
+    op = tree[0]
+    if op == "mul":
+        return _add(log_expression(tree[1]), log_expression(tree[2]))
+    if op == "div":
+        return _sub(log_expression(tree[1]), log_expression(tree[2]))
+    if op == "pow":
+        return _mul(tree[2], log_expression(tree[1]))
+    if op == "sqrt":
+        return _mul(("num", 0.5), log_expression(tree[1]))
+    if op == "exp":
+        return tree[1]
+    if op == "pos":
+        return ("logpos", tree[1])
+    if op == "num" and tree[1] > 0:
+        return ("num", float(np.log(tree[1])))
+    return ("log", tree)
+
+def differentiate(tree, name):
+    """ Derivative of an expression tree with respect to a variable
+
+    Parameters
+    ----------
+    tree: tuple
+        Expression tree (from parse_expression)
+    name: str
+        Variable to differentiate by
+
+    Returns
+    -------
+    derivative: tuple
+        Expression tree of the derivative (pos(x) has derivative step(x) times that of x)
+    """
+    if name not in variables(tree):
+        return ("num", 0.0)
+    op = tree[0]
+    if op == "var":
+        return ("num", 1.0)
+    a = tree[1]
+    da = differentiate(a, name)
+    if op == "neg":
+        return _neg(da)
+    if op == "exp":
+        return _mul(tree, da)
+    if op == "log":
+        return _div(da, a)
+    if op == "sqrt":
+        return _div(da, _mul(("num", 2.0), tree))
+    if op == "pos":
+        return _mul(("step", a), da)
+    if op == "logpos":
+        return _mul(("dlogpos", a), da)
+    if op == "step":
+        return ("num", 0.0)
+    b = tree[2]
+    db = differentiate(b, name)
+    if op == "add":
+        return _add(da, db)
+    if op == "sub":
+        return _sub(da, db)
+    if op == "mul":
+        return _add(_mul(da, b), _mul(a, db))
+    if op == "div":
+        return _sub(_div(da, b), _div(_mul(a, db), _pow(b, ("num", 2.0))))
+    if op == "pow":
+        if name not in variables(b):
+            # d(a ** c) = c * a ** (c - 1) * da
+            return _mul(_mul(b, _pow(a, _sub(b, ("num", 1.0)))), da)
+        # d(a ** b) = a ** b * (db * log(a) + b * da / a)
+        return _mul(tree, _add(_mul(db, ("log", a)), _div(_mul(b, da), a)))
+    raise RegistryException("Can't differentiate '{}'".format(op))
+
+def _count(tree, counts):
+    """ Count the occurrences of each subtree (the operands of a repeated subtree are counted once) """
+    counts[tree] = counts.get(tree, 0) + 1
+    if counts[tree] == 1 and tree[0] not in ("num", "var"):
+        for operand in tree[1:]:
+            _count(operand, counts)
+        if tree[0] == "logpos":
+            # Its operand appears twice in its source
+            _count(tree[1], counts)
+
+def _source(tree, counts, names, lines):
+    """ Source of a tree, assigning subtrees that occur more than once to temporaries in lines """
+    if tree[0] == "num":
+        return repr(tree[1])
+    if tree[0] == "var":
+        return tree[1]
+    if tree in names:
+        return names[tree]
+    source = _formats[tree[0]].format(*(_source(operand, counts, names, lines) for operand in tree[1:]))
+    if counts[tree] > 1:
+        names[tree] = "_t{}".format(len(names))
+        lines.append("    {} = {}".format(names[tree], source))
+        return names[tree]
+    return source
+
+def _function_source(function_name, arguments, trees):
+    """ Source of a function returning a tuple of expression trees, with common subexpressions computed once """
+    counts = {}
+    for tree in trees:
+        _count(tree, counts)
+    names, lines = {}, []
+    results = [_source(tree, counts, names, lines) for tree in trees]
+    return "def {}({}):\n{}\n    return ({},)\n".format(function_name, ", ".join(arguments), "\n".join(lines), ", ".join(results))
+
+# Kernels compiled in this process: (expression, parameter names) -> kernels
+_kernels = {}
+
+def compile_kernels(expression, param_names):
+    """ Generate and compile the model and Jacobian kernels of an expression (cached per process)
+
+    Parameters
+    ----------
+    expression: str
+        Model expression
+    param_names: tuple
+        Parameters of the model, in the order the kernels take them
+
+    Returns
+    -------
+    kernels: types.SimpleNamespace
+        model(T, k, Tref, *params) -> (log values,), jacobian(T, k, Tref, *params) -> (log values, d log values / d param, ...) and the generated source
+    """
+    key = (expression, tuple(param_names))
+    if key not in _kernels:
+        tree = parse_expression(expression)
+        unknown = variables(tree) - set(param_names) - set(expression_constants)
+        if unknown:
+            raise RegistryException("Unknown names {} in model expression '{}'".format(sorted(unknown), expression))
+        log_tree = log_expression(tree)
+        arguments = list(expression_constants) + list(param_names)
+        source = (_function_source("model", arguments, [log_tree]) + "\n" +
+                  _function_source("jacobian", arguments, [log_tree] + [differentiate(log_tree, name) for name in param_names]))
+        namespace = {"np": np, "_eps": _eps}
+        exec(compile(source, "<model {}>".format(expression), "exec"), namespace)
+        _kernels[key] = types.SimpleNamespace(model=namespace["model"], jacobian=namespace["jacobian"], source=source)
+    return _kernels[key]
+
+class RegisteredModel(ThermalModels):
+    """ Model declared with register_model, fitted with its generated kernels and analytic Jacobian
+
+    Subclasses set model_name, param_names, expression, bounds, start and kernels.
+    """
+
+    model_name = None
+
+    param_names = ()
+
+    def __init__(self, temps, traits, fit_pars, timeout=None, workspace=None):
+        super().__init__(temps, traits, fit_pars, timeout, workspace)
+        self.fit_model = self.fit_registered()
+        if self.fit_model is not None:
+            # Return fitted trait values
+            self.fits = self.fitted_vals(self.fit_model.params)
+            # Return parameter estimates from the model
+            self.final_estimates = self.fit_model.params.valuesdict()
+            # Return initial parameter values supplied to the model
+            self.initial_params = self.fit_model.init_values
+            # Return AIC score
+            self.AIC = self.fit_model.aic
+
+    @classmethod
+    def init_params(cls, randomise=True):
+        """ Parameters of the model with their bounds
+
+        Parameters
+        ----------
+        randomise: bool
+            Draw values from a standard normal (as ssh_init), otherwise start in the middle of the starting range
+
+        Returns
+        -------
+        params: lmfit.Parameter.Parameters object
+            parameter object with parameter constraints
+        """
+        params = lmfit.Parameters()
+        for name in cls.param_names:
+            low, upp = cls.bounds[name]
+            params.add(name, value=np.random.normal() if randomise else np.mean(cls.start[name]), vary=True, min=low, max=upp)
+        return params
+
+    def _values(self, fit_pars):
+        """ Constants and parameter values in the order the kernels take them """
+        return [self.workspace.temps, self.k, self.Tref] + [fit_pars[name].value for name in self.param_names]
+
+    def fcn2min(self, fit_pars, temps, traits):
+        """ Log scale residuals (model - data), or the penalty where the model isn't positive """
+        log_values, = self.kernels.model(*self._values(fit_pars))
+        if not np.all(np.isfinite(log_values)):
+            return self.workspace.penalty()
+        return log_values - self.workspace.log_traits
+
+    def dfun(self, fit_pars, temps, traits):
+        """ Jacobian of fcn2min with respect to the varying parameters (one column each) """
+        log_values, *derivatives = self.kernels.jacobian(*self._values(fit_pars))
+        varying = [i for i, name in enumerate(self.param_names) if fit_pars[name].vary]
+        jacobian = np.zeros((len(self.workspace.temps), len(varying)))
+        if not np.all(np.isfinite(log_values)):
+            # The penalty doesn't depend on the parameters
+            return jacobian
+        for j, i in enumerate(varying):
+            jacobian[:, j] = derivatives[i]
+        return jacobian
+
+    def fitted_vals(self, params):
+        """ Trait values predicted by the model at the curve's temperatures """
+        log_values, = self.kernels.model(*self._values(params))
+        return np.exp(np.broadcast_to(log_values, self.workspace.temps.shape))
+
+    def fit_registered(self):
+        """ Fit the model to the log trait values
+
+        Returns
+        -------
+        fit_model: lmfit.MinimizerResult
+            Model result object, or None if the fit raised
+        """
+        # Log trait values
+        self.traits = np.log(self.traits)
+
+        # Minimize model
+        try:
+            return self.minimize_timed(self.fcn2min, Dfun=self.dfun)
+        except Exception:
+            return None
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, getattr(self, "final_estimates", self.fit_pars.valuesdict()))
+
+# Models declared in this process: model_name -> RegisteredModel subclass
+registered_models = {}
+
+def register_model(name, expression, bounds, start):
+    """ Declare a model and make it available to resample_model and fit_tpc by name
+
+    Parameters
+    ----------
+    name: str
+        model_name of the model
+    expression: str
+        Model expression in T (Kelvin), the parameters and the constants k and Tref
+    bounds: dict
+        Parameter -> (min, max) bounds of the fit, in the order of the parameters
+    start: dict
+        Parameter -> [low, upp] range for drawing starting values (used where the caller's sampling bounds don't have the parameter)
+
+    Returns
+    -------
+    model_class: class
+        RegisteredModel subclass fitting the model
+    """
+    if name in general_funcs.resample_funcs and name not in registered_models:
+        raise RegistryException("'{}' is a built-in model and can't be redeclared".format(name))
+    param_names = tuple(bounds)
+    if set(start) != set(param_names):
+        raise RegistryException("Starting ranges {} don't match the parameters {}".format(sorted(start), list(param_names)))
+    if set(param_names) & set(expression_constants + expression_functions):
+        raise RegistryException("Parameters can't be named {}".format(sorted(set(param_names) & set(expression_constants + expression_functions))))
+    kernels = compile_kernels(expression, param_names)
+    unused = set(param_names) - variables(parse_expression(expression))
+    if unused:
+        raise RegistryException("Parameters {} are not used by '{}'".format(sorted(unused), expression))
+
+    class_name = "".join(part.capitalize() for part in name.replace("-", "_").split("_")) + "Model"
+    model_class = type(class_name, (RegisteredModel,), {"model_name": name, "param_names": param_names, "expression": expression,
+                                                        "bounds": dict(bounds), "start": dict(start), "kernels": kernels})
+    registered_models[name] = model_class
+    general_funcs.resample_funcs[name] = (functools.partial(general_funcs.resample_class, model_class), model_class.init_params)
+    general_funcs.start_bounds[name] = dict(start)
+    return model_class
+
+# Boltzmann-Arrhenius: exponential rise without deactivation
+register_model("arrhenius", "B0 * exp(-E / k * (1 / T - 1 / Tref))",
+               bounds={"B0": (0, np.inf), "E": (10E-3, np.inf)},
+               start={"B0": [0.05, 1.2], "E": [0.05, 0.85]})
+
+# Briere (1999), with T in degrees C in the leading term and 0 outside (T0, Tm)
+register_model("briere", "a * (T - 273.15) * pos(T - T0) * sqrt(pos(Tm - T))",
+               bounds={"a": (0, np.inf), "T0": (223.15, 323.15), "Tm": (273.15, 373.15)},
+               start={"a": [1e-5, 1e-3], "T0": [263.15, 288.15], "Tm": [303.15, 323.15]})
+
+# Ratkowsky et al. (1983), 0 outside (Tmin, Tmax)
+register_model("ratkowsky", "(b * pos(T - Tmin) * pos(1 - exp(c * (T - Tmax)))) ** 2",
+               bounds={"b": (0, np.inf), "c": (0, np.inf), "Tmin": (223.15, 323.15), "Tmax": (273.15, 373.15)},
+               start={"b": [0.001, 0.1], "c": [0.05, 0.5], "Tmin": [263.15, 288.15], "Tmax": [303.15, 323.15]})
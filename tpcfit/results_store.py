@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" results_store.py contains a local SQLite store for fitted thermal performance curves.
+
+Fits are written by the fitting pipeline in bulk transactions and indexed on the columns we usually filter by (originalid, trait name, kingdom, model name and climate group), so typical lookups use an index rather than re-reading a whole results csv."""
+
+import re
+import sqlite3
+import numpy as np
+import pandas as pd
+
+class ResultsStoreException(Exception):
+    """ General purpose exception generator for ResultsStore"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+class ResultsStore(object):
+    """ SQLite-backed table of fitted curves """
+
+    # Name of the results table
+    table = "fits"
+
+    # Columns analysts filter by - each gets its own index
+    index_cols = ("originalid", "standardisedtraitname", "interactor1kingdom", "model_name", "climate")
+
+    # Descriptive columns always present in the table
+    text_cols = index_cols + ("interactor1",)
+
+    # Set some useful error messages
+    _err_colname = ("Column names may only contain letters, digits and underscores: '{}'")
+
+    _err_nocol = ("Unknown column '{}'. Available columns: {}")
+
+    def __init__(self, path=":memory:", batch_size=50000):
+        """
+        Parameters
+        ----------
+        path: str
+            Path to the SQLite database file (created if missing)
+        batch_size: int
+            Number of rows sent to SQLite per executemany call
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        # Readers don't block the writer and commits don't fsync every page
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_table()
+        self.columns = self._get_columns()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM {}".format(self.table)).fetchone()[0]
+
+    def close(self):
+        """ Close the database connection """
+        self.conn.close()
+
+    def _check_name(self, name):
+        """ Column names are interpolated into SQL, so only allow plain identifiers """
+        if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", str(name)):
+            raise ResultsStoreException(self._err_colname.format(name))
+        return name
+
+    def _create_table(self):
+        """ Create the results table and its indices if they don't exist yet """
+        cols = ", ".join("{} TEXT".format(c) for c in self.text_cols)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS {} (rowid INTEGER PRIMARY KEY, {})".format(self.table, cols))
+            for col in self.index_cols:
+                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_{0}_{1} ON {0} ({1})".format(self.table, col))
+            # The activation energy summaries group by trait and climate together
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_{0}_trait_climate ON {0} (standardisedtraitname, climate)".format(self.table))
+
+    def _get_columns(self):
+        """ Get a dictionary of column names and SQLite types """
+        info = self.conn.execute("PRAGMA table_info({})".format(self.table)).fetchall()
+        return {row[1]: row[2] for row in info if row[1] != "rowid"}
+
+    def _add_columns(self, data):
+        """ Add any columns in data that the table doesn't have yet (e.g. new model parameters) """
+        for col in data.columns:
+            if col in self.columns:
+                continue
+            self._check_name(col)
+            if pd.api.types.is_numeric_dtype(data[col]) and not pd.api.types.is_bool_dtype(data[col]):
+                col_type = "REAL"
+            else:
+                col_type = "TEXT"
+            self.conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(self.table, col, col_type))
+            self.columns[col] = col_type
+
+    def insert(self, records):
+        """ Bulk insert fitted curves in a single transaction
+
+        Parameters
+        ----------
+        records: pandas DataFrame or list of dicts
+            One row per fitted curve. Unknown columns are added to the table.
+
+        Returns
+        -------
+        n_rows: int
+            Number of rows inserted
+        """
+        data = pd.DataFrame(records)
+        if len(data) == 0:
+            return 0
+
+        cols = list(data.columns)
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(self.table, ", ".join(cols), ", ".join("?" * len(cols)))
+
+        with self.conn:
+            self._add_columns(data)
+            # Swap numpy scalars and NaN for plain python values SQLite understands
+            data = data.astype(object).where(data.notna(), None)
+            rows = data.itertuples(index=False, name=None)
+            while True:
+                batch = [row for _, row in zip(range(self.batch_size), rows)]
+                if not batch:
+                    break
+                self.conn.executemany(sql, batch)
+
+        return len(data)
+
+    def import_csv(self, path, chunksize=100000):
+        """ Stream an existing results csv (e.g. final_data.csv) into the store
+
+        Parameters
+        ----------
+        path: str
+            Path to csv file
+        chunksize: int
+            Number of rows read and inserted at a time
+
+        Returns
+        -------
+        n_rows: int
+            Number of rows imported
+        """
+        n_rows = 0
+        for chunk in pd.read_csv(path, chunksize=chunksize, low_memory=False):
+            # Drop the unnamed row index written by R's write.csv
+            chunk = chunk.loc[:, [not str(c).startswith("Unnamed") for c in chunk.columns]]
+            n_rows += self.insert(chunk)
+        return n_rows
+
+    def _where(self, filters):
+        """ Build a parameterised WHERE clause from keyword filters """
+        clauses = []
+        values = []
+        for col, val in filters.items():
+            if col not in self.columns:
+                raise ResultsStoreException(self._err_nocol.format(col, list(self.columns)))
+            if isinstance(val, (list, tuple, set, np.ndarray, pd.Series)):
+                val = list(val)
+                clauses.append("{} IN ({})".format(col, ", ".join("?" * len(val))))
+                values.extend(val)
+            else:
+                clauses.append("{} = ?".format(col))
+                values.append(val)
+        if not clauses:
+            return "", values
+        return " WHERE " + " AND ".join(clauses), values
+
+    def query(self, columns=None, as_frame=True, limit=None, order_by=None, **filters):
+        """ Query fitted curves
+
+        Parameters
+        ----------
+        columns: list, optional
+            Columns to return (default: all)
+        as_frame: bool
+            Return a pandas DataFrame if True, otherwise a dictionary of numpy arrays
+        limit: int, optional
+            Maximum number of rows to return
+        order_by: str, optional
+            Column to sort the rows by, or "rowid" for the order they were inserted in (default: whatever order SQLite returns)
+        filters: keyword arguments
+            Column equality filters, e.g. model_name="sharpeschoolhigh". Lists are matched with IN.
+
+        Returns
+        -------
+        results: pandas DataFrame or dict of numpy arrays
+        """
+        if columns is None:
+            columns = list(self.columns)
+        for col in columns:
+            if col not in self.columns:
+                raise ResultsStoreException(self._err_nocol.format(col, list(self.columns)))
+
+        where, values = self._where(filters)
+        sql = "SELECT {} FROM {}{}".format(", ".join(columns), self.table, where)
+        if order_by is not None:
+            if order_by != "rowid" and order_by not in self.columns:
+                raise ResultsStoreException(self._err_nocol.format(order_by, list(self.columns)))
+            sql += " ORDER BY {}".format(order_by)
+        if limit is not None:
+            sql += " LIMIT {:d}".format(limit)
+
+        rows = self.conn.execute(sql, values).fetchall()
+
+        if as_frame:
+            return pd.DataFrame.from_records(rows, columns=columns)
+
+        # Transpose rows into typed column arrays (NULL -> nan for numeric columns)
+        cols = list(zip(*rows)) if rows else [()] * len(columns)
+        arrays = {}
+        for col, vals in zip(columns, cols):
+            if self.columns[col] == "REAL":
+                arrays[col] = np.array([np.nan if v is None else v for v in vals], dtype=float)
+            else:
+                arrays[col] = np.array(vals, dtype=object)
+        return arrays
+
+    def query_plan(self, **filters):
+        """ Show how SQLite will answer a query - useful to check an index is being used
+
+        Returns
+        -------
+        plan: list
+            Lines of SQLite's EXPLAIN QUERY PLAN output
+        """
+        where, values = self._where(filters)
+        sql = "EXPLAIN QUERY PLAN SELECT * FROM {}{}".format(self.table, where)
+        return [row[-1] for row in self.conn.execute(sql, values).fetchall()]
+
+    def __repr__(self):
+        return "ResultsStore('{}')".format(self.path)
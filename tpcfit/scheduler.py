@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" scheduler.py contains a cost-aware scheduler for fitting many curves in parallel.
+
+Each curve's cost is estimated from its number of points, the model chosen for it and (when available) its fit time or its function evaluations over all restarts (nfev_total) from previous runs. Curves are dispatched most expensive first from a single shared queue, so idle workers always pull the next piece of work and the cheap curves fill in the tail of the run. Cheap curves are grouped into batches of roughly equal cost to keep the per-task overhead down."""
+
+import os
+import time
+import functools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from tpcfit.models import SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow
+from tpcfit.screening import screen_curve
+from tpcfit.shared_curves import SharedCurves
+
+# Shared curve block attached once per worker process
+_worker_curves = None
+
+# Number of parameters for each model name
+model_params = {model.model_name: len(model.param_names) for model in (SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow)}
+
+def estimate_costs(datasets, iter=5, history=None, temps_col="interactor1K", traits_col="standardisedtraitvalue"):
+    """ Estimate the relative cost of fitting each curve
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    iter: int
+        Number of restarts per curve
+    history: pandas DataFrame, optional
+        Previous runs with an originalid column and fit_time (seconds) and/or nfev_total (function evaluations over all restarts) columns
+
+    Returns
+    -------
+    costs: pandas Series
+        Estimated cost of each curve in seconds (or relative units without a fit_time history), indexed by originalid
+    """
+    ids = list(datasets.keys())
+    n_points = np.array([len(datasets[i]) for i in ids], dtype=np.float64)
+
+    # Screening is cheap, and curves that will be skipped cost next to nothing
+    n_params = np.zeros(len(ids))
+    for j, i in enumerate(ids):
+        model_name, _ = screen_curve(datasets[i][temps_col].values, datasets[i][traits_col].values)
+        n_params[j] = model_params.get(model_name, 0)
+
+    # Each residual costs O(points) and finite differences need one per parameter
+    costs = pd.Series(n_points * (n_params + 1) * iter + 1, index=ids)
+
+    if history is None or len(history) == 0:
+        return costs
+
+    # Latest run of each curve
+    history = history.drop_duplicates("originalid", keep="last").set_index("originalid")
+    history = history.reindex(ids)
+
+    # nfev_total already counts every restart, and each evaluation costs O(points)
+    for col, scale in (("nfev_total", n_points), ("fit_time", None)):
+        if col not in history.columns:
+            continue
+        known = history[col].notna().to_numpy() & (n_params > 0)
+        if not known.any():
+            continue
+        observed = history[col].to_numpy(dtype=np.float64)
+        if scale is not None:
+            observed = observed * scale
+        # Put unseen curves on the same scale as the history
+        ratio = np.median(observed[known] / costs.values[known])
+        costs = costs * ratio
+        costs[known] = observed[known]
+
+    return costs
+
+def make_batches(ids, costs, workers, tasks_per_worker=8):
+    """ Group curves into batches, most expensive first
+
+    Curves costing more than a target share of the total are dispatched alone; cheaper curves are grouped until their batch reaches the target.
+
+    Parameters
+    ----------
+    ids: list
+        Curve ids
+    costs: pandas Series
+        Estimated costs indexed by curve id
+    workers: int
+        Number of worker processes
+    tasks_per_worker: int
+        Roughly how many batches each worker should get
+
+    Returns
+    -------
+    batches: list of lists
+        Batches of curve ids in dispatch order
+    """
+    order = costs.loc[ids].sort_values(ascending=False, kind="mergesort")
+    target = order.sum() / max(workers * tasks_per_worker, 1)
+
+    batches = []
+    batch, batch_cost = [], 0.0
+    for curve_id, cost in order.items():
+        batch.append(curve_id)
+        batch_cost += cost
+        if batch_cost >= target:
+            batches.append(batch)
+            batch, batch_cost = [], 0.0
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _run_batch(fit_func, batch):
+    """ Fit a batch of curves in a worker, timing each one """
+    results = []
+    for curve_id, dataset in batch:
+        start = time.perf_counter()
+        result = fit_func(curve_id, dataset)
+        results.append((curve_id, result, os.getpid(), start, time.perf_counter()))
+    return results
+
+def _attach_curves(n_points, name, path):
+    """ Pool initializer: attach the worker to the shared curve block """
+    global _worker_curves
+    _worker_curves = SharedCurves.attach(n_points, name=name, path=path)
+
+def _run_shared_batch(fit_func, batch):
+    """ Fit a batch of curves from the shared block, timing each one """
+    results = []
+    for curve_id, offset, length in batch:
+        temps, traits = _worker_curves.views(offset, length)
+        start = time.perf_counter()
+        result = fit_func(curve_id, temps, traits)
+        results.append((curve_id, result, os.getpid(), start, time.perf_counter()))
+    return results
+
+class CurveScheduler(object):
+    """ Fit many curves over a process pool, longest curves first """
+
+    def __init__(self, fit_func, workers=None, history=None, iter=5, tasks_per_worker=8, shared=False, shared_path=None, **kwargs):
+        """
+        Parameters
+        ----------
+        fit_func: callable
+            Function fit_func(curve_id, dataset, **kwargs) returning a result for one curve, or fit_func(curve_id, temps, traits, **kwargs) in shared mode. Must be picklable (defined at module level).
+        workers: int
+            Number of worker processes (default: number of CPUs)
+        history: pandas DataFrame, optional
+            Previous runs used to estimate costs (see estimate_costs)
+        iter: int
+            Number of restarts per curve (passed to fit_func)
+        tasks_per_worker: int
+            Roughly how many batches each worker should get
+        shared: bool
+            Place all curves in one shared memory block and send workers (originalid, offset, length) instead of DataFrames
+        shared_path: str, optional
+            In shared mode, use a memory-mapped file at this path instead of shared memory
+        kwargs: keyword arguments
+            Passed to fit_func
+        """
+        self.fit_func = functools.partial(fit_func, iter=iter, **kwargs)
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.history = history
+        self.iter = iter
+        self.tasks_per_worker = tasks_per_worker
+        self.shared = shared
+        self.shared_path = shared_path
+        self.utilization = None
+
+    def run(self, datasets):
+        """ Fit every curve
+
+        Parameters
+        ----------
+        datasets: dict
+            Dictionary of curves with originalid as keys (from get_datasets)
+
+        Returns
+        -------
+        results: list
+            fit_func result for every curve, in the order of datasets
+        """
+        ids = list(datasets.keys())
+        self.costs = estimate_costs(datasets, iter=self.iter, history=self.history)
+        batches = make_batches(ids, self.costs, self.workers, self.tasks_per_worker)
+
+        curves = None
+        if self.shared:
+            curves = SharedCurves.from_datasets(datasets, path=self.shared_path)
+            tasks = [[(curve_id,) + curves.index[curve_id] for curve_id in batch] for batch in batches]
+            worker = functools.partial(_run_shared_batch, self.fit_func)
+            pool_kws = {"initializer": _attach_curves, "initargs": curves.spec()}
+        else:
+            tasks = [[(curve_id, datasets[curve_id]) for curve_id in batch] for batch in batches]
+            worker = functools.partial(_run_batch, self.fit_func)
+            pool_kws = {}
+
+        results = {}
+        timings = []
+        start = time.perf_counter()
+        try:
+            with multiprocessing.Pool(self.workers, **pool_kws) as pool:
+                # chunksize=1: every idle worker pulls the next batch from the shared queue
+                for batch in pool.imap_unordered(worker, tasks, chunksize=1):
+                    for curve_id, result, pid, t0, t1 in batch:
+                        results[curve_id] = result
+                        timings.append((pid, t0, t1))
+        finally:
+            if curves is not None:
+                curves.close()
+                curves.unlink()
+        wall = time.perf_counter() - start
+
+        self.utilization = self.worker_utilization(timings, wall)
+        return [results[curve_id] for curve_id in ids]
+
+    def worker_utilization(self, timings, wall):
+        """ Summarise how busy each worker was
+
+        Parameters
+        ----------
+        timings: list
+            (pid, start, end) of every fitted curve
+        wall: float
+            Wall-clock time of the whole run in seconds
+
+        Returns
+        -------
+        utilization: pandas DataFrame
+            Curves fitted, busy seconds and fraction of wall time busy for each worker
+        """
+        timings = pd.DataFrame(timings, columns=["pid", "start", "end"])
+        timings["busy"] = timings["end"] - timings["start"]
+        utilization = timings.groupby("pid").agg(curves=("busy", "size"), busy=("busy", "sum"))
+        utilization["utilization"] = utilization["busy"] / wall if wall > 0 else np.nan
+        return utilization
+
+    def __repr__(self):
+        return "CurveScheduler({}, workers={})".format(self.fit_func, self.workers)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" screening.py contains a pre-fit screening stage for thermal performance curves.
+
+Curves that can't support any model (too few unique temperatures, non-positive or flat traits, no rising limb) are skipped before they reach the optimizer. For the rest, the most complete feasible model (full, then high, then low) is chosen. Every curve gets a reason code which is recorded with its results."""
+
+import numpy as np
+from tpcfit.models import SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow
+from tpcfit.lazy_imports import lazy_import
+
+# Imported on first use
+pd = lazy_import("pandas")
+
+# Reason codes
+# Full model chosen
+SCREEN_OK = "ok"
+# Too few unique temperatures for the full model - high model chosen
+SCREEN_FEW_TEMPS_FULL = "few_temps_full"
+# Peak at the highest temperature (no high temperature deactivation) - low model chosen
+SCREEN_NO_HIGH_PEAK = "no_high_peak"
+# Skipped: fewer unique temperatures than any model needs
+SCREEN_TOO_FEW_TEMPS = "too_few_temps"
+# Skipped: zero, negative or missing traits (log is not finite)
+SCREEN_NONPOSITIVE = "nonpositive_traits"
+# Skipped: log traits are all the same (e.g. all zero)
+SCREEN_FLAT = "flat_traits"
+# Skipped: peak at the lowest temperature, so there's no rising limb to estimate E from
+SCREEN_NO_RISE = "no_rise"
+# Passed screening, but every restart of the chosen model failed
+SCREEN_FIT_FAILED = "fit_failed"
+
+def min_temps(model):
+    """ Minimum number of unique temperatures needed to fit a model
+
+    One more than the number of parameters, so the fit has at least one degree of freedom (otherwise the AIC is meaningless).
+
+    Parameters
+    ----------
+    model: ThermalModels subclass
+
+    Returns
+    -------
+    min_temps: int
+    """
+    return len(model.param_names) + 1
+
+def screen_curve(temps, traits, unique_temps=None):
+    """ Screen a single curve and choose a feasible model
+
+    Parameters
+    ----------
+    temps: numpy array
+        Temperature array in Kelvin
+    traits: numpy array
+        Trait array
+    unique_temps: int, optional
+        Number of unique temperatures (e.g. the unique_temps column from data cleaning). Counted if not given.
+
+    Returns
+    -------
+    model_name: str or None
+        Name of the model to fit, or None if the curve should be skipped
+    reason: str
+        Reason code
+    """
+    temps = np.asarray(temps, dtype=np.float64)
+    traits = np.asarray(traits, dtype=np.float64)
+
+    # Mean log trait at each unique temperature
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_traits = np.log(traits)
+    if len(log_traits) == 0 or not np.all(np.isfinite(log_traits)):
+        return None, SCREEN_NONPOSITIVE
+
+    uniq, inverse = np.unique(temps, return_inverse=True)
+    if unique_temps is None:
+        unique_temps = len(uniq)
+
+    if unique_temps < min(min_temps(SharpeSchoolfieldHigh), min_temps(SharpeSchoolfieldLow)):
+        return None, SCREEN_TOO_FEW_TEMPS
+
+    if np.ptp(log_traits) == 0:
+        return None, SCREEN_FLAT
+
+    profile = np.bincount(inverse, weights=log_traits) / np.bincount(inverse)
+    peak = np.argmax(profile)
+
+    if peak == 0:
+        return None, SCREEN_NO_RISE
+
+    # Still rising at the highest temperature - only the low model makes sense
+    if peak == len(profile) - 1:
+        if unique_temps >= min_temps(SharpeSchoolfieldLow):
+            return SharpeSchoolfieldLow.model_name, SCREEN_NO_HIGH_PEAK
+        return None, SCREEN_TOO_FEW_TEMPS
+
+    if unique_temps >= min_temps(SharpeSchoolfieldFull):
+        return SharpeSchoolfieldFull.model_name, SCREEN_OK
+
+    return SharpeSchoolfieldHigh.model_name, SCREEN_FEW_TEMPS_FULL
+
+def screen_datasets(datasets, temps_col="interactor1K", traits_col="standardisedtraitvalue"):
+    """ Screen every curve in a dictionary of datasets
+
+    Parameters
+    ----------
+    datasets: dict
+        Dictionary of curves with originalid as keys (from get_datasets)
+    temps_col: str
+        Column of temperatures in Kelvin
+    traits_col: str
+        Column of trait values
+
+    Returns
+    -------
+    screened: pandas DataFrame
+        originalid, chosen model_name and screen reason code for every curve
+    """
+    rows = []
+    for curve_id, dataset in datasets.items():
+        unique_temps = dataset["unique_temps"].iloc[0] if "unique_temps" in dataset.columns else None
+        model_name, reason = screen_curve(dataset[temps_col].values, dataset[traits_col].values, unique_temps)
+        rows.append({"originalid": curve_id, "model_name": model_name, "screen": reason})
+    return pd.DataFrame(rows, columns=["originalid", "model_name", "screen"])
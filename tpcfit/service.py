@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" service.py contains a long-running local fitting service built on ZeroMQ request/reply.
+
+The server keeps a pool of warm worker processes (tpcfit, lmfit and scipy are imported once) and answers fit requests from FitClient. Curves from small requests are batched together before they are sent to the pool, and once too many curves are in flight new requests are answered with "busy" so clients back off rather than queueing without limit. Requests with more curves than can ever be in flight at once are refused with an error, so clients split them instead of backing off forever.
+
+Example :
+    $ python -m tpcfit.service --address tcp://127.0.0.1:5555 --workers 4
+
+    >>> client = FitClient("tcp://127.0.0.1:5555")
+    >>> client.fit([{"id": "MTD4538", "temps": temps, "traits": traits}], model="sharpeschoolhigh")
+"""
+
+import json
+import time
+import queue
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+import zmq
+from tpcfit.general_funcs import fit_tpc
+from tpcfit.sharding import curve_seed
+
+# Sampling bounds used when a request doesn't supply any
+default_bounds = {"B0": [0.05, 1.2], "E": [0.05, 0.85],
+                  "Eh": [0.5, 1.2], "El": [0.05, 0.7],
+                  "Th": [273.15, 330], "Tl": [273.15, 330]}
+
+class ServiceException(Exception):
+    """ General purpose exception generator for the fitting service"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def _to_json(value):
+    """ Make numpy scalars and NaN json friendly """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+def _check_fit(message, curves):
+    """ Check the fields of a fit request
+
+    Returns
+    -------
+    error: str or None
+        What is wrong with the request, None if nothing is
+    """
+    if not isinstance(curves, list):
+        return "curves must be a list"
+    for i, curve in enumerate(curves):
+        if not isinstance(curve, dict) or not isinstance(curve.get("temps"), list) or not isinstance(curve.get("traits"), list):
+            return "Curve {} must be an object with temps and traits lists".format(i)
+    iter = message.get("iter", 5)
+    if isinstance(iter, bool) or not isinstance(iter, int) or iter < 1:
+        return "iter must be a positive integer"
+    timeout = message.get("timeout")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))):
+        return "timeout must be a number"
+    if message.get("model") is not None and not isinstance(message["model"], str):
+        return "model must be a string"
+    bounds = message.get("bounds")
+    if bounds is not None and not (isinstance(bounds, dict) and all(isinstance(v, list) and len(v) == 2 for v in bounds.values())):
+        return "bounds must map parameter names to [low, high] pairs"
+    return None
+
+def _warm_worker():
+    """ Pool initializer: import the fitting dependencies before the first request arrives """
+    import lmfit
+    import scipy.stats
+
+def fit_batch(items):
+    """ Fit a batch of curves in a worker process
+
+    Parameters
+    ----------
+    items: list
+        (request key, curve index, curve dict, model name, bounds, iter, timeout) for each curve
+
+    Returns
+    -------
+    results: list
+        (request key, curve index, result dict) for each curve
+    """
+    results = []
+    for key, index, curve, model_name, bounds, iter, timeout in items:
+        curve_id = index
+        try:
+            curve_id = curve.get("id", index)
+            temps = np.asarray(curve["temps"], dtype=np.float64)
+            traits = np.asarray(curve["traits"], dtype=np.float64)
+            result = fit_tpc(temps, traits, bounds, model_name=model_name, iter=iter, timeout=timeout, seed=curve_seed(curve_id))
+        except Exception as e:
+            result = {"error": "{}: {}".format(type(e).__name__, e)}
+        result["id"] = curve_id
+        results.append((key, index, {k: _to_json(v) for k, v in result.items()}))
+    return results
+
+class FitServer(object):
+    """ Local fitting server with a pool of warm workers """
+
+    def __init__(self, address="tcp://127.0.0.1:5555", workers=None, batch_size=16, batch_wait=0.005, max_pending=1024):
+        """
+        Parameters
+        ----------
+        address: str
+            ZeroMQ address to bind to
+        workers: int
+            Number of worker processes (default: number of CPUs)
+        batch_size: int
+            Maximum number of curves sent to a worker at once
+        batch_wait: float
+            Seconds to wait for more curves before sending a partial batch
+        max_pending: int
+            Number of curves in flight above which new requests are answered with "busy" (larger requests are refused with an error)
+        """
+        self.address = address
+        self.workers = workers if workers is not None else multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_pending = max_pending
+        self.stats = {"requests": 0, "curves": 0, "batches": 0, "busy": 0, "pending": 0}
+
+    def serve(self):
+        """ Serve requests until a "stop" command is received """
+        context = zmq.Context.instance()
+        socket = context.socket(zmq.ROUTER)
+        socket.bind(self.address)
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+
+        # Finished batches come back from the pool's result thread through this queue
+        done = queue.Queue()
+        # Request key -> client identity, results and number of curves still to fit
+        requests = {}
+        keys = itertools.count()
+        batch, batch_start = [], None
+        running = True
+
+        pool = multiprocessing.Pool(self.workers, initializer=_warm_worker)
+        try:
+            while running or requests:
+                events = dict(poller.poll(max(1, int(self.batch_wait * 1000))))
+                if running and socket in events:
+                    while True:
+                        try:
+                            identity, _, payload = socket.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        try:
+                            reply, new_items = self._handle(payload, requests, keys, identity)
+                        except Exception as e:
+                            # A request _handle didn't anticipate only fails that client, never the server
+                            reply, new_items = {"status": "error", "error": "{}: {}".format(type(e).__name__, e)}, []
+                        if reply is not None:
+                            socket.send_multipart([identity, b"", json.dumps(reply).encode()])
+                        if reply is not None and reply.get("status") == "stopping":
+                            running = False
+                        if new_items:
+                            if not batch:
+                                batch_start = time.perf_counter()
+                            batch.extend(new_items)
+
+                # Send full or stale batches to the pool
+                while batch and (len(batch) >= self.batch_size or time.perf_counter() - batch_start >= self.batch_wait or not running):
+                    items, batch = batch[:self.batch_size], batch[self.batch_size:]
+                    batch_start = time.perf_counter()
+                    self.stats["batches"] += 1
+                    pool.apply_async(fit_batch, (items,), callback=done.put,
+                                     error_callback=lambda e, items=items: done.put([(key, index, {"error": repr(e)}) for key, index, *_ in items]))
+
+                # Reply to requests whose curves have all been fitted
+                while True:
+                    try:
+                        finished = done.get_nowait()
+                    except queue.Empty:
+                        break
+                    for key, index, result in finished:
+                        request = requests[key]
+                        request["results"][index] = result
+                        request["remaining"] -= 1
+                        self.stats["pending"] -= 1
+                        if request["remaining"] == 0:
+                            del requests[key]
+                            reply = {"status": "ok", "results": request["results"]}
+                            socket.send_multipart([request["identity"], b"", json.dumps(reply).encode()])
+        finally:
+            pool.terminate()
+            socket.close(linger=0)
+
+    def _handle(self, payload, requests, keys, identity):
+        """ Handle a single request
+
+        Returns
+        -------
+        reply: dict or None
+            Immediate reply (None if the reply will follow once the curves are fitted)
+        items: list
+            Curves to add to the batch
+        """
+        try:
+            message = json.loads(payload.decode())
+        except ValueError:
+            return {"status": "error", "error": "Request is not valid json"}, []
+        if not isinstance(message, dict):
+            return {"status": "error", "error": "Request must be a json object"}, []
+
+        command = message.get("command", "fit")
+        if command == "ping":
+            return dict(self.stats, status="ok", workers=self.workers, max_pending=self.max_pending), []
+        if command == "stop":
+            return {"status": "stopping"}, []
+        if command != "fit":
+            return {"status": "error", "error": "Unknown command '{}'".format(command)}, []
+
+        curves = message.get("curves", [])
+        error = _check_fit(message, curves)
+        if error is not None:
+            return {"status": "error", "error": error}, []
+        if not curves:
+            return {"status": "ok", "results": []}, []
+
+        # A request that would be busy even with nothing in flight can never be served
+        if len(curves) > self.max_pending:
+            return {"status": "error", "error": "Request has {} curves, more than the server accepts at once ({}). Split it into smaller requests.".format(len(curves), self.max_pending)}, []
+
+        # Backpressure: refuse work rather than queue without limit
+        if self.stats["pending"] + len(curves) > self.max_pending:
+            self.stats["busy"] += 1
+            return {"status": "busy", "pending": self.stats["pending"]}, []
+
+        model_name = message.get("model")
+        if model_name == "auto":
+            model_name = None
+        bounds = message.get("bounds") or default_bounds
+        iter = message.get("iter", 5)
+        timeout = message.get("timeout")
+
+        key = next(keys)
+        requests[key] = {"identity": identity, "results": [None] * len(curves), "remaining": len(curves)}
+        self.stats["requests"] += 1
+        self.stats["curves"] += len(curves)
+        self.stats["pending"] += len(curves)
+        return None, [(key, i, curve, model_name, bounds, iter, timeout) for i, curve in enumerate(curves)]
+
+class FitClient(object):
+    """ Client for FitServer """
+
+    def __init__(self, address="tcp://127.0.0.1:5555", timeout=60.0, busy_wait=0.05):
+        """
+        Parameters
+        ----------
+        address: str
+            ZeroMQ address of the server
+        timeout: float
+            Seconds to wait for a reply before giving up
+        busy_wait: float
+            Initial seconds to back off when the server is busy (doubled on every retry)
+        """
+        self.address = address
+        self.timeout = timeout
+        self.busy_wait = busy_wait
+        self.context = zmq.Context.instance()
+        self.socket = None
+        self._connect()
+
+    def _connect(self):
+        if self.socket is not None:
+            self.socket.close(linger=0)
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.connect(self.address)
+
+    def request(self, message):
+        """ Send a request and wait for the reply, backing off while the server is busy
+
+        Parameters
+        ----------
+        message: dict
+            Request message
+
+        Returns
+        -------
+        reply: dict
+        """
+        deadline = time.perf_counter() + self.timeout
+        wait = self.busy_wait
+        while True:
+            self.socket.send(json.dumps(message).encode())
+            remaining = deadline - time.perf_counter()
+            if self.socket.poll(max(1, int(remaining * 1000))) == 0:
+                # A REQ socket can't send again without a reply, so start afresh
+                self._connect()
+                raise ServiceException("No reply from {} within {} seconds".format(self.address, self.timeout))
+            reply = json.loads(self.socket.recv().decode())
+            if reply.get("status") != "busy":
+                break
+            if time.perf_counter() + wait > deadline:
+                raise ServiceException("Server at {} stayed busy for {} seconds".format(self.address, self.timeout))
+            time.sleep(wait)
+            wait *= 2
+
+        if reply.get("status") == "error":
+            raise ServiceException(reply.get("error"))
+        return reply
+
+    def fit(self, curves, model="auto", bounds=None, iter=5, timeout=None):
+        """ Fit one or more curves
+
+        Parameters
+        ----------
+        curves: list of dicts
+            Each with "temps" and "traits" (lists or numpy arrays) and optionally an "id"
+        model: str
+            Model name, or "auto" to choose a feasible model by screening
+        bounds: dict, optional
+            dictionary of sampling bounds (default: default_bounds)
+        iter: int
+            Number of random restarts
+        timeout: float, optional
+            Wall-clock budget in seconds for each fit
+
+        Returns
+        -------
+        results: list of dicts
+            Model name, AIC and parameter estimates for each curve
+        """
+        curves = [dict(curve, temps=np.asarray(curve["temps"], dtype=float).tolist(), traits=np.asarray(curve["traits"], dtype=float).tolist()) for curve in curves]
+        message = {"command": "fit", "curves": curves, "model": model, "bounds": bounds, "iter": iter, "timeout": timeout}
+        return self.request(message)["results"]
+
+    def ping(self):
+        """ Get server statistics """
+        return self.request({"command": "ping"})
+
+    def stop(self):
+        """ Ask the server to finish outstanding requests and stop """
+        return self.request({"command": "stop"})
+
+    def close(self):
+        self.socket.close(linger=0)
+
+if __name__ == "__main__":
+    """ This is executed when run from the command line"""
+
+    # Assign command line interface
+    parser = argparse.ArgumentParser(description="Local thermal performance curve fitting server")
+
+    parser.add_argument("-a", "--address",
+                        type=str,
+                        help="ZeroMQ address to bind to",
+                        required=False,
+                        default="tcp://127.0.0.1:5555")
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        help="Number of worker processes",
+                        required=False,
+                        default=None)
+    parser.add_argument("--max-pending",
+                        type=int,
+                        help="Curves in flight above which requests are answered with busy (larger requests are refused)",
+                        required=False,
+                        default=1024)
+
+    args = parser.parse_args()
+    FitServer(args.address, workers=args.workers, max_pending=args.max_pending).serve()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" sharding.py splits a batch fit over several independent processes or machines and merges the results.
+
+Curves are assigned to shards by a stable hash of their originalid, so every machine agrees on the split without talking to the others. Each shard writes its results csv plus a small json manifest, and merge_shards checks that every shard is present and complete before building one results table. The merged table is sorted and formatted so that it is byte-identical whatever the number of shards."""
+
+import csv
+import json
+import hashlib
+from tpcfit.lazy_imports import lazy_import
+
+# Imported on first use
+pd = lazy_import("pandas")
+
+# Columns that change from run to run and are left out of the merged table
+nondeterministic_cols = ("fit_time",)
+
+# Leading columns of the merged table (the rest follow in alphabetical order)
+leading_cols = ("originalid", "standardisedtraitname", "interactor1kingdom", "interactor1", "climate", "screen", "model_name", "aic", "timed_out", "nfev", "nfev_total")
+
+class ShardingException(Exception):
+    """ General purpose exception generator for sharding"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def curve_hash(curve_id):
+    """ Stable 64 bit hash of a curve id (unlike hash(), the same in every process)
+
+    Parameters
+    ----------
+    curve_id: str
+        originalid of the curve
+
+    Returns
+    -------
+    hash: int
+    """
+    return int.from_bytes(hashlib.md5(str(curve_id).encode("utf-8")).digest()[:8], "little")
+
+def curve_seed(curve_id, seed=0):
+    """ Random seed for a curve, so its random restarts don't depend on which shard or worker fits it
+
+    Parameters
+    ----------
+    curve_id: str
+        originalid of the curve
+    seed: int
+        Base seed for the whole run
+
+    Returns
+    -------
+    seed: int
+        Seed in the range accepted by np.random.seed
+    """
+    return (curve_hash(curve_id) + seed) % (2 ** 32)
+
+def shard_of(curve_id, n_shards):
+    """ Shard a curve belongs to
+
+    Parameters
+    ----------
+    curve_id: str
+        originalid of the curve
+    n_shards: int
+        Total number of shards
+
+    Returns
+    -------
+    shard: int
+        Shard index in [0, n_shards)
+    """
+    return curve_hash(curve_id) % n_shards
+
+def parse_shard(spec):
+    """ Parse a shard given on the command line as "i/N"
+
+    Parameters
+    ----------
+    spec: str
+        e.g. "0/4"
+
+    Returns
+    -------
+    shard: int
+    n_shards: int
+    """
+    try:
+        shard, n_shards = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ShardingException("Shards must be given as i/N, e.g. 0/4 (got '{}')".format(spec))
+    if n_shards < 1 or not 0 <= shard < n_shards:
+        raise ShardingException("Shard index must be in [0, N) (got '{}')".format(spec))
+    return shard, n_shards
+
+def select_shard(data, shard, n_shards, id_col="originalid"):
+    """ Keep the rows of curves that belong to a shard
+
+    Parameters
+    ----------
+    data: pandas DataFrame
+        Full input data
+    shard: int
+        Shard index
+    n_shards: int
+        Total number of shards
+
+    Returns
+    -------
+    data: pandas DataFrame
+        Rows of this shard's curves
+    """
+    ids = pd.unique(data[id_col])
+    mine = [curve_id for curve_id in ids if shard_of(curve_id, n_shards) == shard]
+    return data.loc[data[id_col].isin(mine)]
+
+def manifest_path(output):
+    """ Path of the manifest written next to a shard's results csv """
+    return output + ".manifest.json"
+
+def write_manifest(output, shard, n_shards, curve_ids):
+    """ Record which curves a shard was responsible for
+
+    Parameters
+    ----------
+    output: str
+        Path of the shard's results csv
+    shard: int
+        Shard index
+    n_shards: int
+        Total number of shards
+    curve_ids: list
+        originalids assigned to the shard
+    """
+    manifest = {"shard": shard, "n_shards": n_shards, "results": output, "curves": sorted(str(i) for i in curve_ids)}
+    with open(manifest_path(output), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+def _format_column(values):
+    """ Format a column of csv strings so numbers always look the same (e.g. 3 and 3.0 are both written 3.0) """
+    present = values != ""
+    numbers = pd.to_numeric(pd.Series(values[present]), errors="coerce")
+    if numbers.isna().any():
+        return values
+    formatted = values.copy()
+    formatted[present] = [repr(float(x)) for x in numbers]
+    return formatted
+
+def merge_shards(paths, output):
+    """ Merge shard results into a single results table
+
+    Parameters
+    ----------
+    paths: list
+        Results csv of every shard (each with its manifest next to it)
+    output: str
+        Path of the merged csv
+
+    Returns
+    -------
+    n_curves: int
+        Number of curves in the merged table
+    """
+    manifests = []
+    for path in paths:
+        try:
+            with open(manifest_path(path)) as f:
+                manifests.append(json.load(f))
+        except IOError:
+            raise ShardingException("No manifest found for {}. Was it written by pipeline.py --shard?".format(path))
+
+    # Every shard exactly once
+    n_shards = set(m["n_shards"] for m in manifests)
+    if len(n_shards) != 1:
+        raise ShardingException("Shards come from runs with different shard counts: {}".format(sorted(n_shards)))
+    n_shards = n_shards.pop()
+    shards = sorted(m["shard"] for m in manifests)
+    if shards != list(range(n_shards)):
+        missing = sorted(set(range(n_shards)) - set(shards))
+        raise ShardingException("Expected shards 0-{} exactly once. Missing: {}, given: {}".format(n_shards - 1, missing, shards))
+
+    frames = []
+    for path, manifest in zip(paths, manifests):
+        # Read everything as text so values pass through unchanged. A shard without curves may be header-only or empty.
+        try:
+            frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+        except pd.errors.EmptyDataError:
+            frame = pd.DataFrame(columns=["originalid"], dtype=str)
+        if "originalid" not in frame.columns:
+            raise ShardingException("{} has no originalid column".format(path))
+        ids = sorted(frame["originalid"])
+        if ids != manifest["curves"]:
+            raise ShardingException("Shard {} is incomplete: {} of {} curves in {}".format(manifest["shard"], len(ids), len(manifest["curves"]), path))
+        wrong = [i for i in ids if shard_of(i, n_shards) != manifest["shard"]]
+        if wrong:
+            raise ShardingException("Shard {} contains curves from other shards, e.g. {}".format(manifest["shard"], wrong[0]))
+        frames.append(frame)
+
+    # Columns come from the shards with curves, so empty shards don't change the merged table
+    nonempty = [frame for frame in frames if len(frame)] or frames
+    merged = pd.concat(nonempty, ignore_index=True, sort=False).fillna("")
+    if merged["originalid"].duplicated().any():
+        raise ShardingException("Curves appear in more than one shard")
+
+    # Fixed row order, column order and number formatting
+    merged = merged.drop(columns=[c for c in nondeterministic_cols if c in merged.columns])
+    merged = merged.sort_values("originalid", kind="mergesort")
+    cols = [c for c in leading_cols if c in merged.columns] + sorted(c for c in merged.columns if c not in leading_cols)
+    merged = merged[cols]
+    for col in cols:
+        if col != "originalid":
+            merged[col] = _format_column(merged[col].to_numpy(dtype=object))
+
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(cols)
+        writer.writerows(merged.itertuples(index=False, name=None))
+
+    return len(merged)
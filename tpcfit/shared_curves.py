@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" shared_curves.py places the temperature and trait values of every curve in one block of shared memory (or a memory-mapped file).
+
+Worker processes attach to the block once, and each task only needs (originalid, offset, length) to build zero-copy numpy views of a curve, instead of a pickled DataFrame per curve."""
+
+import os
+import numpy as np
+from multiprocessing import shared_memory
+
+class SharedCurvesException(Exception):
+    """ General purpose exception generator for SharedCurves"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+class SharedCurves(object):
+    """ Temperatures and traits of many curves in a single (2, n_points) float64 array """
+
+    # Set some useful error messages
+    _err_nocurve = ("Curve '{}' is not in the shared block.")
+
+    def __init__(self, n_points, name=None, path=None, create=False):
+        """
+        Parameters
+        ----------
+        n_points: int
+            Total number of points over all curves
+        name: str, optional
+            Name of an existing shared memory block to attach to
+        path: str, optional
+            Use a memory-mapped file at this path instead of shared memory
+        create: bool
+            Create a new block rather than attaching to an existing one
+        """
+        self.n_points = n_points
+        self.path = path
+        self.shm = None
+        # Curve ids -> (offset, length)
+        self.index = {}
+
+        if path is not None:
+            self.data = np.memmap(path, dtype=np.float64, mode="w+" if create else "r", shape=(2, max(n_points, 1)))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name, create=create, size=max(2 * n_points * 8, 1))
+            self.data = np.ndarray((2, n_points), dtype=np.float64, buffer=self.shm.buf)
+        self.name = self.shm.name if self.shm is not None else None
+
+    @classmethod
+    def from_datasets(cls, datasets, temps_col="interactor1K", traits_col="standardisedtraitvalue", path=None):
+        """ Copy a dictionary of curves into a new shared block
+
+        Parameters
+        ----------
+        datasets: dict
+            Dictionary of curves with originalid as keys (from get_datasets)
+        temps_col: str
+            Column of temperatures in Kelvin
+        traits_col: str
+            Column of trait values
+        path: str, optional
+            Use a memory-mapped file at this path instead of shared memory
+
+        Returns
+        -------
+        curves: SharedCurves
+        """
+        n_points = sum(len(dataset) for dataset in datasets.values())
+        curves = cls(n_points, path=path, create=True)
+
+        offset = 0
+        for curve_id, dataset in datasets.items():
+            length = len(dataset)
+            curves.data[0, offset:offset + length] = dataset[temps_col].values
+            curves.data[1, offset:offset + length] = dataset[traits_col].values
+            curves.index[curve_id] = (offset, length)
+            offset += length
+
+        return curves
+
+    @classmethod
+    def attach(cls, n_points, name=None, path=None):
+        """ Attach to a block created in another process (see spec) """
+        return cls(n_points, name=name, path=path, create=False)
+
+    def spec(self):
+        """ Arguments needed to attach to this block from another process
+
+        Returns
+        -------
+        spec: tuple
+            (n_points, name, path)
+        """
+        return (self.n_points, self.name, self.path)
+
+    def views(self, offset, length):
+        """ Zero-copy, read-only views of a single curve
+
+        Parameters
+        ----------
+        offset: int
+            Index of the curve's first point
+        length: int
+            Number of points in the curve
+
+        Returns
+        -------
+        temps: numpy array
+            Temperature values
+        traits: numpy array
+            Trait values
+        """
+        temps = self.data[0, offset:offset + length]
+        traits = self.data[1, offset:offset + length]
+        temps.flags.writeable = False
+        traits.flags.writeable = False
+        return temps, traits
+
+    def __getitem__(self, curve_id):
+        if curve_id not in self.index:
+            raise SharedCurvesException(self._err_nocurve.format(curve_id))
+        return self.views(*self.index[curve_id])
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        """ Detach from the block (views must not be used afterwards) """
+        self.data = None
+        if self.shm is not None:
+            self.shm.close()
+
+    def unlink(self):
+        """ Free the block, or remove the memory-mapped file (creating process only) """
+        if self.shm is not None:
+            self.shm.unlink()
+        elif self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __repr__(self):
+        return "SharedCurves({}, name='{}', path='{}')".format(self.n_points, self.name, self.path)
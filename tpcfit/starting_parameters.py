@@ -5,8 +5,11 @@
 The user supplies upper and lower parameter bounds within which parameters will be are randomly sampled via a truncated gaussian distribution."""
 
 import numpy as np
-from scipy.stats import truncnorm
-from lmfit import Parameter, Parameters
+from tpcfit.lazy_imports import lazy_import
+
+# Imported on first use
+stats = lazy_import("scipy.stats")
+lmfit = lazy_import("lmfit")
 # Probably fix this in the future...
 np.seterr(divide='ignore', invalid='ignore')
 
@@ -45,7 +48,7 @@ class StartParams(object):
         """
         if init_params is not None:
             self.init_params = init_params
-        if not isinstance(init_params, Parameters):
+        if not isinstance(init_params, lmfit.Parameters):
             raise StartParamsException(self._err_nonparam)
         elif self.init_params is None:
             raise StartParamsException(self._err_nonparam)
@@ -87,7 +90,7 @@ class StartParams(object):
         if upp is not None:
             upp=upp
 
-        return truncnorm(
+        return stats.truncnorm(
         (low-self.mean) / self.sd, (upp-self.mean) / self.sd, loc=self.mean, scale=self.sd
         )
 
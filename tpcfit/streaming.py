@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" streaming.py runs a batch fit as concurrent stages connected by bounded queues.
+
+Reading, cleaning and writing run in threads while curves are fitted in a process pool, so disk and CPU work overlap instead of taking turns on the critical path:
+
+    read -> [chunks] -> clean -> [curves] -> fit (process pool) -> [results] -> write
+
+Every queue is bounded, so a slow stage holds back the stages in front of it instead of letting data pile up in memory. Each stage records its throughput and how long it spent working or waiting, and each queue records its depth."""
+
+import time
+import queue
+import threading
+import multiprocessing
+import pandas as pd
+
+# Marks the end of a queue
+_DONE = object()
+
+class StreamingException(ValueError):
+    """ General purpose exception generator for the streaming pipeline (a ValueError, as data_wrang raised for badly ordered input)"""
+
+    def __init__(self, msg):
+        ValueError.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def complete_curves(chunks, id_col="originalid"):
+    """ Regroup a stream of dataframe chunks so that no curve is split between chunks
+
+    Rows of the last curve in each chunk are held back until the curve is complete. Each curve's rows must be contiguous in the input.
+
+    Parameters
+    ----------
+    chunks: iterable of dataframes
+        e.g. from pd.read_csv(chunksize=...)
+    id_col: str
+        Column of curve ids
+
+    Yields
+    ------
+    data: dataframe
+        Chunk of complete curves
+    """
+    finished = set()
+    held = None
+    for chunk in chunks:
+        if held is not None:
+            chunk = pd.concat([held, chunk], ignore_index=True)
+        if len(chunk) == 0:
+            continue
+
+        # Hold back the (possibly incomplete) last curve
+        is_last = (chunk[id_col] == chunk[id_col].iloc[-1]).to_numpy()
+        held = chunk.loc[is_last]
+        ready = chunk.loc[~is_last]
+
+        if len(ready):
+            _check_contiguous(ready[id_col], finished)
+            yield ready
+
+    if held is not None and len(held):
+        _check_contiguous(held[id_col], finished)
+        yield held
+
+def _check_contiguous(ids, finished):
+    """ Raise an error if a curve shows up again after it has been passed on """
+    ids = pd.unique(ids)
+    if finished.intersection(ids):
+        raise StreamingException("Curves are not contiguous in the input. Please sort by originalid first.")
+    finished.update(ids)
+
+def _timed_fit(fit_func, curve_id, dataset):
+    """ Fit a curve in a worker process, timing it """
+    start = time.perf_counter()
+    result = fit_func(curve_id, dataset)
+    return result, time.perf_counter() - start
+
+class StreamingPipeline(object):
+    """ read -> clean -> fit -> write, with the stages running concurrently """
+
+    def __init__(self, read, clean, fit_func, write, workers=None, queue_size=8, max_in_flight=None):
+        """
+        Parameters
+        ----------
+        read: callable
+            read() returns an iterable of input chunks (e.g. pd.read_csv(..., chunksize=...))
+        clean: callable
+            clean(chunks) takes an iterable of chunks and yields (curve_id, dataset) pairs
+        fit_func: callable
+            fit_func(curve_id, dataset) returns the result for one curve. Runs in worker processes, so it must be picklable (defined at module level, or a functools.partial of one).
+        write: callable
+            write(result) is called for every result, in the order fits finish. If it has a close() method, that is called once all results are written. Both are called from the writer thread.
+        workers: int
+            Number of worker processes (default: number of CPUs)
+        queue_size: int
+            Capacity of each queue between stages
+        max_in_flight: int
+            Curves submitted to the pool but not yet finished (default: 2 per worker)
+        """
+        self.read = read
+        self.clean = clean
+        self.fit_func = fit_func
+        self.write = write
+        self.workers = workers if workers is not None else multiprocessing.cpu_count()
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight if max_in_flight is not None else 2 * self.workers
+        self.stats = None
+        self.queue_depths = None
+
+    def run(self):
+        """ Run every stage until the input is exhausted
+
+        Returns
+        -------
+        n_results: int
+            Number of results written
+        """
+        self._stop = threading.Event()
+        self._errors = []
+        self._stage = {name: {"items": 0, "wait": 0.0, "start": None, "end": None, "busy": 0.0}
+                       for name in ("read", "clean", "fit", "write")}
+        self._queues = {name: queue.Queue(self.queue_size) for name in ("chunks", "curves", "results")}
+        self._depths = {name: [] for name in self._queues}
+
+        threads = [threading.Thread(target=self._guard, args=("read", self._read_stage), daemon=True),
+                   threading.Thread(target=self._guard, args=("clean", self._clean_stage), daemon=True),
+                   threading.Thread(target=self._guard, args=("write", self._write_stage), daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        # Fitting is dispatched from this thread
+        self._guard("fit", self._fit_stage)
+
+        for thread in threads:
+            thread.join()
+
+        self.stats = self.stage_stats()
+        self.queue_depths = self.queue_stats()
+        if self._errors:
+            raise self._errors[0]
+        return self._stage["write"]["items"]
+
+    def _guard(self, name, stage):
+        """ Run a stage, stopping the whole pipeline if it fails """
+        self._stage[name]["start"] = time.perf_counter()
+        try:
+            stage()
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            self._stage[name]["end"] = time.perf_counter()
+
+    def _put(self, name, item, stage):
+        """ Put an item on a queue, waiting while it is full (unless the pipeline is stopping) """
+        start = time.perf_counter()
+        q = self._queues[name]
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._depths[name].append(q.qsize())
+        self._stage[stage]["wait"] += time.perf_counter() - start
+
+    def _iter_queue(self, name, stage):
+        """ Iterate over a queue until the previous stage is done """
+        q = self._queues[name]
+        while True:
+            start = time.perf_counter()
+            item = None
+            while not self._stop.is_set():
+                try:
+                    item = q.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    pass
+            self._stage[stage]["wait"] += time.perf_counter() - start
+            if item is None or item is _DONE:
+                return
+            yield item
+
+    def _read_stage(self):
+        try:
+            for chunk in self.read():
+                self._stage["read"]["items"] += 1
+                self._put("chunks", chunk, "read")
+        finally:
+            self._put("chunks", _DONE, "read")
+
+    def _clean_stage(self):
+        try:
+            for curve in self.clean(self._iter_queue("chunks", "clean")):
+                self._stage["clean"]["items"] += 1
+                self._put("curves", curve, "clean")
+        finally:
+            self._put("curves", _DONE, "clean")
+
+    def _fit_stage(self):
+        # Limit the curves handed to the pool, so the pool's own queue stays short too
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        stage = self._stage["fit"]
+
+        def finished(output):
+            result, elapsed = output
+            stage["busy"] += elapsed
+            stage["items"] += 1
+            self._put("results", result, "fit")
+            slots.release()
+
+        def failed(error):
+            self._errors.append(error)
+            self._stop.set()
+            slots.release()
+
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            for curve_id, dataset in self._iter_queue("curves", "fit"):
+                while not slots.acquire(timeout=0.1):
+                    if self._stop.is_set():
+                        return
+                pool.apply_async(_timed_fit, (self.fit_func, curve_id, dataset), callback=finished, error_callback=failed)
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+            self._put("results", _DONE, "fit")
+
+    def _write_stage(self):
+        try:
+            for result in self._iter_queue("results", "write"):
+                self.write(result)
+                self._stage["write"]["items"] += 1
+        finally:
+            if hasattr(self.write, "close"):
+                self.write.close()
+
+    def stage_stats(self):
+        """ Throughput of each stage
+
+        Returns
+        -------
+        stats: pandas DataFrame
+            Items handled, seconds running, seconds waiting on queues, and items per second for each stage. The fit stage's busy time is the total fitting time over all workers.
+        """
+        rows = []
+        for name, stage in self._stage.items():
+            wall = (stage["end"] or time.perf_counter()) - (stage["start"] or time.perf_counter())
+            busy = stage["busy"] if name == "fit" else max(wall - stage["wait"], 0.0)
+            rows.append({"stage": name, "items": stage["items"], "wall": wall, "busy": busy, "wait": stage["wait"],
+                         "throughput": stage["items"] / wall if wall > 0 else float("nan")})
+        return pd.DataFrame(rows).set_index("stage")
+
+    def queue_stats(self):
+        """ Depth of each queue, sampled every time an item was put on it
+
+        Returns
+        -------
+        depths: pandas DataFrame
+            Capacity, mean and maximum depth for each queue
+        """
+        rows = []
+        for name, depths in self._depths.items():
+            rows.append({"queue": name, "capacity": self.queue_size,
+                         "mean_depth": sum(depths) / len(depths) if depths else 0.0,
+                         "max_depth": max(depths) if depths else 0})
+        return pd.DataFrame(rows).set_index("queue")
+
+    def summary(self):
+        """ One readable line per stage and queue, from stats and queue_depths (after run)
+
+        Returns
+        -------
+        lines: list of str
+        """
+        lines = ["{} stage: {:d} items in {:.2f}s ({:.1f}/s), {:.2f}s busy, {:.2f}s waiting".format(
+                     name, int(row["items"]), row["wall"], row["throughput"], row["busy"], row["wait"]) for name, row in self.stats.iterrows()]
+        lines += ["{} queue: mean depth {:.1f}, max {:d} of {:d}".format(
+                      name, row["mean_depth"], int(row["max_depth"]), int(row["capacity"])) for name, row in self.queue_depths.iterrows()]
+        return lines
+
+    def __repr__(self):
+        return "StreamingPipeline(workers={}, queue_size={})".format(self.workers, self.queue_size)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" summary.py summarises fitted estimates (e.g. activation energies) by group, with bootstrap confidence intervals of the mean, median and other quantiles.
+
+This replaces the per-group scalar bootstrap loops of useful-scripts/activation_energy_analysis.R. For each group, the resample indices of all bootstrap replicates are drawn as one matrix (replicates x values), the resampled values are gathered in one step and every statistic is reduced along the rows: means with a row mean, medians and quantiles from the order statistics found by one np.partition of each row (no full sort). Replicates are processed in chunks of at most max_elements resampled values, so memory stays bounded for large groups. Each group has its own random stream, seeded from its key, so its intervals don't depend on the other groups in the table.
+
+Example :
+    >>> fits = pd.read_csv("Data/final_data.csv")
+    >>> fits["band"] = latitude_band(fits["latitude"])
+    >>> bootstrap_summary(fits, by=("climate", "interactor1kingdom", "standardisedtraitname"), value_col="estimate")
+
+    $ python -m tpcfit.summary -i Data/final_data.csv -o Results/summary.csv --by standardisedtraitname climate --value estimate
+"""
+
+import argparse
+import numpy as np
+from tpcfit.lazy_imports import lazy_import
+from tpcfit.sharding import curve_seed
+
+# Imported on first use
+pd = lazy_import("pandas")
+
+# Statistics bootstrapped by default, as in the activation energy analysis
+summary_stats = ("median", "mean")
+
+# Values kept by default: activation energies between 0 and 3 eV
+estimate_bounds = (0, 3)
+
+# Columns holding activation energies, the only ones estimate_bounds applies to by default
+energy_cols = ("E", "estimate")
+
+class SummaryException(Exception):
+    """ General purpose exception generator for summaries"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def stat_name(stat):
+    """ Column name of a statistic: "mean", "median" or a quantile, e.g. 0.25 -> "q25" """
+    if stat in ("mean", "median"):
+        return stat
+    return "q{:g}".format(100 * stat)
+
+def _quantile_positions(stats, n):
+    """ Order statistics and interpolation weight of each quantile of n values (linear interpolation, as np.quantile and R's default) """
+    positions = {}
+    for stat in stats:
+        if stat == "mean":
+            continue
+        q = 0.5 if stat == "median" else float(stat)
+        if not 0 <= q <= 1:
+            raise SummaryException("Quantiles must be between 0 and 1, not {}".format(stat))
+        h = q * (n - 1)
+        lo = int(np.floor(h))
+        positions[stat] = (lo, min(lo + 1, n - 1), h - lo)
+    return positions
+
+def _reduce(samples, stats, positions):
+    """ Statistics of each row of samples (rows are overwritten)
+
+    Parameters
+    ----------
+    samples: numpy array
+        Resampled values, one replicate per row
+    stats: tuple
+        Statistics to compute
+    positions: dict
+        Order statistics of each quantile (from _quantile_positions)
+
+    Returns
+    -------
+    values: dict
+        Statistic -> values of the replicates
+    """
+    values = {}
+    if "mean" in stats:
+        values["mean"] = samples.mean(axis=1)
+    if positions:
+        kth = sorted({k for lo, hi, w in positions.values() for k in (lo, hi)})
+        samples.partition(kth, axis=1)
+        for stat, (lo, hi, w) in positions.items():
+            values[stat] = samples[:, lo] + w * (samples[:, hi] - samples[:, lo]) if w else samples[:, lo].copy()
+    return values
+
+def bootstrap_stats(values, stats=summary_stats, n_boot=10000, level=0.95, seed=0, max_elements=2 ** 22):
+    """ Bootstrap confidence intervals of statistics of one sample
+
+    Parameters
+    ----------
+    values: array-like
+        Sample (non-finite values are dropped)
+    stats: tuple
+        "mean", "median" and/or quantiles between 0 and 1
+    n_boot: int
+        Number of bootstrap replicates
+    level: float
+        Confidence level of the percentile intervals
+    seed: int or numpy Generator
+        Random seed
+    max_elements: int
+        Largest number of resampled values held at once (replicates are processed in chunks)
+
+    Returns
+    -------
+    summary: dict
+        n, and for each statistic its value on the sample and the lower and upper bounds of its interval
+        (e.g. "median", "median_low", "median_high"). All NaN for an empty sample.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    n = len(values)
+    if not 0 < level < 1:
+        raise SummaryException("Confidence level must be between 0 and 1, not {}".format(level))
+    summary = {"n": n}
+    if n == 0:
+        for stat in stats:
+            name = stat_name(stat)
+            summary.update({name: np.nan, name + "_low": np.nan, name + "_high": np.nan})
+        return summary
+
+    positions = _quantile_positions(stats, n)
+    estimates = _reduce(values[None, :].copy(), stats, positions)
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    chunk = max(1, min(n_boot, max_elements // n))
+    replicates = {stat: np.empty(n_boot) for stat in stats}
+    for start in range(0, n_boot, chunk):
+        stop = min(start + chunk, n_boot)
+        # All resample indices of the chunk as one matrix, and the resampled values gathered at once
+        samples = values[rng.integers(0, n, size=(stop - start, n))]
+        for stat, reps in _reduce(samples, stats, positions).items():
+            replicates[stat][start:stop] = reps
+
+    tail = (1 - level) / 2
+    for stat in stats:
+        name = stat_name(stat)
+        low, high = np.quantile(replicates[stat], (tail, 1 - tail))
+        summary.update({name: estimates[stat][0], name + "_low": low, name + "_high": high})
+    return summary
+
+def latitude_band(latitudes, width=10):
+    """ Band of absolute latitude of each value, e.g. 23.4 and -27.7 -> "20-30" with width 10
+
+    Parameters
+    ----------
+    latitudes: array-like
+        Latitudes in degrees
+    width: float
+        Width of each band in degrees
+
+    Returns
+    -------
+    bands: numpy array
+        Band labels (None where the latitude is missing)
+    """
+    latitudes = np.abs(np.asarray(latitudes, dtype=float))
+    lower = np.floor(latitudes / width) * width
+    return np.array([None if low != low else "{:g}-{:g}".format(low, low + width) for low in lower], dtype=object)
+
+def bootstrap_summary(table, by=("standardisedtraitname",), value_col="E", stats=summary_stats, n_boot=10000, level=0.95, seed=0,
+                      bounds=None, prefix="trait_", max_elements=2 ** 22):
+    """ Grouped bootstrap summary of a table of fitted estimates
+
+    Parameters
+    ----------
+    table: pandas DataFrame
+        Fitted estimates, e.g. the results csv of the pipeline or final_data.csv
+    by: tuple
+        Group columns (rows with a missing group value are dropped)
+    value_col: str
+        Column summarised ("E" in pipeline results, "estimate" in final_data.csv)
+    stats: tuple
+        "mean", "median" and/or quantiles between 0 and 1
+    n_boot: int
+        Number of bootstrap replicates per group
+    level: float
+        Confidence level of the percentile intervals
+    seed: int
+        Base random seed; each group's replicates are drawn from a seed derived from its key
+    bounds: tuple, optional
+        Only values strictly between these bounds are summarised. By default estimate_bounds for the energy_cols and all finite values of other columns (pass (-np.inf, np.inf) to keep every energy).
+    prefix: str
+        Prefix of the statistic columns (e.g. trait_median, trait_median_low, trait_median_high)
+    max_elements: int
+        Largest number of resampled values held at once
+
+    Returns
+    -------
+    summary: pandas DataFrame
+        One row per group with the group columns, n, and each statistic with its interval bounds
+    """
+    by = list(by)
+    missing = [col for col in by + [value_col] if col not in table.columns]
+    if missing:
+        raise SummaryException("Columns {} not in the table".format(missing))
+    values = pd.to_numeric(table[value_col], errors="coerce")
+    keep = values.notna() & table[by].notna().all(axis=1)
+    if bounds is None and value_col in energy_cols:
+        bounds = estimate_bounds
+    if bounds is not None:
+        keep &= (values > bounds[0]) & (values < bounds[1])
+    data = table.loc[keep, by].assign(_value=values[keep])
+
+    rows = []
+    for key, group in data.groupby(by, sort=True):
+        key = key if isinstance(key, tuple) else (key,)
+        group_seed = curve_seed("|".join(str(value) for value in key), seed)
+        summary = bootstrap_stats(group["_value"].to_numpy(), stats, n_boot, level, group_seed, max_elements)
+        row = dict(zip(by, key))
+        row["n"] = summary.pop("n")
+        row.update({prefix + name: value for name, value in summary.items()})
+        rows.append(row)
+    columns = by + ["n"] + [prefix + stat_name(stat) + suffix for stat in stats for suffix in ("", "_low", "_high")]
+    return pd.DataFrame(rows, columns=columns)
+
+if __name__ == "__main__":
+    """ This is executed when run from the command line"""
+
+    # Assign command line interface
+    parser = argparse.ArgumentParser(description="Grouped bootstrap summary of fitted estimates")
+
+    parser.add_argument("-i", "--input",
+                        type=str,
+                        help="Csv of fitted estimates",
+                        required=True)
+    parser.add_argument("-o", "--output",
+                        type=str,
+                        help="Summary csv",
+                        required=True)
+    parser.add_argument("--by",
+                        type=str,
+                        nargs="+",
+                        help="Group columns ('latitude_band' is computed from the latitude column)",
+                        required=False,
+                        default=["standardisedtraitname"])
+    parser.add_argument("--value",
+                        type=str,
+                        help="Column summarised",
+                        required=False,
+                        default="E")
+    parser.add_argument("--bounds",
+                        type=float,
+                        nargs=2,
+                        metavar=("LOW", "HIGH"),
+                        help="Only summarise values strictly between LOW and HIGH (default: 0 3 for the energy columns E and estimate, no bounds for other columns; e.g. -10 10 keeps negative energies)",
+                        required=False,
+                        default=None)
+    parser.add_argument("--quantiles",
+                        type=float,
+                        nargs="*",
+                        help="Quantiles bootstrapped besides the median and mean",
+                        required=False,
+                        default=[])
+    parser.add_argument("--n-boot",
+                        type=int,
+                        help="Bootstrap replicates per group",
+                        required=False,
+                        default=10000)
+    parser.add_argument("--seed",
+                        type=int,
+                        help="Random seed",
+                        required=False,
+                        default=0)
+
+    args = parser.parse_args()
+    fits = pd.read_csv(args.input)
+    if "latitude_band" in args.by and "latitude_band" not in fits.columns:
+        fits["latitude_band"] = latitude_band(fits["latitude"])
+    summary = bootstrap_summary(fits, by=args.by, value_col=args.value, stats=summary_stats + tuple(args.quantiles),
+                                n_boot=args.n_boot, seed=args.seed, bounds=args.bounds)
+    summary.to_csv(args.output, index=False)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" synthetic.py generates synthetic Sharpe-Schoolfield thermal performance curves with known parameters.
+
+Curves are returned in the same long format as the input data (one row per measurement), together with a table of the true parameters of every curve, so fits can be timed and scored on parameter recovery. Everything is generated from a seed, so the same call gives the same curves on every machine and commit."""
+
+import numpy as np
+import pandas as pd
+from tpcfit.models import ThermalModels, SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow
+
+# Ranges true parameters are drawn from (uniformly)
+truth_bounds = {"B0": [0.2, 1.0], "E": [0.3, 0.8],
+                "Eh": [2.0, 4.0], "El": [1.5, 3.0],
+                "Th": [303.15, 313.15], "Tl": [280.15, 288.15]}
+
+# Models by name
+synthetic_models = {model.model_name: model for model in (SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow)}
+
+class SyntheticException(Exception):
+    """ General purpose exception generator for synthetic curves"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def schoolfield_project(model_name, params):
+    """ Parameters with Th at least 1 K above Tl, moved as ssf_fcn2min moves them before evaluating the full model
+
+    Parameters
+    ----------
+    model_name: str
+        One of "sharpeschoolfull", "sharpeschoolhigh" or "sharpeschoollow" (only the full model is changed)
+    params: dict
+        Parameter values (scalars, or arrays broadcastable with temps)
+
+    Returns
+    -------
+    params: dict
+        A copy with Th projected, or params itself for the other models
+    """
+    if model_name != SharpeSchoolfieldFull.model_name:
+        return params
+    params = dict(params)
+    params["Th"] = np.maximum(params["Th"], params["Tl"] + 1)
+    return params
+
+def schoolfield_log(model_name, temps, params):
+    """ Log trait values of a Sharpe-Schoolfield model (the same equations the models are fitted with, including the Th projection of schoolfield_project)
+
+    Parameters
+    ----------
+    model_name: str
+        One of "sharpeschoolfull", "sharpeschoolhigh" or "sharpeschoollow"
+    temps: numpy array
+        Temperatures in Kelvin
+    params: dict
+        Parameter values (scalars, or arrays broadcastable with temps)
+
+    Returns
+    -------
+    log_traits: numpy array
+    """
+    k, Tref = ThermalModels.k, ThermalModels.Tref
+    params = schoolfield_project(model_name, params)
+    boltzmann = params["B0"] * np.exp((-params["E"] / k) * ((1 / temps) - (1 / Tref)))
+    denominator = 1.0
+    if model_name in (SharpeSchoolfieldFull.model_name, SharpeSchoolfieldLow.model_name):
+        denominator = denominator + np.exp((params["El"] / k) * ((1 / params["Tl"]) - (1 / temps)))
+    if model_name in (SharpeSchoolfieldFull.model_name, SharpeSchoolfieldHigh.model_name):
+        denominator = denominator + np.exp((params["Eh"] / k) * ((1 / params["Th"]) - (1 / temps)))
+    return np.log(boltzmann / denominator)
+
+def schoolfield_log_jacobian(model_name, temps, params):
+    """ Log trait values of a Sharpe-Schoolfield model and their derivatives with respect to each parameter
+
+    The denominator is summed in log space, so values stay finite where the deactivation terms overflow. Where schoolfield_project moves Th, its derivative is passed on to Tl.
+
+    Parameters
+    ----------
+    model_name: str
+        One of "sharpeschoolfull", "sharpeschoolhigh" or "sharpeschoollow"
+    temps: numpy array
+        Temperatures in Kelvin
+    params: dict
+        Parameter values (scalars, or arrays broadcastable with temps)
+
+    Returns
+    -------
+    log_traits: numpy array
+    derivatives: dict
+        Parameter name -> derivative of log_traits
+    """
+    k, Tref = ThermalModels.k, ThermalModels.Tref
+    moved = False
+    if model_name == SharpeSchoolfieldFull.model_name:
+        moved = params["Th"] < params["Tl"] + 1
+        params = schoolfield_project(model_name, params)
+    inv_temps = 1 / temps
+    exponents = {}
+    if model_name in (SharpeSchoolfieldFull.model_name, SharpeSchoolfieldLow.model_name):
+        exponents["l"] = (params["El"] / k) * ((1 / params["Tl"]) - inv_temps)
+    if model_name in (SharpeSchoolfieldFull.model_name, SharpeSchoolfieldHigh.model_name):
+        exponents["h"] = (params["Eh"] / k) * ((1 / params["Th"]) - inv_temps)
+    log_denominator = np.zeros(np.broadcast(temps, *exponents.values()).shape)
+    for exponent in exponents.values():
+        log_denominator = np.logaddexp(log_denominator, exponent)
+
+    log_traits = np.log(params["B0"]) - (params["E"] / k) * (inv_temps - (1 / Tref)) - log_denominator
+    derivatives = {"B0": np.broadcast_to(1 / params["B0"], log_traits.shape),
+                   "E": np.broadcast_to(-(inv_temps - (1 / Tref)) / k, log_traits.shape)}
+    for side, exponent in exponents.items():
+        # Share of the denominator due to this deactivation term
+        share = np.exp(exponent - log_denominator)
+        E, T = params["E" + side], params["T" + side]
+        derivatives["E" + side] = -share * ((1 / T) - inv_temps) / k
+        derivatives["T" + side] = share * E / (k * T ** 2)
+    if np.any(moved):
+        # Th = Tl + 1 there, so it follows Tl
+        derivatives["Tl"] = derivatives["Tl"] + np.where(moved, derivatives["Th"], 0.0)
+        derivatives["Th"] = np.where(moved, 0.0, derivatives["Th"])
+    return log_traits, derivatives
+
+def synthetic_curves(n_curves, model_name="sharpeschoolhigh", n_points=10, noise=0.1, temp_range=(278.15, 318.15), seed=0):
+    """ Generate synthetic curves with known parameters
+
+    Parameters
+    ----------
+    n_curves: int
+        Number of curves
+    model_name: str
+        Model used to generate the curves
+    n_points: int
+        Number of measurements (at distinct temperatures) per curve
+    noise: float
+        Standard deviation of the gaussian noise added to the log trait values
+    temp_range: tuple
+        Lowest and highest temperature in Kelvin. Each curve's temperatures are evenly spaced over a randomly shifted part of the range.
+    seed: int
+        Random seed
+
+    Returns
+    -------
+    data: pandas DataFrame
+        One row per measurement with originalid, interactor1temp (degrees C), interactor1K, standardisedtraitvalue and unique_temps columns
+    truth: pandas DataFrame
+        True parameters of each curve, indexed by originalid
+    """
+    if model_name not in synthetic_models:
+        raise SyntheticException("Unknown model '{}'. Choose from {}".format(model_name, sorted(synthetic_models)))
+    rng = np.random.default_rng(seed)
+    param_names = synthetic_models[model_name].param_names
+
+    # True parameters, one row per curve
+    truth = {name: rng.uniform(*truth_bounds[name], size=n_curves) for name in param_names}
+
+    # Evenly spaced temperatures spanning 80-100% of the range, at a random offset
+    low, high = temp_range
+    span = (high - low) * rng.uniform(0.8, 1.0, size=n_curves)
+    start = low + (high - low - span) * rng.uniform(size=n_curves)
+    grid = np.linspace(0, 1, n_points)
+    temps = start[:, None] + span[:, None] * grid[None, :]
+
+    log_traits = schoolfield_log(model_name, temps, {name: values[:, None] for name, values in truth.items()})
+    log_traits = log_traits + rng.normal(scale=noise, size=log_traits.shape)
+
+    ids = np.array(["SYN{}".format(i) for i in range(n_curves)], dtype=object)
+    data = pd.DataFrame({"originalid": np.repeat(ids, n_points),
+                         "interactor1temp": temps.ravel() - 273.15,
+                         "interactor1K": temps.ravel(),
+                         "standardisedtraitvalue": np.exp(log_traits).ravel(),
+                         "unique_temps": n_points})
+    truth = pd.DataFrame(truth, index=pd.Index(ids, name="originalid"))
+    return data, truth
+
+def synthetic_datasets(data):
+    """ Split synthetic data into a dictionary of curves (like get_datasets, but in one pass)
+
+    Parameters
+    ----------
+    data: pandas DataFrame
+        Output of synthetic_curves
+
+    Returns
+    -------
+    datasets: dict
+        Dictionary of curves with originalid as keys
+    """
+    return {curve_id: curve.reset_index(drop=True) for curve_id, curve in data.groupby("originalid", sort=False)}
+
+def recovery_error(estimates, truth):
+    """ Parameter recovery error of a set of fits
+
+    Relative error for B0 and the energies, absolute error in Kelvin for Th and Tl.
+
+    Parameters
+    ----------
+    estimates: pandas DataFrame
+        Fitted parameters, indexed by originalid
+    truth: pandas DataFrame
+        True parameters, indexed by originalid
+
+    Returns
+    -------
+    errors: pandas DataFrame
+        Error of each parameter for each curve (NaN where a fit failed)
+    """
+    estimates = estimates.reindex(index=truth.index, columns=truth.columns)
+    errors = (estimates - truth).abs()
+    relative = [col for col in truth.columns if col not in ("Th", "Tl")]
+    errors[relative] = errors[relative] / truth[relative].abs()
+    return errors
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" templates.py keeps a library of previously fitted curves to start new fits from.
+
+Many curves share a shape, so a new curve's best starting point is probably close to the fit of a similar curve. Each fitted curve is described by shape features (its log trait profile on a fixed temperature grid relative to its peak, the peak temperature and the slopes of its rising and falling limbs) and stored with its parameter estimates. A KD-tree per model finds the nearest fitted curves, whose estimates become the first starts of the new fit before any random StartParams draws. B0 is rescaled by the difference between the curves' peak trait values, as the profiles are compared relative to their peak.
+
+Example :
+    >>> library = TemplateLibrary.load("Results/templates.npz")
+    >>> fit_tpc(temps, traits, vals, templates=library, n_templates=3)
+    >>> library.add("MTD4538", "sharpeschoolhigh", temps, traits, estimates)
+    >>> library.save("Results/templates.npz")
+"""
+
+import os
+import numpy as np
+from tpcfit.lazy_imports import lazy_import
+from tpcfit.models import SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow
+
+# Imported on first use
+spatial = lazy_import("scipy.spatial")
+
+# Parameter names of each model
+template_params = {model.model_name: model.param_names for model in (SharpeSchoolfieldFull, SharpeSchoolfieldHigh, SharpeSchoolfieldLow)}
+
+# Temperatures (K) at which trait profiles are compared (0 - 45 degrees C)
+shape_grid = 273.15 + np.linspace(0, 45, 10)
+
+# Features are divided by these so that 1 unit of distance is about the same in each: log trait, K of peak temperature, eV of limb slope
+peak_scale = 10.0
+slope_scale = 2.0
+
+# Boltzmann's constant (eV/K)
+k = 8.617 * 10 ** (-5)
+
+# Format version of saved libraries
+_version = 1
+
+class TemplateException(Exception):
+    """ General purpose exception generator for TemplateLibrary"""
+
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+
+    def __str__(self):
+        return "{}".format(self.msg)
+
+def _limb_slope(temps, log_traits):
+    """ Arrhenius slope (eV) of log traits against -1/kT, 0 with fewer than 2 temperatures """
+    if len(temps) < 2:
+        return 0.0
+    return np.polyfit(-1 / (k * temps), log_traits, 1)[0]
+
+def shape_features(temps, traits, grid=shape_grid):
+    """ Normalised shape of a curve
+
+    Parameters
+    ----------
+    temps: numpy array
+        Temperature values in Kelvin
+    traits: numpy array
+        Trait values
+    grid: numpy array
+        Temperatures (K) at which the log trait profile is sampled
+
+    Returns
+    -------
+    features: numpy array
+        Log trait profile on the grid minus the peak log trait (flat beyond the measured range), then the scaled peak temperature and rising and falling limb slopes. None if the curve has fewer than 2 positive trait values at different temperatures.
+    peak: float
+        Peak log trait value
+    """
+    temps, traits = np.asarray(temps, dtype=float), np.asarray(traits, dtype=float)
+    keep = np.isfinite(temps) & np.isfinite(traits) & (traits > 0)
+
+    # Average log traits at repeated temperatures
+    unique_temps, inverse = np.unique(temps[keep], return_inverse=True)
+    if len(unique_temps) < 2:
+        return None, None
+    log_traits = np.bincount(inverse, weights=np.log(traits[keep])) / np.bincount(inverse)
+
+    i_peak = np.argmax(log_traits)
+    peak = log_traits[i_peak]
+    profile = np.interp(grid, unique_temps, log_traits) - peak
+    rise = _limb_slope(unique_temps[:i_peak + 1], log_traits[:i_peak + 1])
+    fall = _limb_slope(unique_temps[i_peak:], log_traits[i_peak:])
+
+    features = np.concatenate([profile, [(unique_temps[i_peak] - 273.15) / peak_scale, rise / slope_scale, fall / slope_scale]])
+    return features, peak
+
+class TemplateLibrary(object):
+    """ Previously fitted curves indexed by shape, to start new fits from """
+
+    def __init__(self, grid=shape_grid):
+        """
+        Parameters
+        ----------
+        grid: numpy array
+            Temperatures (K) at which trait profiles are compared
+        """
+        self.grid = np.asarray(grid, dtype=float)
+        # Per model: originalid -> (features, peak log trait, estimates in template_params order)
+        self._entries = {model_name: {} for model_name in template_params}
+        self._index = {}
+
+    def add(self, curve_id, model_name, temps, traits, estimates):
+        """ Add (or replace) the fit of a curve
+
+        Parameters
+        ----------
+        curve_id: str
+            originalid of the curve
+        model_name: str
+            Model that was fitted
+        temps: numpy array
+            Temperature values in Kelvin
+        traits: numpy array
+            Trait values
+        estimates: dict
+            Parameter estimates of the fit
+
+        Returns
+        -------
+        added: bool
+            False if the curve has no shape or the estimates aren't all finite
+        """
+        if model_name not in template_params:
+            raise TemplateException("Unknown model '{}'. Choose from {}".format(model_name, sorted(template_params)))
+        features, peak = shape_features(temps, traits, self.grid)
+        try:
+            values = np.array([estimates[name] for name in template_params[model_name]], dtype=float)
+        except (KeyError, TypeError, ValueError):
+            return False
+        if features is None or not np.all(np.isfinite(values)):
+            return False
+        self._entries[model_name][str(curve_id)] = (features, peak, values)
+        self._index.pop(model_name, None)
+        return True
+
+    def _tree(self, model_name):
+        """ KD-tree over the features of a model's fits (rebuilt after additions) """
+        if model_name not in self._index:
+            entries = list(self._entries[model_name].values())
+            features = np.array([entry[0] for entry in entries])
+            self._index[model_name] = (spatial.cKDTree(features),
+                                       np.array([entry[1] for entry in entries]),
+                                       np.array([entry[2] for entry in entries]))
+        return self._index[model_name]
+
+    def starts(self, model_name, temps, traits, n=3):
+        """ Starting parameters from the fits of the most similar curves
+
+        Parameters
+        ----------
+        model_name: str
+            Model to be fitted
+        temps: numpy array
+            Temperature values in Kelvin
+        traits: numpy array
+            Trait values
+        n: int
+            Number of neighbours
+
+        Returns
+        -------
+        starts: list of dicts
+            Parameter values of up to n nearest fits, nearest first (empty if the library has no fits of the model)
+        """
+        if n < 1 or not self._entries.get(model_name):
+            return []
+        features, peak = shape_features(temps, traits, self.grid)
+        if features is None:
+            return []
+        tree, peaks, values = self._tree(model_name)
+        n = min(n, tree.n)
+        distances, indices = tree.query(features, k=n)
+        names = template_params[model_name]
+        starts = []
+        for i in np.atleast_1d(indices):
+            start = dict(zip(names, values[i]))
+            # Profiles are relative to the peak, so scale B0 to this curve's peak
+            start["B0"] = start["B0"] * np.exp(peak - peaks[i])
+            starts.append(start)
+        return starts
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def __contains__(self, curve_id):
+        return any(str(curve_id) in entries for entries in self._entries.values())
+
+    def save(self, path):
+        """ Save the library to a .npz file (written to a temporary file first, so readers never see a partial library) """
+        arrays = {"version": np.array(_version), "grid": self.grid}
+        for model_name, entries in self._entries.items():
+            n_features = len(self.grid) + 3
+            arrays[model_name + ".ids"] = np.array(list(entries.keys()), dtype=str)
+            arrays[model_name + ".features"] = np.array([entry[0] for entry in entries.values()]).reshape(-1, n_features)
+            arrays[model_name + ".peaks"] = np.array([entry[1] for entry in entries.values()], dtype=float)
+            arrays[model_name + ".estimates"] = np.array([entry[2] for entry in entries.values()]).reshape(-1, len(template_params[model_name]))
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, missing_ok=True):
+        """ Load a library saved with save
+
+        Parameters
+        ----------
+        path: str
+            Path of the .npz file
+        missing_ok: bool
+            Return an empty library if the file doesn't exist yet
+
+        Returns
+        -------
+        library: TemplateLibrary
+        """
+        if missing_ok and not os.path.exists(path):
+            return cls()
+        with np.load(path, allow_pickle=False) as arrays:
+            if int(arrays["version"]) != _version:
+                raise TemplateException("{} is a version {} template library, expected version {}".format(path, int(arrays["version"]), _version))
+            library = cls(arrays["grid"])
+            for model_name in template_params:
+                if model_name + ".ids" not in arrays:
+                    continue
+                library._entries[model_name] = {curve_id: (features, peak, values) for curve_id, features, peak, values in
+                                                zip(arrays[model_name + ".ids"].tolist(), arrays[model_name + ".features"],
+                                                    arrays[model_name + ".peaks"], arrays[model_name + ".estimates"])}
+        return library
+
+    def __repr__(self):
+        return "TemplateLibrary({})".format(", ".join("{}={}".format(model_name, len(entries)) for model_name, entries in self._entries.items()))
+
+# Libraries loaded by load_templates in this process: path -> (modification time, library)
+_loaded = {}
+
+def load_templates(path):
+    """ TemplateLibrary.load, cached per process until the file changes (so each worker loads the library once) """
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if path not in _loaded or _loaded[path][0] != mtime:
+        _loaded[path] = (mtime, TemplateLibrary.load(path))
+    return _loaded[path][1]
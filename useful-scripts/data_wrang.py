@@ -61,34 +61,36 @@ def celcius2kelvin(dataset, is_celcius = True):
 
     return dataset
 
-def rm_negative_vals(dataset):
+def rm_negative_vals(dataset, id_col=None):
     """Removes 0 or negative values
 
     Parameters
     ----------
     dataset: dataframe to be cleaned
+    id_col: str, optional
+        column of curve ids. If given, every curve in the dataframe is
+        shifted separately (with a groupby-transform rather than a loop)
 
     Returns
     -------
     dataset: new dataframe without negative temperature or trait values
     """
 
-    # Find minimum temperature value
-    min_temp_val = dataset["temps"].min()
+    for col in ["traits", "temps"]:
+        values = dataset[col].to_numpy(dtype=np.float64)
 
-    # Find minimum trait value
-    min_trait_val = dataset["traits"].min()
+        # Find minimum value (per curve if ids are given)
+        if id_col is None:
+            min_val = np.full(len(values), values.min())
+        else:
+            min_val = dataset.groupby(id_col, sort=False)[col].transform("min").to_numpy()
 
-    # Get rid of 0s for temps and traits columns
-    if min_trait_val <= 0:
-        dataset["traits"] -= min_trait_val - 10E-10
-
-    if min_temp_val <= 0:
-        dataset["temps"] -= min_temp_val - 10E-10
+        # Get rid of 0s for temps and traits columns
+        dataset[col] = values - np.where(min_val <= 0, min_val - 10E-10, 0)
 
     return dataset
 
-def unique_temps(dataset):
+def unique_temps(dataset, id_col=None):
     """Gets the number of unique temperatures for a given dataset
 
     (Will be useful when checking model parameters)
@@ -97,13 +99,18 @@ def unique_temps(dataset):
     ----------
     dataset: pandas core dataframe
         dataframe to be cleaned
+    id_col: str, optional
+        column of curve ids. If given, temperatures are counted per curve
 
     Returns
     -------
     dataset: new dataframe with unique_temps column
     """
 
-    dataset["unique_temps"] = dataset["temps"].nunique()
+    if id_col is None:
+        dataset["unique_temps"] = dataset["temps"].nunique()
+    else:
+        dataset["unique_temps"] = dataset.groupby(id_col, sort=False)["temps"].transform("nunique")
 
     return dataset
 
@@ -117,20 +124,18 @@ def main():
     # Rename columns so things are less annoying to type
     data.rename(columns={"interactor1temp":"temps",         "standardisedtraitvalue":"traits"}, inplace=True)
 
-    # Create dictionary of TPCs
-    datasets = get_datasets(data)
+    # Convert temperature in celcius to kelvin
+    data = celcius2kelvin(data)
+    # Remove negative values from each curve
+    data = rm_negative_vals(data, id_col="originalid")
+    # Get number of unique temps in each curve
+    data = unique_temps(data, id_col="originalid")
 
-    for i in datasets.keys():
-        dataset = datasets[i]
-        # Convert temperature in celcius to kelvin
-        dataset = celcius2kelvin(dataset)
-        # Remove negative values
-        dataset = rm_negative_vals(dataset)
-        # Get number of unique temps
-        dataset = unique_temps(dataset)
+    # Order curves as get_datasets would: first appearance, then temperature
+    data["curve"] = pd.factorize(data["originalid"])[0]
+    data = data.sort_values(["curve", "temps"], kind="mergesort").drop(columns="curve").reset_index()
 
     # Export clean data to results folder
-    data = pd.concat(datasets)
     data.to_csv(args.output, index=False)
     print("NLLS data saved to {}".format(args.output))
 
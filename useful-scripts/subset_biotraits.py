@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import csv
 import pandas as pd
 import random
 
@@ -13,6 +14,7 @@ __date__ = "April 2019"
 """
 Example :
     $ python subset_biotraits.py -i input filepath -tpc number of tpcs to subset -o output filepath
+    $ python subset_biotraits.py -i input filepath -tpc 5 --stratify interactor1kingdom --seed 1
 """
 
 def get_test_data(data, no_tpcs):
@@ -40,18 +42,105 @@ def get_test_data(data, no_tpcs):
 
     return test_data
 
-def main():
+def reservoir_sample(reader, no_tpcs, id_col="originalid", strata_col=None, seed=None):
+    """Selects whole TPC datasets at random in a single pass over the rows
+
+    Curves are reservoir sampled by originalid as they are first seen, so only
+    the rows of the currently selected curves are held in memory. Rows of a
+    curve do not need to be contiguous.
 
-    # Read in file
-    data = pd.read_csv(args.input, low_memory=False)
+    Parameters
+    ----------
+    reader : iterator of rows (lists), starting with the header row
+    no_tpcs: number of tpc datasets to extract (per stratum if stratified)
+    id_col: column of curve ids
+    strata_col: column to stratify by (e.g. standardisedtraitname), optional
+    seed: random seed, optional
+
+    Returns
+    -------
+    header : list of column names
+    rows : selected rows in their original order
+    """
+    rng = random.Random(seed)
+
+    header = next(reader)
+    id_idx = header.index(id_col)
+    strata_idx = header.index(strata_col) if strata_col is not None else None
+
+    # Rows of selected curves, keyed by curve id
+    chosen = {}
+    # Curves seen but not (or no longer) selected
+    rejected = set()
+    # Reservoir of curve ids and number of curves seen, per stratum
+    reservoirs = {}
+    seen = {}
+
+    for line, row in enumerate(reader):
+        curve = row[id_idx]
+        if curve in chosen:
+            chosen[curve].append((line, row))
+            continue
+        if curve in rejected:
+            continue
+
+        # First time we see this curve
+        stratum = row[strata_idx] if strata_idx is not None else None
+        reservoir = reservoirs.setdefault(stratum, [])
+        seen[stratum] = seen.get(stratum, 0) + 1
+
+        if len(reservoir) < no_tpcs:
+            reservoir.append(curve)
+            chosen[curve] = [(line, row)]
+        else:
+            j = rng.randrange(seen[stratum])
+            if j < no_tpcs:
+                # Replace a selected curve and drop its rows
+                evicted = reservoir[j]
+                del chosen[evicted]
+                rejected.add(evicted)
+                reservoir[j] = curve
+                chosen[curve] = [(line, row)]
+            else:
+                rejected.add(curve)
+
+    rows = sorted((r for curve_rows in chosen.values() for r in curve_rows), key=lambda r: r[0])
+    return header, [row for _, row in rows]
+
+def stream_test_data(input, output, no_tpcs, strata_col=None, seed=None):
+    """Streams a large TPC database and writes a random subset of datasets
+
+    Parameters
+    ----------
+    input : path of csv to be subsetted
+    output : path of csv to write
+    no_tpcs: number of tpc datasets to extract (per stratum if stratified)
+    strata_col: column to stratify by, optional
+    seed: random seed, optional
+
+    Returns
+    -------
+    no_selected : number of tpc datasets written
+    """
+    with open(input, newline="") as f:
+        header, rows = reservoir_sample(csv.reader(f), no_tpcs, strata_col=strata_col, seed=seed)
+
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    id_idx = header.index("originalid")
+    return len(set(row[id_idx] for row in rows))
+
+def main():
 
     # Generate test data
     print("Generating test data...")
-    TestData = get_test_data(data, args.no_tpcs)
-    print("{} TPC datasets selected...".format(args.no_tpcs))
+    no_selected = stream_test_data(args.input, args.output, args.no_tpcs, strata_col=args.stratify, seed=args.seed)
+    print("{} TPC datasets selected...".format(no_selected))
 
     # Save to output directory
-    TestData.to_csv(args.output, index = False)
     print("Test data saved to {}".format(args.output))
 
 if __name__ == "__main__":
@@ -80,5 +169,19 @@ if __name__ == "__main__":
                         required=False,
                         default="../data/TestData.csv")
 
+    # Stratify by column
+    parser.add_argument("--stratify",
+                        type=str,
+                        help="Column to stratify by, e.g. standardisedtraitname or interactor1kingdom (-tpc datasets per stratum)",
+                        required=False,
+                        default=None)
+
+    # Random seed
+    parser.add_argument("--seed",
+                        type=int,
+                        help="Random seed for reproducible subsets",
+                        required=False,
+                        default=None)
+
     args = parser.parse_args()
     main()